@@ -9,6 +9,9 @@ from . import resources
 from .models import (
 
     ConstantTable,
+    PointsBalance,
+    PointsEntry,
+    ServiceZone,
     User,
     VehicleRegistration,
     VehicleSettings,
@@ -119,7 +122,35 @@ class VehicleRegistrationResourceAdmin(ImportExportModelAdmin):
         return [field.name for field in self.model._meta.concrete_fields]
 
 
+class ServiceZoneResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.ServiceZoneResource
+
+    search_fields = ["name", "country_code"]
+    list_filter = ["kind", "is_active"]
+    list_display = ["name", "country_code", "kind", "priority", "fare_multiplier", "flat_fee", "is_active"]
+
+
+class PointsEntryResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.PointsEntryResource
+
+    search_fields = ["user__email", "campaign"]
+    list_filter = ["reason"]
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class PointsBalanceResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.PointsBalanceResource
+
+    search_fields = ["user__email"]
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
 admin.site.register(User, UserResourceAdmin)
 admin.site.register(ConstantTable, ConstantTableResourceAdmin)
 admin.site.register(VehicleSettings, VehicleSettingsResourceAdmin)
-admin.site.register(VehicleRegistration, VehicleRegistrationResourceAdmin)
\ No newline at end of file
+admin.site.register(VehicleRegistration, VehicleRegistrationResourceAdmin)
+admin.site.register(ServiceZone, ServiceZoneResourceAdmin)
+admin.site.register(PointsEntry, PointsEntryResourceAdmin)
+admin.site.register(PointsBalance, PointsBalanceResourceAdmin)
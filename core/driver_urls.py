@@ -4,4 +4,5 @@ from core import views
 urlpatterns = [
     path("signup/", views.DriverRegistrationAPIView.as_view(), name="driver_signup"),
     path("signin/", views.DriverSigninView.as_view(), name="driver_signin"),
+    path("heartbeat/", views.DriverHeartbeatAPIView.as_view(), name="driver_heartbeat"),
 ]
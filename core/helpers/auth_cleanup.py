@@ -0,0 +1,67 @@
+"""
+Purges spent authentication state: password reset tokens past their expiry
+(used or not) plus PASSWORD_RESET_TOKEN_RETENTION_HOURS, and OTP codes older
+than OTP_EXPIRY_MINUTES.
+
+Both walk an index from the oldest row (PasswordResetToken.expires_at, and a
+partial index on User.otp_created_at over users holding a code) and work in
+AUTH_PURGE_BATCH rows per statement. Each batch is its own short transaction,
+so locks and WAL per statement stay small, and the job sleeps
+AUTH_PURGE_PAUSE_SECONDS between batches to leave room for live traffic.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import PasswordResetToken, User
+
+logger = logging.getLogger(__name__)
+
+LAST_RUN_KEY = "auth_purge:last_run"
+
+
+def _in_batches(select, apply):
+    """Run `apply(ids)` over `select()` until a batch comes back short; returns the rows affected."""
+    total = 0
+    while True:
+        ids = list(select()[: settings.AUTH_PURGE_BATCH])
+        if ids:
+            total += apply(ids)
+        if len(ids) < settings.AUTH_PURGE_BATCH:
+            return total
+        time.sleep(settings.AUTH_PURGE_PAUSE_SECONDS)
+
+
+def purge_reset_tokens(now):
+    cutoff = now - timedelta(hours=settings.PASSWORD_RESET_TOKEN_RETENTION_HOURS)
+    return _in_batches(
+        lambda: PasswordResetToken.objects.filter(expires_at__lt=cutoff).order_by("expires_at").values_list("id", flat=True),
+        lambda ids: PasswordResetToken.objects.filter(id__in=ids).delete()[0],
+    )
+
+
+def clear_stale_otps(now):
+    cutoff = now - timedelta(minutes=settings.OTP_EXPIRY_MINUTES)
+    return _in_batches(
+        # Codes issued before otp_created_at existed have no timestamp and are stale by now.
+        lambda: User.objects.filter(Q(otp_created_at__lt=cutoff) | Q(otp_created_at__isnull=True), otp_code__isnull=False)
+        .order_by("otp_created_at")
+        .values_list("id", flat=True),
+        lambda ids: User.objects.filter(id__in=ids).update(otp_code=None, otp_created_at=None),
+    )
+
+
+def purge(now=None):
+    """One pass over both; returns the row counts, which are also logged and kept under LAST_RUN_KEY."""
+    now = now or timezone.now()
+    started = time.monotonic()
+    counts = {"reset_tokens": purge_reset_tokens(now), "otp_codes": clear_stale_otps(now)}
+    stats = {**counts, "finished_at": timezone.now().isoformat(), "seconds": round(time.monotonic() - started, 3)}
+    cache.set(LAST_RUN_KEY, stats, timeout=None)
+    logger.info(f"Auth state purge: {counts['reset_tokens']} reset tokens deleted, {counts['otp_codes']} OTP codes cleared")
+    return stats
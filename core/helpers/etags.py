@@ -0,0 +1,70 @@
+"""
+Strong ETags for the endpoints clients poll.
+
+Each view derives its tag from a version it can read without loading or
+serializing the object: the ride's version in the active-ride cache, the
+user's updated_at (already loaded by authentication), or one MAX/COUNT
+aggregate over a list's queryset. `not_modified` runs straight after
+authentication, so a repeat poll with a matching If-None-Match is answered
+with an empty 304 before the view does anything else.
+
+The tag also covers the negotiated renderer, as the JSON and MessagePack
+bodies of the same object differ, and the query string: `?fields=`,
+`?since=`, `?since_version=` and paging all change the body for the same
+version. core.middleware.CompressionMiddleware
+suffixes the tags of compressed bodies with their encoding; matching ignores
+that suffix.
+"""
+import hashlib
+
+from core.helpers import fieldsets
+
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def make(request, *parts):
+    """A strong ETag for the representation identified by `parts`."""
+    renderer = getattr(request, "accepted_renderer", None)
+    source = "|".join(str(part) for part in (*parts, getattr(renderer, "format", ""), _query(request)))
+    return quote_etag(hashlib.blake2b(source.encode(), digest_size=12).hexdigest())
+
+
+def _query(request):
+    """The query string in a canonical form; `?fields=` as a sorted set, so its order does not matter."""
+    params = []
+    for name, values in sorted(request.query_params.lists()):
+        if name == fieldsets.FIELDS_PARAM:
+            values = sorted(fieldsets.requested_fields(request) or ())
+        params.append(f"{name}={','.join(values)}")
+    return "&".join(params)
+
+
+def _base(tag):
+    tag = tag.removeprefix("W/")
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(f'{suffix}"'):
+            return f'{tag[: -len(suffix) - 1]}"'
+    return tag
+
+
+def not_modified(request, etag):
+    """An empty 304 when the request's If-None-Match names `etag`, otherwise None."""
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return None
+    for tag in parse_etags(header):
+        if tag == "*" or _base(tag) == etag:
+            # Echo the client's tag, which names the encoding it holds.
+            return tagged(Response(status=status.HTTP_304_NOT_MODIFIED), etag if tag == "*" else tag)
+    return None
+
+
+def tagged(response, etag):
+    response["ETag"] = etag
+    patch_vary_headers(response, ("Accept",))
+    return response
@@ -0,0 +1,74 @@
+"""
+Sparse fieldsets and delta responses for the endpoints mobile clients poll.
+
+`?fields=a,b,c` trims a response to the listed keys (plus the ones a client
+needs to identify the object). Serializers get it through SparseFieldsMixin,
+which drops the other fields before anything is computed; payloads that are
+already plain dicts, like the cached ride status, go through `select`.
+
+Delta mode lets a client say what it already has: `?since_version=<n>` on
+ride_status/ (the `version` of the last payload it saw) returns only the
+fields that changed since, and `?since=<updated_at>` on the profile and
+vehicle endpoints skips anything not updated after that timestamp. When
+nothing changed the answer is an empty 304.
+"""
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+FIELDS_PARAM = "fields"
+SINCE_PARAM = "since"
+SINCE_VERSION_PARAM = "since_version"
+
+
+def requested_fields(request):
+    """The set of names in `?fields=`, or None when the client wants everything."""
+    raw = request.query_params.get(FIELDS_PARAM) if request is not None else None
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(",") if name.strip()} or None
+
+
+def select(data, fields, keep=()):
+    """`data` restricted to `fields` and `keep`; all of it when `fields` is None."""
+    if fields is None:
+        return data
+    return {key: value for key, value in data.items() if key in fields or key in keep}
+
+
+def changed(old, new, keep=()):
+    """The keys of `new` whose values differ from `old`, plus `keep`."""
+    return {key: value for key, value in new.items() if key in keep or key not in old or old[key] != value}
+
+
+def _invalid(message):
+    from core.serializer import CustomSerializerError
+
+    return CustomSerializerError({"status": False, "message": message})
+
+
+def since(request):
+    """The `?since=` timestamp as an aware datetime, or None."""
+    raw = request.query_params.get(SINCE_PARAM)
+    if not raw:
+        return None
+    # An unescaped "+" in the UTC offset arrives as a space.
+    try:
+        value = parse_datetime(raw.strip().replace(" ", "+"))
+    except ValueError:
+        value = None
+    if value is None:
+        raise _invalid("since must be an ISO 8601 timestamp")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def since_version(request):
+    """The `?since_version=` counter, or None."""
+    raw = request.query_params.get(SINCE_VERSION_PARAM)
+    if not raw:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise _invalid("since_version must be an integer")
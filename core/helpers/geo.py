@@ -0,0 +1,125 @@
+"""
+Geographic helpers shared by the ride and pricing code.
+
+Cells are standard geohashes. Internally a cell is kept as its integer id
+(the interleaved lon/lat bits) so large batches of coordinates can be bucketed
+with numpy; `to_geohash` turns ids back into the familiar base32 strings.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: index for index, char in enumerate(BASE32)}
+_BASE32_CODES = np.frombuffer(BASE32.encode(), dtype=np.uint8)
+
+
+def _bit_split(precision):
+    bits = 5 * precision
+    return bits, (bits + 1) // 2, bits // 2
+
+
+def _interleave(lon_index, lat_index, precision):
+    bits, lon_bits, lat_bits = _bit_split(precision)
+    cell_id = 0
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - i // 2)) & 1
+        cell_id = (cell_id << 1) | bit
+    return cell_id
+
+
+def _id_to_geohash(cell_id, precision):
+    return "".join(BASE32[(cell_id >> 5 * (precision - 1 - k)) & 31] for k in range(precision))
+
+
+def encode(latitude, longitude, precision=6):
+    """Return the geohash of a single coordinate."""
+    bits, lon_bits, lat_bits = _bit_split(precision)
+    lon_index = min(max(int((longitude + 180.0) / 360.0 * (1 << lon_bits)), 0), (1 << lon_bits) - 1)
+    lat_index = min(max(int((latitude + 90.0) / 180.0 * (1 << lat_bits)), 0), (1 << lat_bits) - 1)
+    return _id_to_geohash(_interleave(lon_index, lat_index, precision), precision)
+
+
+def geohash_to_id(geohash):
+    cell_id = 0
+    for char in geohash:
+        cell_id = (cell_id << 5) | _BASE32_INDEX[char]
+    return cell_id
+
+
+def neighbors(geohash):
+    """The geohash and its (up to) eight surrounding cells."""
+    precision = len(geohash)
+    bits, lon_bits, lat_bits = _bit_split(precision)
+    cell_id = geohash_to_id(geohash)
+    lon_index = lat_index = 0
+    for i in range(bits):
+        bit = (cell_id >> (bits - 1 - i)) & 1
+        if i % 2 == 0:
+            lon_index = (lon_index << 1) | bit
+        else:
+            lat_index = (lat_index << 1) | bit
+    cells = []
+    for lat_step in (-1, 0, 1):
+        row = lat_index + lat_step
+        if not 0 <= row < (1 << lat_bits):
+            continue
+        for lon_step in (-1, 0, 1):
+            column = (lon_index + lon_step) % (1 << lon_bits)
+            cells.append(_id_to_geohash(_interleave(column, row, precision), precision))
+    return cells
+
+
+def cell_ids(latitudes, longitudes, precision=6):
+    """Vectorized geohash encoding, returning integer cell ids."""
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    bits, lon_bits, lat_bits = _bit_split(precision)
+    lon_index = np.clip(
+        ((longitudes + 180.0) / 360.0 * (1 << lon_bits)).astype(np.int64), 0, (1 << lon_bits) - 1
+    )
+    lat_index = np.clip(
+        ((latitudes + 90.0) / 180.0 * (1 << lat_bits)).astype(np.int64), 0, (1 << lat_bits) - 1
+    )
+    ids = np.zeros(np.broadcast(latitudes, longitudes).shape, dtype=np.int64)
+    for i in range(bits):
+        if i % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - i // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - i // 2)) & 1
+        ids = (ids << 1) | bit
+    return ids
+
+
+def to_geohash(ids, precision=6):
+    """Convert integer cell ids back to geohash strings."""
+    ids = np.atleast_1d(np.asarray(ids, dtype=np.int64))
+    shifts = 5 * np.arange(precision - 1, -1, -1, dtype=np.int64)
+    codes = _BASE32_CODES[(ids[:, None] >> shifts) & 31]
+    return [raw.decode() for raw in np.ascontiguousarray(codes).view(f"S{precision}").ravel()]
+
+
+def cell_centroids(ids, precision=6):
+    """Return (latitudes, longitudes) of the centre of each cell id."""
+    ids = np.asarray(ids, dtype=np.int64)
+    bits, lon_bits, lat_bits = _bit_split(precision)
+    lon_index = np.zeros_like(ids)
+    lat_index = np.zeros_like(ids)
+    for i in range(bits):
+        bit = (ids >> (bits - 1 - i)) & 1
+        if i % 2 == 0:
+            lon_index = (lon_index << 1) | bit
+        else:
+            lat_index = (lat_index << 1) | bit
+    latitudes = (lat_index + 0.5) * (180.0 / (1 << lat_bits)) - 90.0
+    longitudes = (lon_index + 0.5) * (360.0 / (1 << lon_bits)) - 180.0
+    return latitudes, longitudes
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres; broadcasts over numpy arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=np.float64)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
@@ -0,0 +1,166 @@
+"""
+Offline reverse geocoding against a local gazetteer.
+
+`build` turns address points into an implicit k-d tree: the points (as unit
+vectors, so straight-line nearest is great-circle nearest) are reordered so that
+every index range [lo, hi) is a node whose median sits at (lo + hi) // 2, with
+the split axis stored alongside. No pointers are needed, so the tree is three
+flat files that `load` memory-maps; processes share the pages and start
+instantly regardless of the gazetteer size.
+
+Labels are a UTF-8 blob plus an offsets array, also memory-mapped.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from core.helpers.geo import EARTH_RADIUS_KM
+
+LEAF_SIZE = 32
+FILES = ("points.npy", "axes.npy", "offsets.npy", "labels.bin", "manifest.json")
+
+_lock = threading.Lock()
+_geocoder = None
+_loaded = False
+
+
+def to_unit_vectors(latitudes, longitudes):
+    latitudes = np.radians(np.asarray(latitudes, dtype=np.float64))
+    longitudes = np.radians(np.asarray(longitudes, dtype=np.float64))
+    return np.stack(
+        [np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes), np.sin(latitudes)], axis=-1
+    )
+
+
+def chord_to_km(chord):
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.asarray(chord) / 2.0, 1.0))
+
+
+def km_to_chord(km):
+    return 2.0 * np.sin(km / (2.0 * EARTH_RADIUS_KM))
+
+
+def build(latitudes, longitudes, labels, directory):
+    """Write the tree for the given address points into `directory`."""
+    points = to_unit_vectors(latitudes, longitudes)
+    order = np.arange(len(points))
+    axes = np.zeros(len(points), dtype=np.int8)
+
+    stack = [(0, len(points))]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo <= LEAF_SIZE:
+            continue
+        mid = (lo + hi) // 2
+        block = points[order[lo:hi]]
+        axis = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+        order[lo:hi] = order[lo:hi][np.argpartition(block[:, axis], mid - lo)]
+        axes[mid] = axis
+        stack.extend([(lo, mid), (mid + 1, hi)])
+
+    encoded = [str(labels[index]).encode() for index in order]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(label) for label in encoded])
+
+    os.makedirs(directory, exist_ok=True)
+    staged = {name: os.path.join(directory, f".{name}.tmp") for name in FILES}
+    with open(staged["points.npy"], "wb") as handle:
+        np.save(handle, points[order].astype(np.float32))
+    with open(staged["axes.npy"], "wb") as handle:
+        np.save(handle, axes)
+    with open(staged["offsets.npy"], "wb") as handle:
+        np.save(handle, offsets)
+    with open(staged["labels.bin"], "wb") as handle:
+        handle.write(b"".join(encoded))
+    with open(staged["manifest.json"], "w") as handle:
+        json.dump({"points": len(points), "leaf_size": LEAF_SIZE}, handle)
+    # Readers that already mapped the old files keep them until they reload.
+    for name, path in staged.items():
+        os.replace(path, os.path.join(directory, name))
+    return len(points)
+
+
+class Geocoder:
+    def __init__(self, directory):
+        # Plain ndarray views over the maps avoid np.memmap's per-access overhead.
+        self.points = np.asarray(np.load(os.path.join(directory, "points.npy"), mmap_mode="r"))
+        self.axes = np.asarray(np.load(os.path.join(directory, "axes.npy"), mmap_mode="r"))
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        labels_path = os.path.join(directory, "labels.bin")
+        self.labels = np.memmap(labels_path, dtype=np.uint8, mode="r") if os.path.getsize(labels_path) else b""
+        with open(os.path.join(directory, "manifest.json")) as handle:
+            self.leaf_size = json.load(handle)["leaf_size"]
+
+    def __len__(self):
+        return len(self.points)
+
+    def label(self, index):
+        return bytes(self.labels[self.offsets[index] : self.offsets[index + 1]]).decode()
+
+    def nearest(self, latitude, longitude, max_km=None):
+        """(label, distance_km) of the closest address point, or None beyond `max_km`."""
+        if not len(self.points):
+            return None
+        query = to_unit_vectors(latitude, longitude)
+        coordinates = query.tolist()
+        points, axes = self.points, self.axes
+        best_index = -1
+        best = float(km_to_chord(max_km)) ** 2 if max_km is not None else np.inf
+
+        stack = [(0, len(self.points), 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if bound >= best:
+                continue
+            if hi - lo <= self.leaf_size:
+                distances = ((points[lo:hi] - query) ** 2).sum(axis=1)
+                position = int(distances.argmin())
+                if distances[position] < best:
+                    best, best_index = float(distances[position]), lo + position
+                continue
+            mid = (lo + hi) // 2
+            x, y, z = points[mid].tolist()
+            distance = (x - coordinates[0]) ** 2 + (y - coordinates[1]) ** 2 + (z - coordinates[2]) ** 2
+            if distance < best:
+                best, best_index = distance, mid
+            axis = int(axes[mid])
+            gap = coordinates[axis] - (x, y, z)[axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if gap < 0 else ((mid + 1, hi), (lo, mid))
+            # The far side is only worth visiting if the splitting plane is closer than the best so far.
+            stack.append((far[0], far[1], max(bound, gap * gap)))
+            stack.append((near[0], near[1], bound))
+        if best_index < 0:
+            return None
+        return self.label(best_index), float(chord_to_km(np.sqrt(best)))
+
+
+def get_geocoder():
+    """The process-wide geocoder, or None when no gazetteer has been built."""
+    global _geocoder, _loaded
+    if not _loaded:
+        with _lock:
+            if not _loaded:
+                directory = settings.GEOCODER_DATA_DIR
+                if os.path.exists(os.path.join(directory, "manifest.json")):
+                    _geocoder = Geocoder(directory)
+                _loaded = True
+    return _geocoder
+
+
+def reload():
+    global _loaded
+    with _lock:
+        _loaded = False
+    return get_geocoder()
+
+
+def reverse(latitude, longitude):
+    """Nearest address label within GEOCODER_MAX_DISTANCE_KM, or None."""
+    geocoder = get_geocoder()
+    if geocoder is None or latitude is None or longitude is None:
+        return None
+    found = geocoder.nearest(latitude, longitude, settings.GEOCODER_MAX_DISTANCE_KM)
+    return found[0] if found else None
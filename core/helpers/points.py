@@ -0,0 +1,116 @@
+"""
+Loyalty points: an append-only ledger (PointsEntry) and a folded balance
+(PointsBalance).
+
+A user's spendable points are their PointsBalance plus the ledger entries
+after its `position`, a short range read on the (user, id) index. Credits,
+whether a ride end or a promotion for millions of users, only INSERT entries,
+so they lock nothing and never wait on each other. Only spending locks
+anything: a redemption takes the user's own balance row FOR UPDATE before it
+reads what it may spend, so two rides ending at once cannot both spend the
+same points.
+
+`fold_points_ledger` folds settled entries into the balances a batch at a
+time: one grouped SUM over an id range and one bulk UPDATE of the affected
+balances, with the progress kept in a ProjectionCheckpoint. As with the ride
+event projections, ids are handed out on INSERT and not on commit, so only
+entries older than POINTS_FOLD_LAG_SECONDS are folded, and a batch stops at
+the first entry that is not: no position ever moves past an entry that has
+yet to be folded.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.models import PointsBalance, PointsEntry
+from ride.models import ProjectionCheckpoint
+
+FOLD_CHECKPOINT = "points_balance"
+
+
+def balance(user_id, for_update=False):
+    """Spendable points; with `for_update`, also lock them against other redemptions until commit."""
+    if for_update:
+        row, _ = PointsBalance.objects.select_for_update().get_or_create(user_id=user_id)
+    else:
+        row = PointsBalance.objects.filter(user_id=user_id).first()
+    folded, position = (row.balance, row.position) if row else (0, 0)
+    tail = PointsEntry.objects.filter(user_id=user_id, id__gt=position).aggregate(total=Sum("amount"))["total"]
+    return folded + (tail or 0)
+
+
+def settle_ride(ride, redeemed, earned):
+    """Write a ride's redemption and earning; call in its ride-end transaction, after `balance(..., for_update=True)`."""
+    entries = []
+    if redeemed:
+        entries.append(PointsEntry(user_id=ride.user_id, amount=-redeemed, reason="RIDE_REDEEM", ride_id=ride.pk))
+    if earned:
+        entries.append(PointsEntry(user_id=ride.user_id, amount=earned, reason="RIDE_EARN", ride_id=ride.pk))
+    PointsEntry.objects.bulk_create(entries)
+
+
+def credit_campaign(campaign, amount, users, batch_size):
+    """Credit `amount` points once per user of the `users` queryset, `batch_size` users per INSERT; returns how many were credited."""
+    pending = users.exclude(points_entries__campaign=campaign).order_by("pk").values_list("pk", flat=True)
+    credited, after = 0, None
+    while True:
+        ids = list((pending if after is None else pending.filter(pk__gt=after))[:batch_size])
+        if not ids:
+            return credited
+        # The (user, campaign) constraint keeps an overlapping run from crediting anyone twice.
+        PointsEntry.objects.bulk_create(
+            [PointsEntry(user_id=user_id, amount=amount, reason="PROMOTION", campaign=campaign) for user_id in ids],
+            ignore_conflicts=True,
+        )
+        credited += len(ids)
+        after = ids[-1]
+
+
+def fold(now=None):
+    """Fold the next batch of settled entries into the balances; returns how many entries it folded."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.POINTS_FOLD_LAG_SECONDS)
+    with transaction.atomic():
+        checkpoint, _ = ProjectionCheckpoint.objects.select_for_update().get_or_create(name=FOLD_CHECKPOINT)
+        ids = []
+        for entry_id, created_at in (
+            PointsEntry.objects.filter(id__gt=checkpoint.position)
+            .order_by("id")
+            .values_list("id", "created_at")[: settings.POINTS_FOLD_BATCH]
+        ):
+            if created_at > cutoff:
+                break
+            ids.append(entry_id)
+        if not ids:
+            return 0
+        totals = dict(
+            PointsEntry.objects.filter(id__gt=checkpoint.position, id__lte=ids[-1])
+            .order_by()
+            .values("user_id")
+            .annotate(total=Sum("amount"))
+            .values_list("user_id", "total")
+        )
+        # Users' first balance rows; a redemption may be creating one right now.
+        PointsBalance.objects.bulk_create([PointsBalance(user_id=user_id) for user_id in totals], ignore_conflicts=True)
+        rows = list(PointsBalance.objects.select_for_update().filter(user_id__in=totals).order_by("user_id"))
+        for row in rows:
+            row.balance += totals[row.user_id]
+            row.position = ids[-1]
+            row.updated_at = now
+        PointsBalance.objects.bulk_update(rows, ["balance", "position", "updated_at"])
+        checkpoint.position = ids[-1]
+        checkpoint.save(update_fields=["position", "updated_at"])
+    return len(ids)
+
+
+def catch_up(now=None):
+    """Fold until every settled entry is in the balances; returns how many entries were folded."""
+    folded = 0
+    while True:
+        count = fold(now)
+        folded += count
+        if count < settings.POINTS_FOLD_BATCH:
+            return folded
@@ -0,0 +1,302 @@
+"""
+Driver presence from app heartbeats.
+
+A driver is online while their last heartbeat is younger than
+PRESENCE_TTL_SECONDS. With REDIS_URL set, presence lives in Redis sorted sets
+scored by expiry time: one for all drivers, one per service area and one per
+geohash cell (PRESENCE_CELL_PRECISION), plus a small hash per driver with
+their position and vehicle. "Is online" is a ZSCORE (O(1)) and "online in
+region" a ZRANGEBYSCORE (O(log n + m)); expired members are simply out of the
+score range until `expire` removes them.
+
+Without Redis an in-process timing wheel does the same job. It only sees the
+heartbeats of its own process, so it is meant for development and
+single-process deployments.
+
+The VehicleRegistration.vehicle_status column follows presence through the
+`sync_driver_presence` command.
+"""
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from core.helpers import geo
+
+ONLINE_KEY = "presence:online"
+AREA_KEY = "presence:area:{area}"
+CELL_KEY = "presence:cell:{cell}"
+DRIVER_KEY = "presence:driver:{driver}"
+RECORD_FIELDS = ("vehicle", "ride_type", "vehicle_type", "area", "cell", "latitude", "longitude")
+
+
+def _record(driver, vehicle, ride_type, vehicle_type, area, cell, latitude, longitude, expires_at):
+    return {
+        "driver": driver,
+        "vehicle": vehicle,
+        "ride_type": ride_type,
+        "vehicle_type": vehicle_type,
+        "area": area,
+        "cell": cell,
+        "latitude": latitude,
+        "longitude": longitude,
+        "expires_at": expires_at,
+    }
+
+
+class RedisPresence:
+    def __init__(self):
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection("default")
+
+    def heartbeat(self, record):
+        self.heartbeat_many([record])
+
+    def heartbeat_many(self, records):
+        # Two round trips for the whole batch: read the old places, then write.
+        places = self.redis.pipeline(transaction=False)
+        for record in records:
+            places.hmget(DRIVER_KEY.format(driver=record["driver"]), "area", "cell")
+        pipe = self.redis.pipeline(transaction=False)
+        for record, (old_area, old_cell) in zip(records, places.execute()):
+            driver = record["driver"]
+            if old_area and old_area.decode() != str(record["area"]):
+                pipe.zrem(AREA_KEY.format(area=old_area.decode()), driver)
+            if old_cell and old_cell.decode() != record["cell"]:
+                pipe.zrem(CELL_KEY.format(cell=old_cell.decode()), driver)
+            member = {driver: record["expires_at"]}
+            pipe.zadd(ONLINE_KEY, member)
+            pipe.zadd(AREA_KEY.format(area=record["area"]), member)
+            pipe.zadd(CELL_KEY.format(cell=record["cell"]), member)
+            key = DRIVER_KEY.format(driver=driver)
+            pipe.hset(key, mapping={field: "" if record[field] is None else str(record[field]) for field in RECORD_FIELDS})
+            pipe.expire(key, settings.PRESENCE_TTL_SECONDS * 2)
+        pipe.execute()
+
+    def go_offline(self, driver):
+        key = DRIVER_KEY.format(driver=driver)
+        area, cell = self.redis.hmget(key, "area", "cell")
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrem(ONLINE_KEY, driver)
+        if area:
+            pipe.zrem(AREA_KEY.format(area=area.decode()), driver)
+        if cell:
+            pipe.zrem(CELL_KEY.format(cell=cell.decode()), driver)
+        pipe.delete(key)
+        pipe.execute()
+
+    def is_online(self, driver):
+        expires_at = self.redis.zscore(ONLINE_KEY, driver)
+        return expires_at is not None and expires_at > time.time()
+
+    def _members(self, keys):
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrangebyscore(key, now, "+inf")
+        return [member.decode() for members in pipe.execute() for member in members]
+
+    def online(self):
+        return self._members([ONLINE_KEY])
+
+    def online_in_area(self, area):
+        return self._members([AREA_KEY.format(area=area)])
+
+    def online_in_cells(self, cells):
+        return self._members([CELL_KEY.format(cell=cell) for cell in cells])
+
+    def records(self, drivers):
+        pipe = self.redis.pipeline(transaction=False)
+        for driver in drivers:
+            pipe.hmget(DRIVER_KEY.format(driver=driver), *RECORD_FIELDS)
+        records = {}
+        for driver, values in zip(drivers, pipe.execute()):
+            if values[0] is None:
+                continue
+            values = dict(zip(RECORD_FIELDS, (value.decode() if value else None for value in values)))
+            records[driver] = _record(
+                driver,
+                values["vehicle"],
+                values["ride_type"],
+                values["vehicle_type"],
+                values["area"],
+                values["cell"],
+                float(values["latitude"]),
+                float(values["longitude"]),
+                None,
+            )
+        return records
+
+    def expire(self):
+        now = time.time()
+        expired = [member.decode() for member in self.redis.zrangebyscore(ONLINE_KEY, "-inf", now)]
+        if expired:
+            places = self.redis.pipeline(transaction=False)
+            for driver in expired:
+                places.hmget(DRIVER_KEY.format(driver=driver), "area", "cell")
+            pipe = self.redis.pipeline(transaction=False)
+            for driver, (area, cell) in zip(expired, places.execute()):
+                if area:
+                    pipe.zrem(AREA_KEY.format(area=area.decode()), driver)
+                if cell:
+                    pipe.zrem(CELL_KEY.format(cell=cell.decode()), driver)
+            pipe.zremrangebyscore(ONLINE_KEY, "-inf", now)
+            pipe.execute()
+        return expired
+
+
+class LocalPresence:
+    """Timing wheel of one-second slots; each slot holds the drivers expiring in it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.slot_seconds = settings.PRESENCE_WHEEL_SLOT_SECONDS
+        self.wheel = [set() for _ in range(math.ceil(settings.PRESENCE_TTL_SECONDS / self.slot_seconds) + 2)]
+        self.records_by_driver = {}
+        self.areas = {}
+        self.cells = {}
+        self.cursor = int(time.time() / self.slot_seconds)
+        self.expired = []
+
+    def _slot(self, expires_at):
+        return self.wheel[int(expires_at / self.slot_seconds) % len(self.wheel)]
+
+    def _remove(self, driver):
+        record = self.records_by_driver.pop(driver, None)
+        if record is None:
+            return
+        self._slot(record["expires_at"]).discard(driver)
+        self.areas.get(record["area"], set()).discard(driver)
+        self.cells.get(record["cell"], set()).discard(driver)
+
+    def _advance(self, now):
+        tick = int(now / self.slot_seconds)
+        # A full turn covers every slot, so a long idle gap costs at most one sweep.
+        for step in range(max(self.cursor, tick - len(self.wheel)) + 1, tick + 1):
+            for driver in list(self.wheel[step % len(self.wheel)]):
+                if self.records_by_driver[driver]["expires_at"] <= now:
+                    self._remove(driver)
+                    self.expired.append(driver)
+        self.cursor = max(self.cursor, tick)
+
+    def heartbeat(self, record):
+        self.heartbeat_many([record])
+
+    def heartbeat_many(self, records):
+        with self.lock:
+            self._advance(time.time())
+            for record in records:
+                self._remove(record["driver"])
+                self.records_by_driver[record["driver"]] = record
+                self._slot(record["expires_at"]).add(record["driver"])
+                self.areas.setdefault(record["area"], set()).add(record["driver"])
+                self.cells.setdefault(record["cell"], set()).add(record["driver"])
+
+    def go_offline(self, driver):
+        with self.lock:
+            self._remove(driver)
+
+    def is_online(self, driver):
+        record = self.records_by_driver.get(driver)
+        return record is not None and record["expires_at"] > time.time()
+
+    def _live(self, select):
+        now = time.time()
+        with self.lock:
+            self._advance(now)
+            return [driver for driver in select() if self.records_by_driver[driver]["expires_at"] > now]
+
+    def online(self):
+        return self._live(lambda: list(self.records_by_driver))
+
+    def online_in_area(self, area):
+        return self._live(lambda: list(self.areas.get(area, ())))
+
+    def online_in_cells(self, cells):
+        return self._live(lambda: [driver for cell in cells for driver in self.cells.get(cell, ())])
+
+    def records(self, drivers):
+        with self.lock:
+            return {driver: self.records_by_driver[driver] for driver in drivers if driver in self.records_by_driver}
+
+    def expire(self):
+        with self.lock:
+            self._advance(time.time())
+            expired, self.expired = self.expired, []
+        return expired
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = RedisPresence() if settings.REDIS_URL else LocalPresence()
+    return _backend
+
+
+def _heartbeat_record(driver_id, latitude, longitude, area=None, vehicle_id=None, ride_type=None, vehicle_type=None):
+    return _record(
+        str(driver_id),
+        None if vehicle_id is None else str(vehicle_id),
+        ride_type,
+        vehicle_type,
+        area,
+        geo.encode(latitude, longitude, settings.PRESENCE_CELL_PRECISION),
+        latitude,
+        longitude,
+        time.time() + settings.PRESENCE_TTL_SECONDS,
+    )
+
+
+def heartbeat(driver_id, latitude, longitude, area=None, vehicle_id=None, ride_type=None, vehicle_type=None):
+    backend().heartbeat(_heartbeat_record(driver_id, latitude, longitude, area, vehicle_id, ride_type, vehicle_type))
+
+
+def heartbeat_many(heartbeats):
+    """`heartbeat` for many drivers at once; takes dicts of heartbeat's arguments."""
+    if heartbeats:
+        backend().heartbeat_many([_heartbeat_record(**entry) for entry in heartbeats])
+
+
+def go_offline(driver_id):
+    backend().go_offline(str(driver_id))
+
+
+def is_online(driver_id):
+    return backend().is_online(str(driver_id))
+
+
+def online():
+    """Every online driver id."""
+    return backend().online()
+
+
+def online_in_area(area):
+    return backend().online_in_area(area)
+
+
+def online_near(latitude, longitude):
+    """Online drivers in the pickup's cell and the eight around it."""
+    cell = geo.encode(latitude, longitude, settings.PRESENCE_CELL_PRECISION)
+    return backend().online_in_cells(geo.neighbors(cell))
+
+
+def records(driver_ids):
+    """Latest heartbeat (position and vehicle) of each driver, keyed by driver id."""
+    return backend().records([str(driver_id) for driver_id in driver_ids])
+
+
+def record(driver_id):
+    return records([driver_id]).get(str(driver_id))
+
+
+def expire():
+    """Forget drivers whose heartbeat timed out; returns their ids."""
+    return backend().expire()
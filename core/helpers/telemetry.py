@@ -0,0 +1,158 @@
+"""
+Driver telemetry received over MQTT (see the `run_telemetry_gateway` command).
+
+Driver apps publish to MQTT_TELEMETRY_TOPIC with their user id in place of
+the `+`, e.g. qglide/drivers/<driver id>/telemetry; the broker's ACL is what
+restricts each driver to their own topic. A payload is a MessagePack array
+
+    [latitude, longitude, is_online, is_available, sent_at]
+
+with sent_at (unix seconds) optional. It carries the same state as the
+heartbeat endpoint, so a ping is a few dozen bytes instead of an HTTPS
+request.
+
+The MQTT network thread only decodes and validates (`decode`) and keeps the
+latest message per driver in a TelemetryBatch. The gateway's main thread
+drains that batch every MQTT_FLUSH_SECONDS and `apply`s it to the presence
+store in bulk: a driver pinging ten times a second costs one presence write
+per flush.
+"""
+import math
+import threading
+import time
+import uuid
+
+import msgpack
+from django.conf import settings
+
+from core.helpers import presence
+from core.models import VehicleRegistration
+from ride.helpers import surge
+
+
+class InvalidTelemetry(ValueError):
+    pass
+
+
+def topic_filter():
+    """The subscription: a shared one when MQTT_SHARED_GROUP is set, so gateway processes split the drivers."""
+    if settings.MQTT_SHARED_GROUP:
+        return f"$share/{settings.MQTT_SHARED_GROUP}/{settings.MQTT_TELEMETRY_TOPIC}"
+    return settings.MQTT_TELEMETRY_TOPIC
+
+
+def _driver_from_topic(topic):
+    levels = topic.split("/")
+    pattern = settings.MQTT_TELEMETRY_TOPIC.split("/")
+    if len(levels) != len(pattern):
+        raise InvalidTelemetry(f"unexpected topic {topic}")
+    try:
+        return str(uuid.UUID(levels[pattern.index("+")]))
+    except ValueError:
+        raise InvalidTelemetry(f"no driver id in topic {topic}")
+
+
+def _coordinate(value, limit):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or abs(value) > limit:
+        raise InvalidTelemetry(f"invalid coordinate {value!r}")
+    return float(value)
+
+
+def decode(topic, payload, now=None):
+    """(driver id, message) for one MQTT message; raises InvalidTelemetry for anything malformed or stale."""
+    driver = _driver_from_topic(topic)
+    try:
+        fields = msgpack.unpackb(payload, raw=False)
+    except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as exc:
+        raise InvalidTelemetry(f"undecodable payload: {exc}")
+    if not isinstance(fields, list) or len(fields) not in (4, 5):
+        raise InvalidTelemetry("payload must be [latitude, longitude, is_online, is_available, sent_at]")
+    if not isinstance(fields[2], bool) or not isinstance(fields[3], bool):
+        raise InvalidTelemetry("is_online and is_available must be booleans")
+    sent_at = fields[4] if len(fields) == 5 else None
+    if sent_at is not None:
+        if isinstance(sent_at, bool) or not isinstance(sent_at, (int, float)):
+            raise InvalidTelemetry(f"invalid sent_at {sent_at!r}")
+        # A ping older than the presence TTL would bring a driver back online after they timed out.
+        if (now or time.time()) - sent_at > settings.PRESENCE_TTL_SECONDS:
+            raise InvalidTelemetry("stale message")
+    return driver, {
+        "latitude": _coordinate(fields[0], 90),
+        "longitude": _coordinate(fields[1], 180),
+        "is_online": fields[2],
+        "is_available": fields[3],
+        "sent_at": sent_at,
+    }
+
+
+class TelemetryBatch:
+    """Latest message per driver since the last drain; safe to fill from the MQTT thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = {}
+
+    def add(self, driver, message):
+        with self.lock:
+            previous = self.messages.get(driver)
+            # QoS 0 gives no ordering guarantee across reconnects; keep the newest by sent_at.
+            if previous is None or message["sent_at"] is None or (previous["sent_at"] or 0) <= message["sent_at"]:
+                self.messages[driver] = message
+
+    def drain(self):
+        with self.lock:
+            messages, self.messages = self.messages, {}
+        return messages
+
+
+def _vehicles(drivers):
+    """(area, vehicle id, ride type, vehicle type) per driver, from presence or one query for the rest."""
+    known = {
+        driver: (record["area"], record["vehicle"], record["ride_type"], record["vehicle_type"])
+        for driver, record in presence.records(drivers).items()
+        if record["vehicle"]
+    }
+    missing = [driver for driver in drivers if driver not in known]
+    if missing:
+        rows = (
+            VehicleRegistration.objects.filter(user_id__in=missing, is_active=True, is_deleted=False)
+            .order_by("user_id", "-created_at")
+            .values_list("user_id", "user__country_code", "id", "vehichle_type__ride_type", "vehichle_type__vehicle_type")
+        )
+        for user_id, area, vehicle_id, ride_type, vehicle_type in rows:
+            known.setdefault(str(user_id), (area, vehicle_id, ride_type, vehicle_type))
+    return known
+
+
+def apply(messages):
+    """Write a drained batch to the presence store; returns (applied, rejected) driver counts."""
+    offline = [driver for driver, message in messages.items() if not message["is_online"]]
+    for driver in offline:
+        presence.go_offline(driver)
+
+    online = {driver: message for driver, message in messages.items() if message["is_online"]}
+    vehicles = _vehicles(list(online)) if online else {}
+    heartbeats = []
+    for driver, message in online.items():
+        if driver not in vehicles:
+            # No active vehicle, as the heartbeat endpoint's 403.
+            continue
+        area, vehicle_id, ride_type, vehicle_type = vehicles[driver]
+        heartbeats.append(
+            {
+                "driver_id": driver,
+                "latitude": message["latitude"],
+                "longitude": message["longitude"],
+                "area": area,
+                "vehicle_id": vehicle_id,
+                "ride_type": ride_type,
+                "vehicle_type": vehicle_type,
+            }
+        )
+    presence.heartbeat_many(heartbeats)
+    surge.record_supply_many(
+        (entry["driver_id"], entry["latitude"], entry["longitude"])
+        for entry in heartbeats
+        if online[entry["driver_id"]]["is_available"]
+    )
+    return len(offline) + len(heartbeats), len(online) - len(heartbeats)
@@ -0,0 +1,188 @@
+"""
+Point-in-zone lookups over `ServiceZone` polygons.
+
+Every process keeps the active zones in a Sort-Tile-Recursive (STR) packed
+R-tree of polygon bounding boxes, stored level by level as numpy arrays, so a
+lookup only walks the handful of nodes whose boxes contain the point and then
+runs an even-odd ray cast over the edges of the few candidate polygons.
+
+Zone edits bump a version key in the shared cache (see core/signals.py); each
+process checks it at most every ZONE_INDEX_CHECK_SECONDS and rebuilds its tree
+when it changed.
+"""
+import math
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from core.models import ServiceZone
+
+VERSION_KEY = "zones:version"
+NODE_CAPACITY = 16
+
+_index = None
+_version = None
+_checked_at = 0.0
+
+
+class ZoneGeometryError(ValueError):
+    pass
+
+
+def polygons(geometry):
+    """The rings of each polygon of a GeoJSON geometry (or Feature)."""
+    if geometry.get("type") == "Feature":
+        geometry = geometry.get("geometry") or {}
+    kind, coordinates = geometry.get("type"), geometry.get("coordinates")
+    if kind == "Polygon":
+        parts = [coordinates]
+    elif kind == "MultiPolygon":
+        parts = coordinates
+    else:
+        raise ZoneGeometryError(f"Unsupported geometry type {kind!r}; expected Polygon or MultiPolygon")
+    for rings in parts:
+        if not rings or any(len(ring) < 4 for ring in rings):
+            raise ZoneGeometryError("Polygon rings need at least four positions")
+    return parts
+
+
+class Polygon:
+    """An outer ring and its holes, kept as flat edge arrays."""
+
+    def __init__(self, rings):
+        edges = []
+        for ring in rings:
+            ring = np.asarray(ring, dtype=np.float64)[:, :2]
+            if not np.array_equal(ring[0], ring[-1]):
+                ring = np.vstack([ring, ring[:1]])
+            edges.append(np.hstack([ring[:-1], ring[1:]]))
+        self.x1, self.y1, self.x2, self.y2 = np.vstack(edges).T
+        outer = np.asarray(rings[0], dtype=np.float64)
+        self.bbox = (outer[:, 0].min(), outer[:, 1].min(), outer[:, 0].max(), outer[:, 1].max())
+
+    def contains(self, longitude, latitude):
+        # Even-odd over every ring, so points inside a hole count as outside.
+        crosses = (self.y1 > latitude) != (self.y2 > latitude)
+        rise = np.where(crosses, self.y2 - self.y1, 1.0)
+        x_at = self.x1 + (latitude - self.y1) * (self.x2 - self.x1) / rise
+        return bool(np.count_nonzero(crosses & (longitude < x_at)) % 2)
+
+
+class STRtree:
+    """Static R-tree over (minx, miny, maxx, maxy) boxes, packed with STR."""
+
+    def __init__(self, boxes, node_capacity=NODE_CAPACITY):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.node_capacity = node_capacity
+        self.order = self._str_order(boxes)
+        self.levels = [boxes[self.order]]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            starts = np.arange(0, len(level), node_capacity)
+            self.levels.append(
+                np.column_stack(
+                    [
+                        np.minimum.reduceat(level[:, 0], starts),
+                        np.minimum.reduceat(level[:, 1], starts),
+                        np.maximum.reduceat(level[:, 2], starts),
+                        np.maximum.reduceat(level[:, 3], starts),
+                    ]
+                )
+            )
+
+    def _str_order(self, boxes):
+        count = len(boxes)
+        if not count:
+            return np.array([], dtype=np.intp)
+        centre_x = (boxes[:, 0] + boxes[:, 2]) / 2
+        centre_y = (boxes[:, 1] + boxes[:, 3]) / 2
+        slice_size = self.node_capacity * math.ceil(math.sqrt(math.ceil(count / self.node_capacity)))
+        by_x = np.argsort(centre_x, kind="stable")
+        return np.concatenate(
+            [
+                chunk[np.argsort(centre_y[chunk], kind="stable")]
+                for chunk in np.array_split(by_x, range(slice_size, count, slice_size))
+            ]
+        )
+
+    def query(self, x, y):
+        """Indexes of the input boxes that contain (x, y)."""
+        if not len(self.order):
+            return self.order
+        nodes = np.zeros(1, dtype=np.intp)
+        for depth in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[depth]
+            if depth < len(self.levels) - 1:
+                nodes = (nodes[:, None] * self.node_capacity + np.arange(self.node_capacity)).ravel()
+                nodes = nodes[nodes < len(level)]
+            boxes = level[nodes]
+            nodes = nodes[(boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3])]
+            if not len(nodes):
+                break
+        return self.order[nodes]
+
+
+class ZoneIndex:
+    def __init__(self, zones):
+        self.polygons = []
+        self.owners = []
+        for zone in zones:
+            for rings in polygons(zone.geometry):
+                self.polygons.append(Polygon(rings))
+                self.owners.append(zone)
+        self.tree = STRtree([polygon.bbox for polygon in self.polygons])
+        self.service_countries = {zone.country_code for zone in self.owners if zone.kind == "SERVICE_AREA"}
+
+    def locate(self, latitude, longitude, country_code=None, kind=None):
+        """Zones containing the point, highest priority first."""
+        found = {}
+        for index in self.tree.query(longitude, latitude):
+            zone = self.owners[index]
+            if zone.id in found or (kind and zone.kind != kind):
+                continue
+            if country_code and zone.country_code not in (None, "", country_code):
+                continue
+            if self.polygons[index].contains(longitude, latitude):
+                found[zone.id] = zone
+        return sorted(found.values(), key=lambda zone: -zone.priority)
+
+
+def get_index():
+    global _index, _version, _checked_at
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < settings.ZONE_INDEX_CHECK_SECONDS:
+        return _index
+    version = cache.get(VERSION_KEY, 0)
+    if _index is None or version != _version:
+        _index = ZoneIndex(ServiceZone.objects.filter(is_active=True))
+        _version = version
+    _checked_at = now
+    return _index
+
+
+def invalidate():
+    """Make every process rebuild its index on its next check."""
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    global _index
+    _index = None
+
+
+def zones_at(latitude, longitude, country_code=None, kind=None):
+    return get_index().locate(latitude, longitude, country_code, kind)
+
+
+def is_serviceable(latitude, longitude, country_code=None):
+    """Outside RESTRICTED zones and, if the country has any service areas, inside one of them."""
+    found = zones_at(latitude, longitude, country_code)
+    if any(zone.kind == "RESTRICTED" for zone in found):
+        return False
+    if country_code in get_index().service_countries:
+        return any(zone.kind == "SERVICE_AREA" for zone in found)
+    return True
+
+
+def pricing_zone(latitude, longitude, country_code=None):
+    found = zones_at(latitude, longitude, country_code, kind="PRICING")
+    return found[0] if found else None
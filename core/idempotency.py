@@ -0,0 +1,159 @@
+"""
+Idempotency-Key support for POST endpoints that clients retry.
+
+A client sends the same `Idempotency-Key` header on every retry of one
+logical request. The first attempt runs normally and its response (status,
+rendered body and content type) is kept in the cache for
+IDEMPOTENCY_TTL_SECONDS; later attempts get those bytes back verbatim
+without re-running validation, queries or writes, and without the
+permission checks the first attempt's own writes would now fail (a retried
+ride creation is not an "already has an active ride" 403).
+
+Keys are scoped to the user and the view. A duplicate arriving while the
+first attempt is still running waits on a short cache lock for up to
+IDEMPOTENCY_WAIT_SECONDS and then replays, or gets a 409. Reusing a key for
+a different request body is a 422. 5xx responses are not kept, so the
+client can retry them.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class InvalidIdempotencyKey(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = {
+        "status": False,
+        "message": f"{HEADER} must be at most {MAX_KEY_LENGTH} characters",
+    }
+    default_code = "invalid_idempotency_key"
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = {
+        "status": False,
+        "message": "a request with this Idempotency-Key is still in progress, please retry",
+    }
+    default_code = "idempotency_key_in_use"
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = {
+        "status": False,
+        "message": "this Idempotency-Key was already used for a different request",
+    }
+    default_code = "idempotency_key_reused"
+
+
+class Replay(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class Claim:
+    """One request's hold on its idempotency key."""
+
+    def __init__(self, request, view_name, key):
+        scope = f"idempotency:{request.user.pk}:{view_name}:{key}"
+        self.key = scope
+        self.lock_key = f"{scope}:lock"
+        self.fingerprint = hashlib.sha256(request.method.encode() + request.path.encode() + b"\n" + request.body).hexdigest()
+        self.locked = False
+
+    def _replay(self, stored):
+        if stored["fingerprint"] != self.fingerprint:
+            raise IdempotencyKeyReused()
+        response = HttpResponse(stored["content"], status=stored["status"], content_type=stored["content_type"])
+        response[REPLAYED_HEADER] = "true"
+        return response
+
+    def acquire(self):
+        """Take the key's lock and return None, or return the stored response to replay."""
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            stored = cache.get(self.key)
+            if stored is not None:
+                return self._replay(stored)
+            if cache.add(self.lock_key, self.fingerprint, settings.IDEMPOTENCY_LOCK_SECONDS):
+                # The first attempt may have finished between the read and the lock.
+                stored = cache.get(self.key)
+                if stored is not None:
+                    cache.delete(self.lock_key)
+                    return self._replay(stored)
+                self.locked = True
+                return None
+            if time.monotonic() >= deadline:
+                raise IdempotencyKeyInUse()
+            time.sleep(0.05)
+
+    def release(self):
+        if self.locked:
+            cache.delete(self.lock_key)
+            self.locked = False
+
+    def complete(self, response):
+        """Keep `response` for replays (unless it is a 5xx) and release the lock."""
+        if not self.locked:
+            return
+        try:
+            if response.status_code < 500:
+                if hasattr(response, "render") and not response.is_rendered:
+                    response.render()
+                cache.set(
+                    self.key,
+                    {
+                        "fingerprint": self.fingerprint,
+                        "status": response.status_code,
+                        "content": response.content,
+                        "content_type": response.get("Content-Type"),
+                    },
+                    settings.IDEMPOTENCY_TTL_SECONDS,
+                )
+        finally:
+            self.release()
+
+
+class IdempotentMixin:
+    """APIView mixin replaying POST responses for a repeated Idempotency-Key."""
+
+    def initial(self, request, *args, **kwargs):
+        self.idempotency = None
+        key = request.headers.get(HEADER)
+        # Authentication runs here (request.user); anonymous requests fall through to the permission checks.
+        if key and request.method == "POST" and request.user.is_authenticated:
+            if len(key) > MAX_KEY_LENGTH:
+                raise InvalidIdempotencyKey()
+            claim = Claim(request, type(self).__name__, key)
+            replay = claim.acquire()
+            if replay is not None:
+                raise Replay(replay)
+            self.idempotency = claim
+        super().initial(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # An unhandled error becomes a 500 outside finalize_response.
+            if getattr(self, "idempotency", None) is not None:
+                self.idempotency.release()
+            raise
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "idempotency", None) is not None:
+            self.idempotency.complete(response)
+        return response
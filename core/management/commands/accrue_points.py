@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.helpers import points
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = "Credit a promotion's points once to every matching active user, a batch of users per INSERT."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--campaign", required=True, help="unique name; re-running it credits only users it missed")
+        parser.add_argument("--points", type=int, required=True)
+        parser.add_argument("--user-type", choices=[choice for choice, _ in User.USER_TYPE])
+        parser.add_argument("--country-code")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options["points"] <= 0:
+            raise CommandError("--points must be positive")
+        users = User.objects.filter(is_active=True, is_deleted=False, is_suspended=False)
+        if options["user_type"]:
+            users = users.filter(user_type=options["user_type"])
+        if options["country_code"]:
+            users = users.filter(country_code=options["country_code"])
+        credited = points.credit_campaign(options["campaign"], options["points"], users, options["batch_size"])
+        self.stdout.write(f"Credited {options['points']} points to {credited} users for {options['campaign']}")
@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+# The stack every request ran through before core/middleware.py.
+STOCK_MIDDLEWARE = [
+    "django.middleware.security.SecurityMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
+    "corsheaders.middleware.CorsMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "allauth.account.middleware.AccountMiddleware",
+]
+
+
+class Command(BaseCommand):
+    help = "Time API requests through the stock and the route-aware middleware stacks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--path", default="/v1/ride/ride_status/", help="API path to request")
+        parser.add_argument(
+            "--session-cookie",
+            default="",
+            help="sessionid cookie to send, as a browser-based client would (default: none)",
+        )
+
+    def handle(self, *args, **options):
+        stacks = (("stock", STOCK_MIDDLEWARE), ("route-aware", settings.MIDDLEWARE))
+        clients, timings, session_queries = {}, {}, {}
+        for name, middleware in stacks:
+            # The test client builds its middleware chain on the first request.
+            with override_settings(MIDDLEWARE=middleware):
+                clients[name] = Client()
+                if options["session_cookie"]:
+                    clients[name].cookies[settings.SESSION_COOKIE_NAME] = options["session_cookie"]
+                clients[name].get(options["path"])
+            timings[name], session_queries[name] = [], 0
+
+        # Alternate the stacks in rounds so warm-up and noise hit both alike.
+        rounds = 20
+        for _ in range(rounds):
+            for name, _middleware in stacks:
+                with CaptureQueriesContext(connection) as queries:
+                    for _ in range(max(options["requests"] // rounds, 1)):
+                        started = time.perf_counter()
+                        clients[name].get(options["path"])
+                        timings[name].append((time.perf_counter() - started) * 1e6)
+                session_queries[name] += sum("django_session" in query["sql"] for query in queries.captured_queries)
+
+        for name, _middleware in stacks:
+            samples = sorted(timings[name])
+            self.stdout.write(
+                f"{name:>12}: mean {statistics.fmean(samples):.1f} µs, p50 {samples[len(samples) // 2]:.1f} µs, "
+                f"p99 {samples[int(len(samples) * 0.99)]:.1f} µs, "
+                f"{session_queries[name] / len(samples):.2f} session queries/request"
+            )
+        self.stdout.write(
+            f"saved {statistics.fmean(timings['stock']) - statistics.fmean(timings['route-aware']):.1f} µs per request"
+        )
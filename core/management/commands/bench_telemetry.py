@@ -0,0 +1,60 @@
+import time
+import uuid
+
+import msgpack
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.helpers import presence, telemetry
+
+
+class Command(BaseCommand):
+    help = "Time the telemetry gateway's per-message decoding and its batched presence writes, without a broker."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200000)
+        parser.add_argument("--drivers", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        drivers = [str(uuid.UUID(int=int(value))) for value in rng.integers(1, 2**63, options["drivers"])]
+        topics = [settings.MQTT_TELEMETRY_TOPIC.replace("+", driver) for driver in drivers]
+        now = time.time()
+        picks = rng.integers(0, len(drivers), options["messages"])
+        latitudes = rng.uniform(6.4, 6.7, options["messages"])
+        longitudes = rng.uniform(3.2, 3.6, options["messages"])
+        messages = [
+            (topics[pick], msgpack.packb([latitude, longitude, True, True, now]))
+            for pick, latitude, longitude in zip(picks.tolist(), latitudes.tolist(), longitudes.tolist())
+        ]
+
+        # What the MQTT network thread does per message.
+        batch = telemetry.TelemetryBatch()
+        started = time.perf_counter()
+        for topic, payload in messages:
+            batch.add(*telemetry.decode(topic, payload))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"decode + batch: {elapsed / len(messages) * 1e6:.2f} µs per message, "
+            f"{len(messages) / elapsed:,.0f} messages/s on one core ({len(messages[0][1])} byte payloads)"
+        )
+
+        # Drivers already online carry their vehicle in presence, as in steady state.
+        presence.heartbeat_many(
+            [
+                {"driver_id": driver, "latitude": 6.5, "longitude": 3.4, "area": "NG", "vehicle_id": uuid.uuid4(), "ride_type": "ECONOMY", "vehicle_type": "RIDES"}
+                for driver in drivers
+            ]
+        )
+        drained = batch.drain()
+        started = time.perf_counter()
+        applied, rejected = telemetry.apply(drained)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"apply: {len(drained)} drivers in {elapsed * 1000:.1f} ms ({elapsed / len(drained) * 1e6:.1f} µs per driver), "
+            f"{applied} applied, {rejected} rejected"
+        )
+        for driver in drivers:
+            presence.go_offline(driver)
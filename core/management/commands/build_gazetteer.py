@@ -0,0 +1,52 @@
+import csv
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.helpers import geocoder
+
+
+class Command(BaseCommand):
+    help = "Build the offline reverse-geocoding index from a CSV of address points or a GeoNames dump."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["csv", "geonames"], default="csv")
+        parser.add_argument(
+            "--label-columns",
+            nargs="+",
+            default=["address"],
+            help="CSV columns joined (with ', ') into the address label",
+        )
+        parser.add_argument("--country", help="only keep GeoNames rows of this country code")
+        parser.add_argument("--output", default=None, help="index directory (default: GEOCODER_DATA_DIR)")
+
+    def handle(self, *args, **options):
+        latitudes, longitudes, labels = [], [], []
+        reader = self.geonames(options) if options["format"] == "geonames" else self.csv(options)
+        for latitude, longitude, label in reader:
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            labels.append(label)
+        if not labels:
+            raise CommandError("No address points found")
+        count = geocoder.build(latitudes, longitudes, labels, options["output"] or settings.GEOCODER_DATA_DIR)
+        self.stdout.write(f"Indexed {count} address points")
+
+    def csv(self, options):
+        with open(options["path"], newline="", encoding="utf-8") as handle:
+            for row in csv.DictReader(handle):
+                latitude = row.get("latitude") or row.get("lat")
+                longitude = row.get("longitude") or row.get("lon") or row.get("lng")
+                label = ", ".join(row[column] for column in options["label_columns"] if row.get(column))
+                if latitude and longitude and label:
+                    yield float(latitude), float(longitude), label
+
+    def geonames(self, options):
+        # http://download.geonames.org/export/dump/ : name is column 1, lat/lon 4/5, country 8.
+        with open(options["path"], encoding="utf-8") as handle:
+            for line in handle:
+                columns = line.rstrip("\n").split("\t")
+                if len(columns) < 9 or (options["country"] and columns[8] != options["country"]):
+                    continue
+                yield float(columns[4]), float(columns[5]), columns[1]
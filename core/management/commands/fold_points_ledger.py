@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.helpers import points
+
+
+class Command(BaseCommand):
+    help = "Fold settled loyalty points ledger entries into the users' cached balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="catch up once and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            folded = points.catch_up()
+            if options["once"]:
+                self.stdout.write(f"Folded {folded} points entries")
+                break
+            time.sleep(max(settings.POINTS_FOLD_TICK_SECONDS - (time.monotonic() - started), 0))
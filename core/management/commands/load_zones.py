@@ -0,0 +1,59 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.helpers import zones
+from core.models import ZONE_KIND, ServiceZone
+
+ZONE_FIELDS = ("priority", "base_rate", "kilometer_rate", "fare_multiplier", "flat_fee")
+
+
+class Command(BaseCommand):
+    help = (
+        "Load service/pricing zones from a GeoJSON FeatureCollection. Feature properties: name, kind, "
+        "country_code, priority, base_rate, kilometer_rate, fare_multiplier, flat_fee."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="GeoJSON file")
+        parser.add_argument("--country", help="country_code for features that do not set one")
+        parser.add_argument("--kind", choices=[kind for kind, _ in ZONE_KIND], default="PRICING")
+        parser.add_argument("--replace", action="store_true", help="deactivate existing zones of the same country first")
+
+    def handle(self, *args, **options):
+        with open(options["path"]) as handle:
+            collection = json.load(handle)
+        features = collection.get("features", [collection] if collection.get("type") == "Feature" else [])
+        if not features:
+            raise CommandError("No features found")
+
+        new_zones = []
+        for position, feature in enumerate(features):
+            properties = feature.get("properties") or {}
+            try:
+                zones.polygons(feature)
+            except zones.ZoneGeometryError as error:
+                raise CommandError(f"Feature {position}: {error}")
+            kind = properties.get("kind", options["kind"])
+            if kind not in dict(ZONE_KIND):
+                raise CommandError(f"Feature {position}: unknown kind {kind!r}")
+            new_zones.append(
+                ServiceZone(
+                    name=properties.get("name") or f"Zone {position + 1}",
+                    country_code=properties.get("country_code", options["country"]),
+                    kind=kind,
+                    geometry=feature["geometry"],
+                    **{field: properties[field] for field in ZONE_FIELDS if properties.get(field) is not None},
+                )
+            )
+
+        with transaction.atomic():
+            if options["replace"]:
+                ServiceZone.objects.filter(
+                    country_code__in={zone.country_code for zone in new_zones}, is_active=True
+                ).update(is_active=False)
+            ServiceZone.objects.bulk_create(new_zones)
+        # bulk_create and update() skip the model signals.
+        zones.invalidate()
+        self.stdout.write(f"Loaded {len(new_zones)} zones")
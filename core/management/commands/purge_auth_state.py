@@ -0,0 +1,24 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.helpers import auth_cleanup
+
+
+class Command(BaseCommand):
+    help = "Delete spent password reset tokens and clear stale OTP codes every AUTH_PURGE_TICK_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="run a single pass and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            stats = auth_cleanup.purge()
+            if options["once"]:
+                self.stdout.write(
+                    f"{stats['reset_tokens']} reset tokens deleted, {stats['otp_codes']} OTP codes cleared in {stats['seconds']}s"
+                )
+                break
+            time.sleep(max(settings.AUTH_PURGE_TICK_SECONDS - (time.monotonic() - started), 0))
@@ -0,0 +1,88 @@
+import logging
+import os
+import socket
+import time
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core.helpers import telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Consume driver telemetry from the MQTT broker and feed it to the presence store in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seconds", type=float, default=0, help="stop after this many seconds (default: run forever)")
+
+    def handle(self, *args, **options):
+        if not settings.REDIS_URL:
+            raise CommandError("REDIS_URL is not set; the in-process presence store cannot be read from another process")
+        broker = urlparse(settings.MQTT_BROKER_URL)
+        batch = telemetry.TelemetryBatch()
+        self.received = self.dropped = 0
+
+        def on_connect(client, userdata, flags, reason_code, properties):
+            if reason_code.is_failure:
+                logger.error(f"Telemetry gateway: broker refused the connection ({reason_code})")
+                return
+            # Subscribing here renews the subscription after every reconnect.
+            client.subscribe(telemetry.topic_filter(), qos=0)
+            logger.info(f"Telemetry gateway: subscribed to {telemetry.topic_filter()}")
+
+        def on_message(client, userdata, message):
+            self.received += 1
+            try:
+                batch.add(*telemetry.decode(message.topic, message.payload))
+            except telemetry.InvalidTelemetry as exc:
+                self.dropped += 1
+                logger.debug(f"Telemetry gateway: dropped message on {message.topic}: {exc}")
+
+        client = mqtt.Client(
+            mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f"qglide-telemetry-{socket.gethostname()}-{os.getpid()}",
+            protocol=mqtt.MQTTv5 if settings.MQTT_SHARED_GROUP else mqtt.MQTTv311,
+        )
+        if broker.username:
+            client.username_pw_set(broker.username, broker.password)
+        if broker.scheme == "mqtts":
+            client.tls_set()
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.reconnect_delay_set(min_delay=1, max_delay=30)
+        client.connect_async(broker.hostname, broker.port or (8883 if broker.scheme == "mqtts" else 1883))
+        client.loop_start()
+
+        deadline = time.monotonic() + options["seconds"] if options["seconds"] else None
+        applied = rejected = 0
+        last_report = time.monotonic()
+        try:
+            while deadline is None or time.monotonic() < deadline:
+                started = time.monotonic()
+                messages = batch.drain()
+                if messages:
+                    close_old_connections()
+                    counts = telemetry.apply(messages)
+                    applied, rejected = applied + counts[0], rejected + counts[1]
+                if started - last_report >= 60:
+                    logger.info(
+                        f"Telemetry gateway: {self.received} messages, {self.dropped} dropped, "
+                        f"{applied} driver updates, {rejected} without an active vehicle"
+                    )
+                    last_report = started
+                time.sleep(max(settings.MQTT_FLUSH_SECONDS - (time.monotonic() - started), 0))
+        finally:
+            client.loop_stop()
+            client.disconnect()
+            messages = batch.drain()
+            if messages:
+                counts = telemetry.apply(messages)
+                applied, rejected = applied + counts[0], rejected + counts[1]
+        self.stdout.write(
+            f"{self.received} messages, {self.dropped} dropped, {applied} driver updates, {rejected} without an active vehicle"
+        )
@@ -0,0 +1,58 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.helpers import presence
+from core.models import VehicleRegistration
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Mirror driver presence into VehicleRegistration.vehicle_status with batched updates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="run a single sync and exit")
+
+    def handle(self, *args, **options):
+        if not settings.REDIS_URL:
+            raise CommandError("REDIS_URL is not set; the in-process presence store cannot be read from another process")
+        while True:
+            started = time.monotonic()
+            online, offline = self.sync()
+            if options["once"]:
+                self.stdout.write(f"{online} vehicles set ONLINE, {offline} set OFFLINE")
+                break
+            time.sleep(max(settings.PRESENCE_SYNC_SECONDS - (time.monotonic() - started), 0))
+
+    def sync(self):
+        presence.expire()
+        records = presence.records(presence.online())
+        online_vehicles = {record["vehicle"]: driver for driver, record in records.items() if record["vehicle"]}
+
+        usable = {
+            str(vehicle_id): vehicle_status
+            for vehicle_id, vehicle_status in VehicleRegistration.objects.filter(
+                id__in=list(online_vehicles), is_active=True, is_deleted=False
+            ).values_list("id", "vehicle_status")
+        }
+        to_online = [vehicle_id for vehicle_id, vehicle_status in usable.items() if vehicle_status != "ONLINE"]
+        to_offline = [
+            vehicle_id
+            for vehicle_id in VehicleRegistration.objects.filter(vehicle_status="ONLINE").values_list("id", flat=True)
+            if str(vehicle_id) not in usable
+        ]
+
+        # Drivers whose vehicle was deactivated or deleted since their session began.
+        for driver in set(records) - {online_vehicles[vehicle_id] for vehicle_id in usable}:
+            presence.go_offline(driver)
+
+        batch = settings.PRESENCE_SYNC_BATCH
+        for status, ids in (("ONLINE", to_online), ("OFFLINE", to_offline)):
+            for start in range(0, len(ids), batch):
+                VehicleRegistration.objects.filter(id__in=ids[start : start + batch]).update(vehicle_status=status)
+        if to_online or to_offline:
+            logger.info(f"Presence sync: {len(to_online)} vehicles ONLINE, {len(to_offline)} OFFLINE")
+        return len(to_online), len(to_offline)
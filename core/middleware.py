@@ -0,0 +1,109 @@
+"""
+Route-aware versions of the browser middleware.
+
+Everything under API_PATH_PREFIXES is a JWT-authenticated JSON API, so
+sessions, CSRF cookies, `request.user` from the session, messages and the
+X-Frame-Options header are pure overhead there. These subclasses pass such
+requests straight through and behave exactly like Django's own everywhere
+else (/admin/, the reset-password page, the API docs). Being subclasses, they
+still satisfy the admin's middleware checks.
+
+allauth's AccountMiddleware stays as it is: allauth refuses to start unless
+that exact path is in MIDDLEWARE, and it does not touch the session on API
+responses.
+
+CompressionMiddleware goes the other way and only acts on API responses.
+"""
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.middleware import clickjacking, csrf
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_br = _lazy_re_compile(r"\bbr\b")
+re_accepts_gzip = _lazy_re_compile(r"\bgzip\b")
+
+
+def is_api_request(request):
+    return request.path_info.startswith(tuple(settings.API_PATH_PREFIXES))
+
+
+class BrowserOnlyMixin:
+    def __call__(self, request):
+        if is_api_request(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(BrowserOnlyMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(BrowserOnlyMixin, csrf.CsrfViewMiddleware):
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if is_api_request(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(BrowserOnlyMixin, auth_middleware.AuthenticationMiddleware):
+    pass
+
+
+class MessageMiddleware(BrowserOnlyMixin, messages_middleware.MessageMiddleware):
+    pass
+
+
+class XFrameOptionsMiddleware(BrowserOnlyMixin, clickjacking.XFrameOptionsMiddleware):
+    pass
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Brotli (when installed) or gzip for API responses of at least
+    COMPRESSION_MIN_BYTES, i.e. the list and profile payloads, not 304s or
+    short status replies.
+
+    Unlike Django's GZipMiddleware there is no random padding: these routes
+    authenticate with a bearer token, not a cookie, so there is no secret for
+    a BREACH attack to extract, and the same body always compresses the same.
+    A compressed body therefore keeps a strong ETag, suffixed with its
+    encoding as core.helpers.etags expects.
+    """
+
+    def process_response(self, request, response):
+        if (
+            not is_api_request(request)
+            or response.streaming
+            or response.has_header("Content-Encoding")
+            or len(response.content) < settings.COMPRESSION_MIN_BYTES
+        ):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        accepted = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        if brotli is not None and re_accepts_br.search(accepted):
+            encoding, content = "br", brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        elif re_accepts_gzip.search(accepted):
+            encoding, content = "gzip", compress_string(response.content)
+        else:
+            return response
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response.headers["Content-Length"] = str(len(content))
+        response.headers["Content-Encoding"] = encoding
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+        return response
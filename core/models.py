@@ -9,6 +9,7 @@ from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.core.validators import MinValueValidator
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext as _
 
@@ -35,6 +36,12 @@ VEHICLE_TYPE = (
     ("PACKAGE_DELIVERY", "Package Delivery"),
 )
 
+ZONE_KIND = (
+    ("SERVICE_AREA", "Service Area"),
+    ("PRICING", "Pricing"),
+    ("RESTRICTED", "Restricted"),
+)
+
 
 class BaseModel(models.Model):
     """Base model for reuse.
@@ -99,13 +106,20 @@ class User(AbstractUser, BaseModel):
     ip_address = models.CharField(max_length=255, blank=True, null=True)
     referral_code = models.CharField(max_length=255, blank=True, null=True)
     otp_code = models.CharField(max_length=128, blank=True, null=True)
+    otp_created_at = models.DateTimeField(null=True, blank=True)
     promotion_notification = models.BooleanField(default=False)
     user_type = models.CharField(
         max_length=255, blank=True, null=True, choices=USER_TYPE, default="USER"
     )
     date_of_birth = models.DateField(null=True, blank=True)
     profile_photo = models.ImageField(upload_to='media/images/profiles/', null=True, blank=True)
+    # rating_average rounded; both the decayed average of ride/helpers/ratings.py.
     rating = models.PositiveIntegerField(default=0)
+    rating_average = models.FloatField(default=0.0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveBigIntegerField(default=0)
+    rating_weight = models.FloatField(default=0.0)
+    rating_weighted_sum = models.FloatField(default=0.0)
     terms_and_conditions = models.BooleanField(default=True)
     is_verified = models.BooleanField(default=False)
     is_suspended = models.BooleanField(default=False)
@@ -124,6 +138,12 @@ class User(AbstractUser, BaseModel):
         ordering = ["-created_at"]
         verbose_name = "USER PROFILE"
         verbose_name_plural = "USER PROFILES"
+        indexes = [
+            # Outstanding OTP codes by age, for purge_auth_state.
+            models.Index(
+                fields=["otp_created_at"], name="user_pending_otp_idx", condition=models.Q(otp_code__isnull=False)
+            ),
+        ]
 
     @property
     def full_name(self) -> str:
@@ -237,11 +257,14 @@ class User(AbstractUser, BaseModel):
     def hash_otp(cls, user, otp_code):
         hashed_otp_code = make_password(otp_code)
         user.otp_code = hashed_otp_code
+        user.otp_created_at = timezone.now()
         user.save()
         return user
 
     @classmethod
     def check_otp(cls, user, otp_code):
+        if user.otp_created_at and timezone.now() - user.otp_created_at > timedelta(minutes=settings.OTP_EXPIRY_MINUTES):
+            return False
         return check_password(otp_code, user.otp_code)
 
 
@@ -304,6 +327,8 @@ class ConstantTable(BaseModel):
     package_delivery_rate = models.FloatField(default=1.0)
     duration_seconds = models.IntegerField(default=600)
     minimum_rate = models.FloatField(default=10.0)
+    # Loyalty points credited per unit of fare a ride ends with; a point is worth one unit off a fare.
+    points_earn_rate = models.FloatField(default=0.0)
 
     class Meta:
         ordering = ["-created_at"]
@@ -353,23 +378,36 @@ class ConstantTable(BaseModel):
         is_peak_hours: bool, 
         points: Optional[int] = 0, 
         is_delivery: Optional[bool] = False, 
-        package_weight: Optional[float] = 0
+        package_weight: Optional[float] = 0,
+        surge_multiplier: Optional[float] = 1.0,
+        zone: Optional["ServiceZone"] = None,
     ):
-        country_constants = cls.constant_table_instance(cls, country_code)
+        country_constants = cls.constant_table_instance(country_code=country_code)
         if ride_type == "ECONOMY":
             kilometer_rate = country_constants.economy_kilometer_rate
         elif ride_type == "SUV":
             kilometer_rate = country_constants.suv_kilometer_rate
         else:
             kilometer_rate = country_constants.luxury_kilometer_rate
+        base_rate = country_constants.base_rate
+
+        # A pricing zone overrides the country rates it sets.
+        if zone is not None:
+            if zone.base_rate is not None:
+                base_rate = zone.base_rate
+            if zone.kilometer_rate is not None:
+                kilometer_rate = zone.kilometer_rate
 
         total_fare = 0  
-        total_fare += country_constants.base_rate
+        total_fare += base_rate
         total_fare += kilometer_rate * distance
         if duration > country_constants.duration_seconds:
             total_fare += country_constants.time_based_rate * (distance/60)
         if is_peak_hours:
             total_fare += country_constants.peak_hour_rate
+        if zone is not None:
+            total_fare = total_fare * zone.fare_multiplier + zone.flat_fee
+        total_fare *= surge_multiplier
         if is_delivery:
             total_fare += country_constants.package_delivery_rate * package_weight
         
@@ -378,23 +416,48 @@ class ConstantTable(BaseModel):
         else:
             total_fare = total_fare
 
-        if points > 0:
-            if total_fare >= points:
-                point_discount = total_fare - points
-                point_deducted = True
-                points_left = 0
-            else:
-                point_discount = total_fare
-                point_deducted = True
-                points_left = point_discount - total_fare
-        else:
-            point_discount = 0
-            point_deducted = False
-            points_left = 0
+        point_discount, point_deducted, points_left = cls.redeem_points(total_fare, points)
 
         return total_fare, point_discount, point_deducted, points_left
+
+    @staticmethod
+    def redeem_points(total_fare: float, points: Optional[int] = 0):
+        """(point_discount, point_deducted, points_left) for spending up to `points` on `total_fare`."""
+        # A point takes one unit off the fare; whole points only, never more than the fare.
+        points = max(points or 0, 0)
+        point_discount = min(points, int(total_fare))
+        return point_discount, point_discount > 0, points - point_discount
     
 
+class ServiceZone(BaseModel):
+    """
+    A GeoJSON Polygon/MultiPolygon (lon, lat order) used to restrict or price rides.
+
+    SERVICE_AREA zones bound where rides may be requested once a country has any,
+    RESTRICTED zones are always refused, and PRICING zones override the country's
+    ConstantTable rates; the highest priority zone wins where zones overlap.
+    """
+
+    name = models.CharField(max_length=255)
+    country_code = models.CharField(null=True, blank=True, db_index=True)
+    kind = models.CharField(max_length=50, choices=ZONE_KIND, default="PRICING")
+    geometry = models.JSONField()
+    priority = models.IntegerField(default=0)
+    base_rate = models.FloatField(null=True, blank=True)
+    kilometer_rate = models.FloatField(null=True, blank=True)
+    fare_multiplier = models.FloatField(default=1.0, validators=[MinValueValidator(0.0)])
+    flat_fee = models.FloatField(default=0.0, validators=[MinValueValidator(0.0)])
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["-priority", "-created_at"]
+        verbose_name = "SERVICE ZONE"
+        verbose_name_plural = "SERVICE ZONES"
+
+    def __str__(self):
+        return f"{self.name} ({self.kind})"
+
+
 class VehicleSettings(BaseModel):
     name = models.CharField(max_length=255, null=True, blank=True)
     ride_type = models.CharField(
@@ -457,4 +520,58 @@ class PasswordResetToken(BaseModel):
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "PASSWORD RESET TOKEN"
-        verbose_name_plural = "PASSWORD RESET TOKENS"
\ No newline at end of file
+        verbose_name_plural = "PASSWORD RESET TOKENS"
+        indexes = [models.Index(fields=["expires_at"], name="password_reset_expiry_idx")]
+
+
+POINTS_REASON = (
+    ("RIDE_EARN", "Ride Earn"),
+    ("RIDE_REDEEM", "Ride Redeem"),
+    ("PROMOTION", "Promotion"),
+    ("ADJUSTMENT", "Adjustment"),
+)
+
+
+class PointsEntry(models.Model):
+    """
+    Append-only loyalty points ledger (core/helpers/points.py): a credit or
+    (negative) debit per row. The sequential id is the offset the balance
+    fold checkpoints.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    # No constraint: the ledger outlives the users and rides it mentions.
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name="points_entries")
+    amount = models.BigIntegerField()
+    reason = models.CharField(max_length=50, choices=POINTS_REASON)
+    ride_id = models.UUIDField(null=True, blank=True)
+    campaign = models.CharField(max_length=100, null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "POINTS ENTRY"
+        verbose_name_plural = "POINTS ENTRIES"
+        indexes = [models.Index(fields=["user", "id"], name="points_entry_user_idx")]
+        # What makes a retried ride end or a re-run promotion a no-op.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ride_id", "reason"], name="points_entry_ride_unique", condition=models.Q(ride_id__isnull=False)
+            ),
+            models.UniqueConstraint(
+                fields=["user", "campaign"], name="points_entry_campaign_unique", condition=models.Q(campaign__isnull=False)
+            ),
+        ]
+
+
+class PointsBalance(BaseModel):
+    """A user's ledger entries up to `position`, summed; the balance is this plus the entries after it."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="points_balance")
+    balance = models.BigIntegerField(default=0)
+    position = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-updated_at"]
+        verbose_name = "POINTS BALANCE"
+        verbose_name_plural = "POINTS BALANCES"
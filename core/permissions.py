@@ -1,7 +1,7 @@
 from rest_framework import permissions, status
 from rest_framework.exceptions import APIException
 
-from ride.models import Ride
+from ride.helpers import active_rides
 
 
 class UserIsDeleted(APIException):
@@ -74,7 +74,8 @@ class UserHasActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(user=request.user, is_completed=False).first()
+        # Book-ahead rides don't stop the user from riding now.
+        opened_ride = active_rides.current(user=request.user, statuses=active_rides.IN_PROGRESS_STATUSES)
         if opened_ride:
             raise AlreadyStartedRide()
         return True
@@ -83,7 +84,7 @@ class UserHasNoActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(user=request.user, ride_status="PENDING", is_completed=False).first()
+        opened_ride = active_rides.current(user=request.user, statuses=["PENDING"])
         if opened_ride is None:
             raise NoOpenRide()
         return True
@@ -92,7 +93,10 @@ class CancelUserActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(user=request.user, ride_status__in=["ACCEPTED", "WAITING"], is_completed=False).first()
+        ride_id = active_rides.requested_id(request)
+        # A booking is only cancelled by naming it; otherwise the ride under way is.
+        statuses = ["SCHEDULED", "ACCEPTED", "WAITING"] if ride_id else ["ACCEPTED", "WAITING"]
+        opened_ride = active_rides.current(user=request.user, statuses=statuses, ride_id=ride_id)
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
@@ -101,7 +105,9 @@ class AcceptedRiderActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status__in=["ACCEPTED", "WAITING"], is_completed=False).first()
+        opened_ride = active_rides.current(
+            driver=request.user, statuses=["ACCEPTED", "WAITING"], ride_id=active_rides.requested_id(request)
+        )
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
@@ -111,7 +117,9 @@ class WaitingRiderActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="ACCEPTED", is_completed=False).first()
+        opened_ride = active_rides.current(
+            driver=request.user, statuses=["ACCEPTED"], ride_id=active_rides.requested_id(request)
+        )
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
@@ -121,7 +129,9 @@ class StartRiderActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="WAITING", is_completed=False).first()
+        opened_ride = active_rides.current(
+            driver=request.user, statuses=["WAITING"], ride_id=active_rides.requested_id(request)
+        )
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
@@ -131,7 +141,9 @@ class EndRiderActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="RIDE_START", is_completed=False).first()
+        opened_ride = active_rides.current(
+            driver=request.user, statuses=["RIDE_START"], ride_id=active_rides.requested_id(request)
+        )
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
@@ -141,7 +153,9 @@ class CashPaymentActiveRide(permissions.BasePermission):
 
     def has_permission(self, request, view):
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="RIDE_END", is_completed=False).first()
+        opened_ride = active_rides.current(
+            driver=request.user, statuses=["RIDE_END"], ride_id=active_rides.requested_id(request)
+        )
         if opened_ride is None:
             raise NoAcceptedRide()
         return True
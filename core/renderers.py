@@ -0,0 +1,73 @@
+"""
+orjson and MessagePack renderers/parsers for the API.
+
+JSON stays the default content type but is encoded and decoded by orjson,
+several times faster than the stdlib json module DRF uses. Mobile clients can
+opt into MessagePack, a smaller binary encoding of the same payload, by
+sending `Accept: application/msgpack` (and `Content-Type: application/msgpack`
+for request bodies).
+
+Values neither library handles natively (lazy translation strings, Decimals,
+durations, ...) go through DRF's own JSONEncoder, so the output matches what
+rest_framework.renderers.JSONRenderer produced. So do datetimes, which orjson
+would otherwise write with "+00:00" where DRF writes "Z".
+"""
+import msgpack
+import orjson
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+def _default(obj):
+    return _encoder.default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        # The browsable API asks for indented output through the media type parameters.
+        if accepted_media_type and "indent" in accepted_media_type:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(data, default=_default, option=option)
+
+
+class ORJSONParser(BaseParser):
+    media_type = "application/json"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False, strict_map_key=False)
+        except (msgpack.ExtraData, msgpack.FormatError, msgpack.StackError, ValueError) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
@@ -20,4 +20,19 @@ class VehicleSettingsResource(resources.ModelResource):
 
 class VehicleRegistrationResource(resources.ModelResource):
     class Meta:
-        model = models.VehicleRegistration
\ No newline at end of file
+        model = models.VehicleRegistration
+
+
+class ServiceZoneResource(resources.ModelResource):
+    class Meta:
+        model = models.ServiceZone
+
+
+class PointsEntryResource(resources.ModelResource):
+    class Meta:
+        model = models.PointsEntry
+
+
+class PointsBalanceResource(resources.ModelResource):
+    class Meta:
+        model = models.PointsBalance
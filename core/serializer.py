@@ -3,6 +3,7 @@ from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import update_last_login
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
+from django.utils import timezone
 from rest_framework import exceptions, serializers
 from rest_framework.exceptions import APIException
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -12,6 +13,7 @@ from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 from rest_framework.exceptions import AuthenticationFailed
 from drf_yasg.utils import swagger_auto_schema
 
+from core.helpers import fieldsets
 from core.helpers.func import (
     generate_verification_code,
 )
@@ -72,6 +74,20 @@ class ModelCustomSerializer(serializers.ModelSerializer):
         return errors
 
 
+class SparseFieldsMixin:
+    """Serializes only the fields named in the request's `?fields=`, plus `always_included`."""
+
+    # Identity and the delta-mode cursors.
+    always_included = ("id", "updated_at", "version")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = fieldsets.requested_fields(self.context.get("request"))
+        if requested is not None:
+            for name in set(self.fields) - requested - set(self.always_included):
+                self.fields.pop(name)
+
+
 class VehiclePrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
 
     default_error_messages = {
@@ -331,6 +347,7 @@ class RegistrationSerializer(ModelCustomSerializer):
         del attrs["confirm_password"]
         verification_code = generate_verification_code()
         attrs["otp_code"] = make_password(verification_code)
+        attrs["otp_created_at"] = timezone.now()
         attrs["un_hashed_otp_code"] = verification_code
         attrs["phone_number"] = correct_phone_number
         attrs["is_active"] = True
@@ -429,7 +446,7 @@ class VehicleRegistrationSerializer(ModelCustomSerializer):
         return attrs
     
 
-class FetchVehicleTypeSerializer(ModelCustomSerializer):
+class FetchVehicleTypeSerializer(SparseFieldsMixin, ModelCustomSerializer):
     """Serializers Fetch Brand for all Users."""
 
     class Meta:
@@ -439,10 +456,11 @@ class FetchVehicleTypeSerializer(ModelCustomSerializer):
             "name",
             "vehicle_type",
             "is_active",
+            "updated_at",
         )
 
 
-class FetchVehicleRegistrationSerializer(ModelCustomSerializer):
+class FetchVehicleRegistrationSerializer(SparseFieldsMixin, ModelCustomSerializer):
     """Serializers Fetch Brand for all Users."""
 
     class Meta:
@@ -461,6 +479,7 @@ class FetchVehicleRegistrationSerializer(ModelCustomSerializer):
             "is_active",
             "is_deleted",
             "created_at",
+            "updated_at",
         )
 
 
@@ -488,6 +507,13 @@ class FetchVehicleRegistrationAdminSerializer(ModelCustomSerializer):
         )
 
 
+class DriverHeartbeatSerializer(CustomSerializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90, required=True)
+    longitude = serializers.FloatField(min_value=-180, max_value=180, required=True)
+    is_online = serializers.BooleanField(default=True)
+    is_available = serializers.BooleanField(default=True)
+
+
 class VerificationCodeSerializer(CustomSerializer):
     email = serializers.EmailField(required=True)
     otp_code = serializers.CharField(max_length=4, min_length=4, required=True)
@@ -498,7 +524,7 @@ class VerificationCodeSerializer(CustomSerializer):
         return attrs
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializers user profile information"""
     full_name = serializers.ReadOnlyField()
     profile_photo_url = serializers.SerializerMethodField()
@@ -511,7 +537,11 @@ class UserProfileSerializer(serializers.ModelSerializer):
             "email", 
             "date_of_birth", 
             "profile_photo",
-            "profile_photo_url"
+            "profile_photo_url",
+            "rating",
+            "rating_average",
+            "rating_count",
+            "updated_at",
         )
 
     def get_profile_photo_url(self, obj):
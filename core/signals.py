@@ -1,6 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from core.models import User
+from core.helpers import zones
+from core.models import ServiceZone, User
 from allauth.account.signals import user_signed_up
 
 @receiver(post_save, sender=User)
@@ -16,4 +17,13 @@ def new_user_verification(sender, instance, created, **kwargs):
 
 @receiver(user_signed_up)
 def populate_profile(request, user, **kwargs):
-    User.objects.get_or_create(user=user)
\ No newline at end of file
+    User.objects.get_or_create(user=user)
+
+
+@receiver(post_save, sender=ServiceZone)
+@receiver(post_delete, sender=ServiceZone)
+def refresh_zone_index(sender, **kwargs):
+    """
+    This function makes every process reload the zone index
+    """
+    zones.invalidate()
@@ -1,3 +1,467 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import numpy as np
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework.views import APIView
+
+from core import middleware, renderers
+from core.helpers import auth_cleanup, fieldsets, geocoder, points, presence, telemetry, zones
+from core.helpers.geo import haversine_km
+from core.models import ConstantTable, PasswordResetToken, PointsBalance, PointsEntry, ServiceZone, User
+from core.serializer import CustomSerializerError
+from ride.models import Ride
+
+
+class UserMixin:
+    """A verified, active user for a test class, created once per class."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create(
+            email="rider@example.com", username="rider", first_name="A", last_name="B", is_verified=True, is_active=True
+        )
+
+
+class PointsLedgerTests(UserMixin, TestCase):
+    def test_fare_spends_whole_points_up_to_the_fare(self):
+        fare = ConstantTable.calculate_fare("NG", "ECONOMY", 10, 0, False)[0]
+        self.assertEqual(ConstantTable.calculate_fare("NG", "ECONOMY", 10, 0, False, points=5)[1:], (5, True, 0))
+        self.assertEqual(
+            ConstantTable.calculate_fare("NG", "ECONOMY", 10, 0, False, points=1000)[1:],
+            (int(fare), True, 1000 - int(fare)),
+        )
+        self.assertEqual(ConstantTable.redeem_points(fare, 1000), (int(fare), True, 1000 - int(fare)))
+
+    def test_credits_and_redemptions_fold_into_the_balance(self):
+        users = User.objects.filter(pk=self.user.pk)
+        self.assertEqual(points.credit_campaign("launch", 100, users, 10), 1)
+        self.assertEqual(points.credit_campaign("launch", 100, users, 10), 0)
+        ride = Ride.objects.create(user=self.user)
+        self.assertEqual(points.balance(self.user.pk, for_update=True), 100)
+        points.settle_ride(ride, redeemed=30, earned=5)
+        self.assertEqual(points.balance(self.user.pk), 75)
+
+        self.assertEqual(points.catch_up(now=timezone.now() + timedelta(minutes=1)), 3)
+        self.assertEqual(PointsBalance.objects.get(user=self.user).balance, 75)
+        points.settle_ride(Ride.objects.create(user=self.user), redeemed=0, earned=10)
+        self.assertEqual(points.balance(self.user.pk), 85)
+
+    def test_a_backdated_later_entry_does_not_skip_an_unsettled_earlier_one(self):
+        points.credit_campaign("launch", 100, User.objects.filter(pk=self.user.pk), 10)
+        points.settle_ride(Ride.objects.create(user=self.user), redeemed=0, earned=10)
+        later = PointsEntry.objects.get(reason="RIDE_EARN")
+        PointsEntry.objects.filter(pk=later.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+        # Only the second, higher-id entry is past the cutoff yet.
+        self.assertEqual(points.fold(), 0)
+        self.assertEqual(points.catch_up(now=timezone.now() + timedelta(minutes=1)), 2)
+        self.assertEqual(PointsBalance.objects.get(user=self.user).balance, 110)
+        self.assertEqual(points.balance(self.user.pk), 110)
+
+
+@override_settings(GEOCODER_MAX_DISTANCE_KM=2.0)
+class GeocoderTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        rng = np.random.default_rng(23)
+        self.latitudes, self.longitudes = 6.5 + rng.uniform(-0.3, 0.3, 3000), 3.4 + rng.uniform(-0.3, 0.3, 3000)
+        self.labels = [f"{index} Test Street" for index in range(3000)]
+        geocoder.build(self.latitudes, self.longitudes, self.labels, self.directory)
+
+    def test_nearest_matches_a_brute_force_scan(self):
+        tree = geocoder.Geocoder(self.directory)
+        self.assertEqual(len(tree), 3000)
+        rng = np.random.default_rng(29)
+        for latitude, longitude in zip(6.5 + rng.uniform(-0.35, 0.35, 200), 3.4 + rng.uniform(-0.35, 0.35, 200)):
+            distances = haversine_km(self.latitudes, self.longitudes, latitude, longitude)
+            label, distance_km = tree.nearest(latitude, longitude)
+            self.assertEqual(label, self.labels[int(distances.argmin())])
+            self.assertAlmostEqual(distance_km, distances.min(), delta=0.01)
+        self.assertIsNone(tree.nearest(7.5, 3.4, max_km=5.0))
+
+    def test_reverse_uses_the_built_gazetteer_within_range(self):
+        with override_settings(GEOCODER_DATA_DIR=self.directory):
+            self.addCleanup(geocoder.reload)
+            geocoder.reload()
+            self.assertEqual(geocoder.reverse(self.latitudes[42], self.longitudes[42]), self.labels[42])
+            self.assertIsNone(geocoder.reverse(7.5, 3.4))
+            self.assertIsNone(geocoder.reverse(None, 3.4))
+
+
+def _square(west, south, east, north):
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+class STRtreeTests(SimpleTestCase):
+    def test_query_matches_a_brute_force_scan(self):
+        rng = np.random.default_rng(17)
+        corners = rng.uniform(0, 100, (700, 2))
+        boxes = np.hstack([corners, corners + rng.uniform(0.5, 8, (700, 2))])
+        tree = zones.STRtree(boxes)
+
+        for x, y in rng.uniform(-5, 110, (300, 2)):
+            expected = np.flatnonzero((boxes[:, 0] <= x) & (x <= boxes[:, 2]) & (boxes[:, 1] <= y) & (y <= boxes[:, 3]))
+            self.assertEqual(sorted(tree.query(x, y).tolist()), expected.tolist())
+        self.assertEqual(len(zones.STRtree([]).query(1, 1)), 0)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "zone-tests"}},
+    ZONE_INDEX_CHECK_SECONDS=0,
+)
+class ServiceZoneTests(TestCase):
+    def setUp(self):
+        zones.invalidate()
+
+    def test_holes_priority_and_kind_are_respected(self):
+        city = ServiceZone(
+            name="City", kind="PRICING", priority=1,
+            geometry={"type": "Polygon", "coordinates": [_square(3.0, 6.0, 4.0, 7.0), _square(3.4, 6.4, 3.6, 6.6)]},
+        )
+        airport = ServiceZone(
+            name="Airport", kind="PRICING", priority=5,
+            geometry={"type": "MultiPolygon", "coordinates": [[_square(3.45, 6.45, 3.55, 6.55)], [_square(3.1, 6.1, 3.2, 6.2)]]},
+        )
+        index = zones.ZoneIndex([city, airport])
+
+        self.assertEqual(index.locate(6.15, 3.15), [airport, city])
+        self.assertEqual(index.locate(6.42, 3.42), [])
+        self.assertEqual(index.locate(6.5, 3.5), [airport])
+        self.assertEqual(index.locate(6.8, 3.8), [city])
+        self.assertEqual(index.locate(6.8, 3.8, kind="RESTRICTED"), [])
+        with self.assertRaises(zones.ZoneGeometryError):
+            zones.polygons({"type": "Point", "coordinates": [3.0, 6.0]})
+
+    def test_service_areas_and_restricted_zones_gate_requests(self):
+        self.assertTrue(zones.is_serviceable(6.5, 3.5, "NG"))
+        ServiceZone.objects.create(
+            name="Lagos", country_code="NG", kind="SERVICE_AREA",
+            geometry={"type": "Polygon", "coordinates": [_square(3.0, 6.0, 4.0, 7.0)]},
+        )
+        ServiceZone.objects.create(
+            name="Base", kind="RESTRICTED", geometry={"type": "Polygon", "coordinates": [_square(3.4, 6.4, 3.6, 6.6)]}
+        )
+        pricing = ServiceZone.objects.create(
+            name="Island", country_code="NG", kind="PRICING", fare_multiplier=1.5,
+            geometry={"type": "Polygon", "coordinates": [_square(3.7, 6.7, 3.9, 6.9)]},
+        )
+
+        self.assertTrue(zones.is_serviceable(6.2, 3.2, "NG"))
+        self.assertFalse(zones.is_serviceable(6.5, 3.5, "NG"))
+        self.assertFalse(zones.is_serviceable(8.0, 3.2, "NG"))
+        self.assertTrue(zones.is_serviceable(8.0, 3.2, "GH"))
+        self.assertEqual(zones.pricing_zone(6.8, 3.8, "NG"), pricing)
+        self.assertIsNone(zones.pricing_zone(6.8, 3.8, "GH"))
+
+
+@override_settings(PRESENCE_TTL_SECONDS=30, PRESENCE_CELL_PRECISION=5, PRESENCE_WHEEL_SLOT_SECONDS=1)
+class LocalPresenceTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = 1_700_000_000.0
+        patcher = mock.patch("time.time", side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(presence, "_backend", presence.LocalPresence())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_drivers_expire_once_their_heartbeat_times_out(self):
+        presence.heartbeat("driver-1", 6.52, 3.37, area="NG", vehicle_id="vehicle-1")
+        self.clock += 10
+        presence.heartbeat_many([{"driver_id": "driver-2", "latitude": 6.60, "longitude": 3.50, "area": "NG"}])
+
+        self.clock += 19
+        self.assertEqual(sorted(presence.online_in_area("NG")), ["driver-1", "driver-2"])
+        self.assertEqual(presence.online_near(6.52, 3.37), ["driver-1"])
+        self.assertEqual(presence.record("driver-1")["vehicle"], "vehicle-1")
+        self.assertEqual(presence.expire(), [])
+
+        self.clock += 2
+        self.assertFalse(presence.is_online("driver-1"))
+        self.assertEqual(presence.online(), ["driver-2"])
+        self.assertEqual(presence.expire(), ["driver-1"])
+        self.assertEqual(presence.expire(), [])
+        self.assertIsNone(presence.record("driver-1"))
+
+        self.clock += 1000
+        self.assertEqual(presence.expire(), ["driver-2"])
+        self.assertEqual(presence.online_in_area("NG"), [])
+
+    def test_a_new_heartbeat_moves_the_driver_and_extends_their_expiry(self):
+        presence.heartbeat("driver-1", 6.52, 3.37, area="NG")
+        self.clock += 25
+        presence.heartbeat("driver-1", 5.60, -0.19, area="GH")
+
+        self.clock += 25
+        self.assertTrue(presence.is_online("driver-1"))
+        self.assertEqual(presence.online_in_area("NG"), [])
+        self.assertEqual(presence.online_in_area("GH"), ["driver-1"])
+        self.assertEqual(presence.online_near(6.52, 3.37), [])
+        self.assertEqual(presence.expire(), [])
+
+        presence.go_offline("driver-1")
+        self.assertFalse(presence.is_online("driver-1"))
+        self.assertEqual(presence.online(), [])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "auth-cleanup-tests"}},
+    PASSWORD_RESET_TOKEN_RETENTION_HOURS=24,
+    OTP_EXPIRY_MINUTES=10,
+    AUTH_PURGE_BATCH=2,
+    AUTH_PURGE_PAUSE_SECONDS=0,
+)
+class AuthCleanupTests(UserMixin, TestCase):
+    def user_with_otp(self, name, minutes_ago):
+        user = User.objects.create(email=f"{name}@example.com", username=name, otp_code="hashed")
+        otp_created_at = None if minutes_ago is None else timezone.now() - timedelta(minutes=minutes_ago)
+        User.objects.filter(pk=user.pk).update(otp_created_at=otp_created_at)
+        return user.pk
+
+    def test_purge_spares_unexpired_tokens_and_fresh_codes(self):
+        now = timezone.now()
+        for hours_ago, is_used in ((30, False), (48, True), (25, False)):
+            PasswordResetToken.objects.create(user=self.user, expires_at=now - timedelta(hours=hours_ago), is_used=is_used)
+        retained = PasswordResetToken.objects.create(user=self.user, expires_at=now - timedelta(hours=2))
+        live = PasswordResetToken.objects.create(user=self.user)
+        stale = [self.user_with_otp("stale", 20), self.user_with_otp("legacy", None)]
+        fresh = self.user_with_otp("fresh", 5)
+
+        stats = auth_cleanup.purge(now)
+        self.assertEqual((stats["reset_tokens"], stats["otp_codes"]), (3, 2))
+        self.assertEqual(set(PasswordResetToken.objects.values_list("pk", flat=True)), {retained.pk, live.pk})
+        self.assertFalse(User.objects.filter(pk__in=stale, otp_code__isnull=False).exists())
+        self.assertEqual(User.objects.get(pk=fresh).otp_code, "hashed")
+        self.assertEqual(auth_cleanup.purge(now)["reset_tokens"], 0)
+        self.assertEqual(cache.get(auth_cleanup.LAST_RUN_KEY)["reset_tokens"], 0)
+
+
+@override_settings(API_PATH_PREFIXES=("/v1/",))
+class RouteAwareMiddlewareTests(SimpleTestCase):
+    CHAIN = (
+        middleware.XFrameOptionsMiddleware,
+        middleware.MessageMiddleware,
+        middleware.AuthenticationMiddleware,
+        middleware.CsrfViewMiddleware,
+        middleware.SessionMiddleware,
+    )
+
+    def view(self, request):
+        response = HttpResponse("ok")
+        response.seen = {name: hasattr(request, name) for name in ("session", "user", "_messages")}
+        return response
+
+    def get_response(self, request):
+        handler = self.view
+        for middleware_class in self.CHAIN:
+            handler = middleware_class(handler)
+        return handler(request)
+
+    def test_api_routes_skip_the_browser_middleware(self):
+        request = RequestFactory().post("/v1/ride/create/", {})
+        self.assertIsNone(middleware.CsrfViewMiddleware(self.view).process_view(request, self.view, (), {}))
+        response = self.get_response(request)
+        self.assertEqual(response.seen, {"session": False, "user": False, "_messages": False})
+        self.assertNotIn("X-Frame-Options", response)
+
+    def test_browser_routes_keep_sessions_csrf_and_frame_options(self):
+        request = RequestFactory().post("/admin/login/", {})
+        refused = middleware.CsrfViewMiddleware(self.view).process_view(request, self.view, (), {})
+        self.assertEqual(refused.status_code, 403)
+        response = self.get_response(RequestFactory().get("/admin/login/"))
+        self.assertEqual(response.seen, {"session": True, "user": True, "_messages": True})
+        self.assertEqual(response["X-Frame-Options"], "DENY")
+
+
+class RendererTests(SimpleTestCase):
+    def payload(self):
+        return {
+            "status": True,
+            "message": gettext_lazy("success"),
+            "id": uuid.UUID(int=7),
+            "price": Decimal("2500.50"),
+            "created_at": timezone.now(),
+            "duration": timedelta(minutes=5),
+            "stops": [{"seq": 1, "latitude": 6.52}],
+            3: "non-string key",
+        }
+
+    def test_orjson_matches_drf_json_and_round_trips(self):
+        data = self.payload()
+        rendered = renderers.ORJSONRenderer().render(data)
+        self.assertEqual(json.loads(rendered), json.loads(JSONRenderer().render(data)))
+        self.assertEqual(renderers.ORJSONParser().parse(io.BytesIO(rendered)), json.loads(rendered))
+        self.assertIn(b"\n  ", renderers.ORJSONRenderer().render(data, "application/json; indent=4"))
+        self.assertEqual(renderers.ORJSONRenderer().render(None), b"")
+
+    def test_msgpack_round_trips_the_same_payload(self):
+        data = self.payload()
+        rendered = renderers.MessagePackRenderer().render(data)
+        parsed = renderers.MessagePackParser().parse(io.BytesIO(rendered))
+        expected = json.loads(JSONRenderer().render(data))
+        self.assertEqual(parsed.pop(3), expected.pop("3"))
+        self.assertEqual(parsed, expected)
+        self.assertLess(len(rendered), len(renderers.ORJSONRenderer().render(data)))
+
+    def test_malformed_bodies_are_parse_errors(self):
+        with self.assertRaises(ParseError):
+            renderers.ORJSONParser().parse(io.BytesIO(b'{"status": '))
+        with self.assertRaises(ParseError):
+            renderers.MessagePackParser().parse(io.BytesIO(b"\xc1"))
+
+    def test_clients_negotiate_msgpack(self):
+        class EchoView(APIView):
+            authentication_classes = permission_classes = []
+
+            def post(self, request):
+                return Response({"status": True, "echo": request.data})
+
+        factory = APIRequestFactory()
+        request = factory.post(
+            "/v1/echo/", renderers.MessagePackRenderer().render({"seats": 2}),
+            content_type="application/msgpack", HTTP_ACCEPT="application/msgpack",
+        )
+        response = EchoView.as_view()(request).render()
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(renderers.MessagePackParser().parse(io.BytesIO(response.content)), {"status": True, "echo": {"seats": 2}})
+
+        response = EchoView.as_view()(factory.post("/v1/echo/", {"seats": 2}, format="json")).render()
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(json.loads(response.content), {"status": True, "echo": {"seats": 2}})
+
+
+class FieldsetTests(SimpleTestCase):
+    def request(self, query):
+        return Request(APIRequestFactory().get(f"/v1/ride/ride_status/{query}"))
+
+    def test_fields_and_deltas_are_parsed_and_applied(self):
+        self.assertIsNone(fieldsets.requested_fields(self.request("")))
+        self.assertIsNone(fieldsets.requested_fields(self.request("?fields=,")))
+        fields = fieldsets.requested_fields(self.request("?fields=price, ride_status,"))
+        self.assertEqual(fields, {"price", "ride_status"})
+
+        data = {"id": "ride", "version": 3, "price": 2500.0, "ride_status": "ACCEPTED", "driver": "driver"}
+        self.assertIs(fieldsets.select(data, None), data)
+        self.assertEqual(fieldsets.select(data, fields, keep=("id",)), {"id": "ride", "price": 2500.0, "ride_status": "ACCEPTED"})
+        old = {"id": "ride", "version": 2, "price": 2500.0, "ride_status": "PENDING"}
+        self.assertEqual(
+            fieldsets.changed(old, data, keep=("id",)),
+            {"id": "ride", "version": 3, "ride_status": "ACCEPTED", "driver": "driver"},
+        )
+
+    def test_cursors_are_validated(self):
+        self.assertIsNone(fieldsets.since_version(self.request("")))
+        self.assertEqual(fieldsets.since_version(self.request("?since_version=4")), 4)
+        self.assertEqual(
+            fieldsets.since(self.request("?since=2026-01-02T03:04:05+01:00")).isoformat(), "2026-01-02T03:04:05+01:00"
+        )
+        # An unescaped "+" arrives as a space.
+        self.assertEqual(fieldsets.since(self.request("?since=2026-01-02T03:04:05 01:00")).utcoffset(), timedelta(hours=1))
+        self.assertTrue(timezone.is_aware(fieldsets.since(self.request("?since=2026-01-02T03:04:05"))))
+        with self.assertRaises(CustomSerializerError):
+            fieldsets.since_version(self.request("?since_version=latest"))
+        for query in ("?since=yesterday", "?since=2026-13-40T00:00:00"):
+            with self.assertRaises(CustomSerializerError):
+                fieldsets.since(self.request(query))
+
+
+class SparseProfileTests(UserMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_profile_honours_fields_and_since(self):
+        body = self.client.get("/v1/auth/user_profile/?fields=email").json()
+        self.assertEqual(set(body), {"updated_at", "email"})
+        self.assertEqual(body["email"], "rider@example.com")
+
+        self.user.refresh_from_db()
+        since = self.user.updated_at.isoformat().replace("+", "%2B")
+        self.assertEqual(self.client.get(f"/v1/auth/user_profile/?since={since}").status_code, 304)
+        earlier = (self.user.updated_at - timedelta(seconds=1)).isoformat().replace("+", "%2B")
+        self.assertEqual(self.client.get(f"/v1/auth/user_profile/?since={earlier}").status_code, 200)
+        self.assertEqual(self.client.get("/v1/auth/user_profile/?since=yesterday").status_code, 400)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "telemetry-tests"}},
+    MQTT_TELEMETRY_TOPIC="qglide/drivers/+/telemetry",
+    PRESENCE_TTL_SECONDS=30,
+)
+class TelemetryTests(TestCase):
+    driver = str(uuid.UUID(int=1))
+    topic = f"qglide/drivers/{driver}/telemetry"
+
+    def setUp(self):
+        patcher = mock.patch.object(presence, "_backend", presence.LocalPresence())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_decode_accepts_fresh_pings(self):
+        now = 1_700_000_000
+        self.assertEqual(
+            telemetry.decode(self.topic, msgpack.packb([6.52, 3, True, False, now - 5]), now=now),
+            (self.driver, {"latitude": 6.52, "longitude": 3.0, "is_online": True, "is_available": False, "sent_at": now - 5}),
+        )
+        self.assertIsNone(telemetry.decode(self.topic, msgpack.packb([6.52, 3.37, True, True]))[1]["sent_at"])
+
+    def test_decode_rejects_stale_or_malformed_messages(self):
+        now = 1_700_000_000
+        for topic, payload in (
+            ("qglide/drivers/not-a-uuid/telemetry", [6.52, 3.37, True, True]),
+            (f"qglide/{self.driver}/telemetry", [6.52, 3.37, True, True]),
+            (self.topic, [6.52, 3.37, True, True, now - 31]),
+            (self.topic, [6.52, 3.37, True, True, True]),
+            (self.topic, [6.52, 3.37, True, True, "now"]),
+            (self.topic, [6.52, 3.37, 1, True]),
+            (self.topic, [91.0, 3.37, True, True]),
+            (self.topic, [6.52, float("nan"), True, True]),
+            (self.topic, [True, 3.37, True, True]),
+            (self.topic, [6.52, 3.37, True]),
+            (self.topic, {"latitude": 6.52}),
+        ):
+            with self.subTest(topic=topic, payload=payload), self.assertRaises(telemetry.InvalidTelemetry):
+                telemetry.decode(topic, msgpack.packb(payload), now=now)
+        for payload in (b"\xc1", msgpack.packb([6.52, 3.37, True, True]) + b"\x00"):
+            with self.assertRaises(telemetry.InvalidTelemetry):
+                telemetry.decode(self.topic, payload, now=now)
+
+    def test_batches_keep_the_newest_ping_and_apply_it_to_presence(self):
+        batch = telemetry.TelemetryBatch()
+        batch.add(self.driver, {"latitude": 6.52, "longitude": 3.37, "is_online": True, "is_available": True, "sent_at": 20})
+        batch.add(self.driver, {"latitude": 6.50, "longitude": 3.30, "is_online": True, "is_available": True, "sent_at": 10})
+        self.assertEqual(batch.drain()[self.driver]["sent_at"], 20)
+        self.assertEqual(batch.drain(), {})
+
+        offline, unknown = str(uuid.UUID(int=2)), str(uuid.UUID(int=3))
+        presence.heartbeat(self.driver, 6.0, 3.0, area="NG", vehicle_id="vehicle-1", ride_type="ECONOMY")
+        presence.heartbeat(offline, 6.0, 3.0, area="NG", vehicle_id="vehicle-2")
+        messages = {
+            self.driver: {"latitude": 6.52, "longitude": 3.37, "is_online": True, "is_available": False, "sent_at": None},
+            offline: {"latitude": 6.52, "longitude": 3.37, "is_online": False, "is_available": False, "sent_at": None},
+            unknown: {"latitude": 6.52, "longitude": 3.37, "is_online": True, "is_available": True, "sent_at": None},
+        }
+
+        self.assertEqual(telemetry.apply(messages), (2, 1))
+        self.assertEqual(presence.online(), [self.driver])
+        record = presence.record(self.driver)
+        self.assertEqual((record["latitude"], record["vehicle"], record["ride_type"]), (6.52, "vehicle-1", "ECONOMY"))
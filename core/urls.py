@@ -65,6 +65,7 @@ urlpatterns = [
     path("fetch_vehicle_registration_admin/", views.FetchVehicleRegistrationAdminAPIView.as_view(), name="fetch_vehicle_registration_admin"),
     path("verify_email/", views.VerificationAPIView.as_view(), name="verify-email"),
     path("user_profile/", views.GetUserProfileAPIView.as_view(), name="user-profile"),
+    path("points/", views.PointsBalanceAPIView.as_view(), name="points-balance"),
         path(
         "update_user_profile/",
         views.UpdateUserProfileAPIView.as_view(),
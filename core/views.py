@@ -1,6 +1,7 @@
 from django.shortcuts import render
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.db.models import Count, Max, Sum
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import render
 from django.utils import timezone
@@ -11,11 +12,13 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from core.helpers.brevor import BervorApi
+from core.helpers import etags, fieldsets, points, presence
 from core.helpers.func import generate_verification_code
 from core.helpers.mailersend import MailerSendApi
-from core.models import User, VehicleRegistration, VehicleSettings
+from core.models import PointsEntry, User, VehicleRegistration, VehicleSettings
 from core.permissions import UserIsActive
-from core.serializer import ChangeForgotPasswordSerializer, ChangeUserPasswordSerializer, DriverLoginRequestSerializer, DriverRegistrationSerializer, DriverSigninSerializer, FetchVehicleRegistrationAdminSerializer, FetchVehicleRegistrationSerializer, FetchVehicleTypeSerializer, ForgotPasswordSerializer, GoogleSigninSerializer, GoogleSignupSerializer, RegistrationSerializer, ResetPasswordSerializer, UserProfileSerializer, VehicleRegistrationSerializer, VerificationCodeSerializer
+from core.serializer import ChangeForgotPasswordSerializer, ChangeUserPasswordSerializer, DriverHeartbeatSerializer, DriverLoginRequestSerializer, DriverRegistrationSerializer, DriverSigninSerializer, FetchVehicleRegistrationAdminSerializer, FetchVehicleRegistrationSerializer, FetchVehicleTypeSerializer, ForgotPasswordSerializer, GoogleSigninSerializer, GoogleSignupSerializer, RegistrationSerializer, ResetPasswordSerializer, UserProfileSerializer, VehicleRegistrationSerializer, VerificationCodeSerializer
+from ride.helpers import surge
 from ride.models import Ride
 from allauth.socialaccount.providers.google.views import GoogleOAuth2Adapter
 import requests
@@ -89,7 +92,8 @@ class VehicleRegistrationAPIView(APIView):
         serializer.is_valid(raise_exception=True)
         serializer.save()
         if previous_vehicle:
-            previous_vehicle.update(is_deleted=True, is_active=False, deleted_at=timezone.now())
+            now = timezone.now()
+            previous_vehicle.update(is_deleted=True, is_active=False, deleted_at=now, updated_at=now)
 
         # send_user_welcome_email(email=email, otp_code=un_hashed_otp_code)
         return Response(
@@ -118,6 +122,10 @@ class FetchVehicleTypeAPIView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
+        since = fieldsets.since(self.request)
+        if since is not None:
+            # Deactivated types are part of the delta so clients can drop them.
+            return VehicleSettings.objects.filter(updated_at__gt=since)
 
         all_vehicle_type = VehicleSettings.objects.filter(is_active=True)
 
@@ -125,6 +133,13 @@ class FetchVehicleTypeAPIView(generics.ListAPIView):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
+        summary = queryset.aggregate(latest=Max("updated_at"), count=Count("id"))
+        etag = etags.make(request, summary["latest"], summary["count"])
+        cached = etags.not_modified(request, etag)
+        if cached is not None:
+            return cached
+        if fieldsets.since(request) is not None and not summary["count"]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(queryset, request)
         serializer = self.get_serializer(page, many=True)
@@ -134,7 +149,7 @@ class FetchVehicleTypeAPIView(generics.ListAPIView):
             "previous": paginator.get_previous_link(),
             "results": serializer.data,
         }
-        return Response(response_data, status=status.HTTP_200_OK)
+        return etags.tagged(Response(response_data, status=status.HTTP_200_OK), etag)
     
 
 class FetchVehicleTypeAdminAPIView(generics.ListAPIView):
@@ -191,6 +206,10 @@ class FetchVehicleRegistrationAPIView(generics.ListAPIView):
         return super().get(request, *args, **kwargs)
 
     def get_queryset(self):
+        since = fieldsets.since(self.request)
+        if since is not None:
+            # Deleted registrations are part of the delta so clients can drop them.
+            return VehicleRegistration.objects.filter(user=self.request.user, updated_at__gt=since)
 
         all_vehicle_registration = VehicleRegistration.objects.filter(is_deleted=False, user=self.request.user)
 
@@ -198,6 +217,13 @@ class FetchVehicleRegistrationAPIView(generics.ListAPIView):
 
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_queryset())
+        summary = queryset.aggregate(latest=Max("updated_at"), count=Count("id"))
+        etag = etags.make(request, request.user.pk, summary["latest"], summary["count"])
+        cached = etags.not_modified(request, etag)
+        if cached is not None:
+            return cached
+        if fieldsets.since(request) is not None and not summary["count"]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
         paginator = self.pagination_class()
         page = paginator.paginate_queryset(queryset, request)
         serializer = self.get_serializer(page, many=True)
@@ -207,7 +233,7 @@ class FetchVehicleRegistrationAPIView(generics.ListAPIView):
             "previous": paginator.get_previous_link(),
             "results": serializer.data,
         }
-        return Response(response_data, status=status.HTTP_200_OK)
+        return etags.tagged(Response(response_data, status=status.HTTP_200_OK), etag)
     
 
 class FetchVehicleRegistrationAdminAPIView(generics.ListAPIView):
@@ -361,8 +387,15 @@ class GetUserProfileAPIView(APIView):
         tags=['Rider/User']
     )
     def get(self, request):
+        etag = etags.make(request, request.user.pk, request.user.updated_at.isoformat())
+        cached = etags.not_modified(request, etag)
+        if cached is not None:
+            return cached
+        since = fieldsets.since(request)
+        if since is not None and request.user.updated_at <= since:
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
         serializer = self.serializer_class(request.user, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return etags.tagged(Response(serializer.data, status=status.HTTP_200_OK), etag)
     
 class UpdateUserProfileAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive]
@@ -414,6 +447,8 @@ class ForgotPasswordAPIView(APIView):
 
         # Create password reset token
         from core.models import PasswordResetToken
+        # Only the newest link works; earlier unused ones would just wait for purge_auth_state.
+        PasswordResetToken.objects.filter(user=user, is_used=False).delete()
         reset_token = PasswordResetToken.objects.create(user=user)
         
         # Generate reset link
@@ -736,4 +771,80 @@ class DriverSigninView(TokenObtainPairView):
         tags=['Driver']
     )
     def post(self, request, *args, **kwargs):
-        return super().post(request, *args, **kwargs)
\ No newline at end of file
+        return super().post(request, *args, **kwargs)
+
+
+class DriverHeartbeatAPIView(APIView):
+    """Keep a driver online; the driver app calls this every few seconds while on duty."""
+    permission_classes = [IsAuthenticated, UserIsActive]
+    serializer_class = DriverHeartbeatSerializer
+
+    @swagger_auto_schema(request_body=DriverHeartbeatSerializer, tags=['Driver'])
+    def post(self, request):
+        """Handle HTTP POST request."""
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        latitude = serializer.validated_data.get("latitude")
+        longitude = serializer.validated_data.get("longitude")
+
+        if not serializer.validated_data.get("is_online"):
+            presence.go_offline(request.user.id)
+            return Response({
+                "status": True,
+                "message": "Rider is offline",
+            }, status=status.HTTP_200_OK)
+
+        # The vehicle is looked up once per session and then carried in the presence record.
+        current = presence.record(request.user.id)
+        if current and current["vehicle"]:
+            vehicle = (current["vehicle"], current["ride_type"], current["vehicle_type"])
+        else:
+            vehicle = (
+                VehicleRegistration.objects.filter(user=request.user, is_active=True, is_deleted=False)
+                .order_by("-created_at")
+                .values_list("id", "vehichle_type__ride_type", "vehichle_type__vehicle_type")
+                .first()
+            )
+            if vehicle is None:
+                return Response({
+                    "status": False,
+                    "message": "Rider has no active vehicle",
+                }, status=status.HTTP_403_FORBIDDEN)
+
+        presence.heartbeat(
+            request.user.id,
+            latitude,
+            longitude,
+            area=request.user.country_code,
+            vehicle_id=vehicle[0],
+            ride_type=vehicle[1],
+            vehicle_type=vehicle[2],
+        )
+        if serializer.validated_data.get("is_available"):
+            surge.record_supply(request.user.id, latitude, longitude)
+        return Response({
+            "status": True,
+            "message": "success",
+            "ttl": settings.PRESENCE_TTL_SECONDS,
+        }, status=status.HTTP_200_OK)
+
+
+class PointsBalanceAPIView(APIView):
+    permission_classes = [IsAuthenticated, UserIsActive]
+
+    @swagger_auto_schema(
+        operation_description="Loyalty points balance and latest ledger entries",
+        tags=['Rider/User']
+    )
+    def get(self, request):
+        entries = (
+            PointsEntry.objects.filter(user=request.user)
+            .order_by("-id")
+            .values("amount", "reason", "ride_id", "campaign", "created_at")[:20]
+        )
+        return Response({
+            "status": True,
+            "message": "success",
+            "balance": points.balance(request.user.pk),
+            "entries": list(entries),
+        }, status=status.HTTP_200_OK)
@@ -3,7 +3,15 @@ from import_export.admin import ImportExportModelAdmin
 
 from . import resources
 from .models import (
-    Ride
+    DeliveryRoute,
+    DriverDailyStats,
+    EarningsRollup,
+    ProjectionCheckpoint,
+    Ride,
+    RideEvent,
+    RideFunnelDaily,
+    RidePool,
+    ZoneHourlyDemand,
 )
 # Register your models here.
 
@@ -17,4 +25,71 @@ class RideResourceAdmin(ImportExportModelAdmin):
     
 
 
-admin.site.register(Ride, RideResourceAdmin)
\ No newline at end of file
+class RidePoolResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.RidePoolResource
+
+    list_filter = ["is_active"]
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class DeliveryRouteResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.DeliveryRouteResource
+
+    list_filter = ["is_active"]
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class RideEventResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.RideEventResource
+
+    list_filter = ["to_status"]
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class ProjectionCheckpointResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.ProjectionCheckpointResource
+
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class DriverDailyStatsResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.DriverDailyStatsResource
+
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class ZoneHourlyDemandResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.ZoneHourlyDemandResource
+
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class RideFunnelDailyResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.RideFunnelDailyResource
+
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+class EarningsRollupResourceAdmin(ImportExportModelAdmin):
+    resource_class = resources.EarningsRollupResource
+
+    def get_list_display(self, request):
+        return [field.name for field in self.model._meta.concrete_fields]
+
+
+admin.site.register(Ride, RideResourceAdmin)
+admin.site.register(RidePool, RidePoolResourceAdmin)
+admin.site.register(DeliveryRoute, DeliveryRouteResourceAdmin)
+admin.site.register(RideEvent, RideEventResourceAdmin)
+admin.site.register(ProjectionCheckpoint, ProjectionCheckpointResourceAdmin)
+admin.site.register(DriverDailyStats, DriverDailyStatsResourceAdmin)
+admin.site.register(ZoneHourlyDemand, ZoneHourlyDemandResourceAdmin)
+admin.site.register(RideFunnelDaily, RideFunnelDailyResourceAdmin)
+admin.site.register(EarningsRollup, EarningsRollupResourceAdmin)
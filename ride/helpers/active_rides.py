@@ -0,0 +1,307 @@
+"""
+Write-through cache of every user's and driver's open rides.
+
+Permission classes, views and `RideStatusAPIView` all ask "what is this
+person's open ride and what state is it in?". Each user and driver gets one
+hash, `active_ride:user:{id}` / `active_ride:driver:{id}`, with a field per
+ride holding "version|closed_at|payload". `Ride.save` bumps `Ride.version`
+under the row lock of its UPDATE, so versions follow commit order, and
+publishes the saved state once the transaction commits. A field is only
+replaced by a higher version, so callbacks that run out of order, or a reader
+filling the hash from a stale database read, can never roll a ride back.
+Closed rides stay as tombstones for TOMBSTONE_SECONDS so a late write for them
+is still rejected. Each published state is also kept in the default cache for
+RIDE_STATUS_HISTORY_SECONDS, whichever store is selected, as the base
+ride_status/ diffs delta responses against.
+
+A hash is only trusted once it carries the LOADED field, which is set by the
+first read that filled it from the database; until then (or after it expires)
+reads fall through to PostgreSQL. Both roles can hold several open rides (a
+driver on a pool or delivery route), hence a hash and not a single value;
+a driver's transition names its ride with `ride_id`, or else moves the ride
+whose stop comes first on the pool or route.
+
+ACTIVE_RIDE_CACHE picks the store: "redis" (the default with REDIS_URL),
+"local" for single-process deployments and tests, or "off" to always query
+the database.
+"""
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+USER_KEY = "active_ride:user:{id}"
+DRIVER_KEY = "active_ride:driver:{id}"
+HISTORY_KEY = "ride_status:{id}:{version}"
+LOADED = "loaded"
+TOMBSTONE_SECONDS = 3600
+# Open rides that are under way, as opposed to SCHEDULED bookings.
+IN_PROGRESS_STATUSES = ("PENDING", "ACCEPTED", "WAITING", "RIDE_START", "RIDE_END")
+
+# KEYS[1] the hash; ARGV: ttl, tombstone floor, mark loaded (0/1), then ride/value pairs.
+MERGE_SCRIPT = """
+local ttl, floor = tonumber(ARGV[1]), tonumber(ARGV[2])
+for i = 4, #ARGV, 2 do
+  local current = redis.call('HGET', KEYS[1], ARGV[i])
+  if not current or tonumber(string.match(current, '^(%d+)|')) < tonumber(string.match(ARGV[i + 1], '^(%d+)|')) then
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+  end
+end
+if ARGV[3] == '1' then
+  redis.call('HSET', KEYS[1], 'loaded', '1')
+end
+local fields = redis.call('HGETALL', KEYS[1])
+for i = 1, #fields, 2 do
+  local closed = tonumber(string.match(fields[i + 1], '^%d+|(%d+)|'))
+  if closed and closed > 0 and closed < floor then
+    redis.call('HDEL', KEYS[1], fields[i])
+  end
+end
+redis.call('EXPIRE', KEYS[1], ttl)
+return 1
+"""
+
+
+def _encode(version, closed_at, payload):
+    return f"{version}|{closed_at}|{json.dumps(payload, cls=DjangoJSONEncoder)}"
+
+
+def _version(value):
+    return int(value.split("|", 1)[0])
+
+
+def _closed_at(value):
+    return int(value.split("|", 2)[1])
+
+
+def _decode(value):
+    return json.loads(value.split("|", 2)[2])
+
+
+class RedisStore:
+    def __init__(self):
+        from django_redis import get_redis_connection
+
+        self.redis = get_redis_connection("default")
+        self.merge_script = self.redis.register_script(MERGE_SCRIPT)
+
+    def merge(self, entries, loaded=False):
+        """Apply {key: {ride: value}}; older versions than the stored ones are ignored."""
+        floor = int(time.time()) - TOMBSTONE_SECONDS
+        pipe = self.redis.pipeline(transaction=False)
+        for key, values in entries.items():
+            args = [settings.ACTIVE_RIDE_CACHE_TTL, floor, int(loaded)]
+            for ride, value in values.items():
+                args.extend([ride, value])
+            self.merge_script(keys=[key], args=args, client=pipe)
+        pipe.execute()
+
+    def read(self, key):
+        values = self.redis.hgetall(key)
+        if values.get(LOADED.encode()) is None:
+            return None
+        return {ride.decode(): value.decode() for ride, value in values.items() if ride.decode() != LOADED}
+
+
+class LocalStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hashes = {}
+
+    def merge(self, entries, loaded=False):
+        now = time.time()
+        floor = int(now) - TOMBSTONE_SECONDS
+        with self.lock:
+            for key, values in entries.items():
+                expires_at, fields = self.hashes.get(key, (0, {}))
+                if expires_at <= now:
+                    fields = {}
+                for ride, value in values.items():
+                    current = fields.get(ride)
+                    if current is None or _version(current) < _version(value):
+                        fields[ride] = value
+                if loaded:
+                    fields[LOADED] = "1"
+                fields = {
+                    ride: value
+                    for ride, value in fields.items()
+                    if ride == LOADED or not 0 < _closed_at(value) < floor
+                }
+                self.hashes[key] = (now + settings.ACTIVE_RIDE_CACHE_TTL, fields)
+
+    def read(self, key):
+        expires_at, fields = self.hashes.get(key, (0, {}))
+        if expires_at <= time.time() or LOADED not in fields:
+            return None
+        return {ride: value for ride, value in fields.items() if ride != LOADED}
+
+
+class NoStore:
+    def merge(self, entries, loaded=False):
+        pass
+
+    def read(self, key):
+        return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = {"redis": RedisStore, "local": LocalStore}.get(settings.ACTIVE_RIDE_CACHE, NoStore)()
+    return _store
+
+
+def reset():
+    """Drop the store so the next call picks ACTIVE_RIDE_CACHE again (tests, settings changes)."""
+    global _store
+    with _store_lock:
+        _store = None
+
+
+def snapshot(row):
+    """Field name and encoded value of a ride's current state, from a RideStatusReader row."""
+    from ride.serializer import ride_status_reader
+
+    is_open = not row["is_completed"] and row["ride_status"] != "CANCELLED"
+    payload = {
+        "status": row["ride_status"],
+        "created": row["created_at"].timestamp(),
+        "data": ride_status_reader.to_representation(row) if is_open else None,
+    }
+    return str(row["id"]), _encode(row["version"], 0 if is_open else int(time.time()), payload)
+
+
+def _keys(user_id, driver_id):
+    keys = [USER_KEY.format(id=user_id)] if user_id else []
+    if driver_id:
+        keys.append(DRIVER_KEY.format(id=driver_id))
+    return keys
+
+
+def publish(ride):
+    """Write the ride's state to its user's and driver's hashes, and to its history, after the current transaction commits."""
+    keys = _keys(ride.user_id, ride.driver_id)
+    if not keys:
+        return
+    from ride.serializer import ride_status_reader
+
+    # Read back inside the transaction: the saved row, its version and the driver/vehicle summaries in one query.
+    row = ride_status_reader.rows(pk=ride.pk).get()
+    field, value = snapshot(row)
+
+    def write():
+        # The history backs ride_status/ deltas, so it is kept even with ACTIVE_RIDE_CACHE off.
+        if not isinstance(store(), NoStore):
+            store().merge({key: {field: value} for key in keys})
+        cache.set(HISTORY_KEY.format(id=field, version=row["version"]), value, settings.RIDE_STATUS_HISTORY_SECONDS)
+
+    transaction.on_commit(write)
+
+
+def state_at(ride_id, version):
+    """The status payload `ride_id` had at `version`, while it is still kept for delta responses."""
+    value = cache.get(HISTORY_KEY.format(id=ride_id, version=version))
+    return None if value is None else _decode(value)["data"]
+
+
+def publish_closed(rows, status):
+    """Tombstone rides closed by a bulk UPDATE, which bypasses Ride.save.
+
+    `rows` are dicts with id, user_id, driver_id, version and created_at read
+    back after the UPDATE in the same transaction.
+    """
+    if isinstance(store(), NoStore):
+        return
+    closed_at = int(time.time())
+    entries = {}
+    for row in rows:
+        value = _encode(row["version"], closed_at, {"status": status, "created": row["created_at"].timestamp(), "data": None})
+        for key in _keys(row["user_id"], row["driver_id"]):
+            entries.setdefault(key, {})[str(row["id"])] = value
+    if entries:
+        transaction.on_commit(lambda: store().merge(entries))
+
+
+def _load(role, person_id):
+    from ride.serializer import ride_status_reader
+
+    rows = ride_status_reader.rows(is_completed=False, **{f"{role}_id": person_id}).exclude(ride_status="CANCELLED")
+    values = dict(snapshot(row) for row in rows)
+    key = (USER_KEY if role == "user" else DRIVER_KEY).format(id=person_id)
+    store().merge({key: values}, loaded=True)
+    # A transition that committed meanwhile may already be newer than what was read.
+    merged = store().read(key)
+    return values if merged is None else merged
+
+
+def open_rides(user=None, driver=None):
+    """{ride id: {"status": .., "data": ..}} of the open rides of a user or a driver, newest first."""
+    role, person = ("user", user) if user is not None else ("driver", driver)
+    person_id = getattr(person, "pk", person)
+    values = store().read((USER_KEY if role == "user" else DRIVER_KEY).format(id=person_id))
+    if values is None:
+        values = _load(role, person_id)
+    rides = {ride: _decode(value) for ride, value in values.items() if not _closed_at(value)}
+    return dict(sorted(rides.items(), key=lambda item: item[1]["created"], reverse=True))
+
+
+def _stop_order(driver_id):
+    """Ride ids in the stop order of the driver's active pool and delivery route."""
+    from ride.models import DeliveryRoute, RidePool
+
+    order = []
+    for model in (RidePool, DeliveryRoute):
+        for stops in model.objects.filter(driver_id=driver_id, is_active=True).values_list("stops", flat=True):
+            order.extend(stop["ride"] for stop in stops)
+    return order
+
+
+def current(user=None, driver=None, statuses=None, ride_id=None):
+    """(ride id, state) of an open ride, optionally in one of `statuses`, or None.
+
+    With `ride_id`, that ride if it is one of them. Otherwise the newest, except
+    for a driver with several (a pool or delivery route): the one whose stop
+    comes first.
+    """
+    rides = {
+        ride: state
+        for ride, state in open_rides(user=user, driver=driver).items()
+        if statuses is None or state["status"] in statuses
+    }
+    if ride_id is not None:
+        ride_id = str(ride_id)
+        return (ride_id, rides[ride_id]) if ride_id in rides else None
+    if driver is not None and len(rides) > 1:
+        for ride in _stop_order(getattr(driver, "pk", driver)):
+            if ride in rides:
+                return ride, rides[ride]
+    return next(iter(rides.items()), None)
+
+
+def get_ride(user=None, driver=None, statuses=None, ride_id=None):
+    """The Ride row behind `current`, fetched by primary key."""
+    from ride.models import Ride
+
+    found = current(user=user, driver=driver, statuses=statuses, ride_id=ride_id)
+    if found is None:
+        return None
+    ride = Ride.objects.filter(pk=found[0], is_completed=False).first()
+    if ride is None or (statuses is not None and ride.ride_status not in statuses):
+        return None
+    return ride
+
+
+def requested_id(request):
+    """The `ride_id` a transition names in its body or query string, if any."""
+    ride_id = request.data.get("ride_id") if hasattr(request.data, "get") else None
+    return ride_id or request.query_params.get("ride_id") or None
@@ -0,0 +1,31 @@
+"""
+Fills a ride's missing address fields from the offline reverse geocoder
+(core/helpers/geocoder.py), so clients no longer need a third-party geocoding
+call on every status change.
+"""
+from core.helpers import geocoder
+
+ADDRESS_FIELDS = (
+    ("user_location_latitude", "user_location_longitude", "user_location_address"),
+    ("user_pickup_latitude", "user_pickup_longitude", "user_pickup_address"),
+    ("user_ride_end_latitude", "user_ride_end_longitude", "user_ride_end_address"),
+    ("driver_pickup_latitude", "driver_pickup_longitude", "driver_pickup_address"),
+    ("driver_waiting_latitude", "driver_waiting_longitude", "driver_waiting_address"),
+    ("driver_ride_end_latitude", "driver_ride_end_longitude", "driver_ride_end_address"),
+)
+
+
+def fill_missing(ride):
+    """Set every empty address whose coordinates are known; returns the fields filled."""
+    if geocoder.get_geocoder() is None:
+        return []
+    filled = []
+    for latitude_field, longitude_field, address_field in ADDRESS_FIELDS:
+        latitude, longitude = getattr(ride, latitude_field), getattr(ride, longitude_field)
+        if getattr(ride, address_field) or latitude is None or longitude is None:
+            continue
+        address = geocoder.reverse(latitude, longitude)
+        if address:
+            setattr(ride, address_field, address[:255])
+            filled.append(address_field)
+    return filled
@@ -0,0 +1,198 @@
+"""
+Batch-optimal assignment of PENDING rides to available drivers.
+
+Every DISPATCH_INTERVAL_SECONDS the `run_batch_dispatch` command collects the
+open requests of each zone (a geohash prefix of DISPATCH_ZONE_PRECISION) and
+the available drivers in that cell and its eight neighbours, so a driver just
+across a cell boundary is still a candidate, builds a pickup-ETA cost matrix
+from the ETA matrix cache and solves it with scipy's `linear_sum_assignment`,
+a vectorized Jonker-Volgenant (Hungarian family) solver. Zones are solved one
+after another and a driver matched in one is not offered to the next. Pairs whose ride_type/vehicle_type
+do not match the driver's vehicle, or whose pickup would take longer than
+DISPATCH_MAX_PICKUP_SECONDS, are infeasible.
+"""
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from scipy.optimize import linear_sum_assignment
+
+from core.helpers import geo
+from ride.helpers import eta_matrix, pooling
+from ride.helpers.driver_locations import available_drivers
+from ride.models import Ride
+
+logger = logging.getLogger(__name__)
+
+# Larger than any sum of feasible costs in a batch, so the solver maximises the
+# number of feasible matches before minimising their total ETA.
+INFEASIBLE = 1e9
+
+
+class OpenRequests:
+    """Column-oriented snapshot of PENDING rides in arrival order."""
+
+    def __init__(self, ride_ids, ride_types, vehicle_types, latitudes, longitudes):
+        self.ride_ids = ride_ids
+        self.ride_types = np.asarray(ride_types, dtype=object)
+        self.vehicle_types = np.asarray(vehicle_types, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ride_ids)
+
+    def subset(self, mask):
+        index = np.flatnonzero(mask)
+        return OpenRequests(
+            [self.ride_ids[i] for i in index],
+            self.ride_types[index],
+            self.vehicle_types[index],
+            self.latitudes[index],
+            self.longitudes[index],
+        )
+
+
+def pending_requests(area, limit=None):
+    rides = Ride.objects.filter(
+        user__country_code=area,
+        ride_status="PENDING",
+        is_completed=False,
+        driver__isnull=True,
+        user_pickup_latitude__isnull=False,
+        user_pickup_longitude__isnull=False,
+    )
+    if settings.DELIVERY_BATCHING:
+        # Packages wait for their window and are routed by ride/helpers/delivery.py.
+        rides = rides.exclude(vehicle_type="PACKAGE_DELIVERY")
+    rides = (
+        rides.order_by("created_at")
+        .values_list("id", "ride_type", "vehicle_type", "user_pickup_latitude", "user_pickup_longitude")
+    )
+    columns = list(zip(*rides[: limit or settings.DISPATCH_BATCH_MAX])) or [[], [], [], [], []]
+    return OpenRequests(*[list(column) for column in columns])
+
+
+def cost_matrix(drivers, requests, area):
+    """Drivers x requests pickup ETA in seconds (INFEASIBLE where not allowed) and distance in km."""
+    matrix = eta_matrix.get_matrix(area)
+    if matrix is None:
+        distance_km, eta_seconds = eta_matrix.estimate(
+            drivers.latitudes[:, None],
+            drivers.longitudes[:, None],
+            requests.latitudes[None, :],
+            requests.longitudes[None, :],
+        )
+    else:
+        distance_km, eta_seconds = matrix.pairwise(
+            drivers.latitudes, drivers.longitudes, requests.latitudes, requests.longitudes
+        )
+    known = np.array([ride_type is not None for ride_type in drivers.ride_types], dtype=bool)
+    compatible = (
+        known[:, None]
+        & (drivers.ride_types[:, None] == requests.ride_types[None, :])
+        & (drivers.vehicle_types[:, None] == requests.vehicle_types[None, :])
+    )
+    feasible = compatible & (eta_seconds <= settings.DISPATCH_MAX_PICKUP_SECONDS)
+    return np.where(feasible, eta_seconds, INFEASIBLE), distance_km
+
+
+def solve(cost):
+    """Optimal (rows, columns) assignment, dropping infeasible pairs."""
+    if not cost.size:
+        return np.array([], dtype=np.intp), np.array([], dtype=np.intp)
+    rows, columns = linear_sum_assignment(cost)
+    feasible = cost[rows, columns] < INFEASIBLE
+    return rows[feasible], columns[feasible]
+
+
+def greedy(cost):
+    """First-come matching: each request in arrival order takes the nearest free driver."""
+    taken = np.zeros(cost.shape[0], dtype=bool)
+    rows, columns = [], []
+    for column in range(cost.shape[1]):
+        candidates = np.where(taken, np.inf, cost[:, column])
+        row = int(np.argmin(candidates)) if len(candidates) else 0
+        if len(candidates) and candidates[row] < INFEASIBLE:
+            taken[row] = True
+            rows.append(row)
+            columns.append(column)
+    return np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)
+
+
+def prune(cost, limit):
+    """Drop drivers with no feasible request and keep at most `limit` of the closest ones."""
+    best = cost.min(axis=1) if cost.size else np.array([])
+    rows = np.flatnonzero(best < INFEASIBLE)
+    if len(rows) > limit:
+        rows = rows[np.argsort(best[rows], kind="stable")[:limit]]
+    return rows
+
+
+def apply_assignments(drivers, requests, rows, columns):
+    """Move the matched rides to ACCEPTED unless they or their driver changed meanwhile."""
+    pairs = {
+        requests.ride_ids[column]: (
+            drivers.driver_ids[row],
+            drivers.vehicle_ids[row],
+            drivers.latitudes[row],
+            drivers.longitudes[row],
+        )
+        for row, column in zip(rows, columns)
+    }
+    if not pairs:
+        return 0
+    assigned = 0
+    with transaction.atomic():
+        busy = set(
+            Ride.objects.filter(
+                driver_id__in=[pair[0] for pair in pairs.values()], is_completed=False
+            ).values_list("driver_id", flat=True)
+        )
+        rides = Ride.objects.select_for_update(skip_locked=True).filter(
+            id__in=list(pairs), ride_status="PENDING", is_completed=False, driver__isnull=True
+        )
+        for ride in rides:
+            driver_id, vehicle_id, latitude, longitude = pairs[ride.id]
+            if driver_id in busy:
+                continue
+            ride.driver_id = driver_id
+            ride.vehicle_id = vehicle_id
+            ride.ride_status = "ACCEPTED"
+            ride.save(update_fields=["driver", "vehicle", "ride_status", "updated_at"])
+            if ride.is_pooled:
+                pooling.start_pool(ride, latitude, longitude)
+            assigned += 1
+    return assigned
+
+
+def dispatch_area(area):
+    """Run one batch for every zone of a service area; returns the number of rides assigned."""
+    requests = pending_requests(area)
+    if not len(requests):
+        return 0
+    drivers = available_drivers(area)
+    if not len(drivers):
+        return 0
+
+    precision = settings.DISPATCH_ZONE_PRECISION
+    request_zones = geo.cell_ids(requests.latitudes, requests.longitudes, precision)
+    driver_zones = geo.cell_ids(drivers.latitudes, drivers.longitudes, precision)
+
+    assigned = 0
+    taken = np.zeros(len(drivers), dtype=bool)
+    for zone in np.unique(request_zones):
+        nearby_cells = [geo.geohash_to_id(cell) for cell in geo.neighbors(geo.to_geohash([zone], precision)[0])]
+        nearby = np.isin(driver_zones, nearby_cells) & ~taken
+        if not nearby.any():
+            continue
+        zone_drivers = drivers.subset(nearby)
+        zone_requests = requests.subset(request_zones == zone)
+        cost, _ = cost_matrix(zone_drivers, zone_requests, area)
+        kept = prune(cost, settings.DISPATCH_BATCH_MAX)
+        rows, columns = solve(cost[kept])
+        assigned += apply_assignments(zone_drivers, zone_requests, kept[rows], columns)
+        taken[np.flatnonzero(nearby)[kept[rows]]] = True
+    logger.info(f"Batch dispatch assigned {assigned} of {len(requests)} rides in area {area}")
+    return assigned
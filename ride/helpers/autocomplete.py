@@ -0,0 +1,204 @@
+"""
+Destination autocomplete over a local address/POI index.
+
+Entries are indexed under every word they contain: "14 Allen Avenue, Ikeja"
+gets the keys "14 allen avenue ikeja", "allen avenue ikeja", "avenue ikeja" and
+"ikeja". The keys are kept sorted as fixed-width byte strings, which is a
+flattened trie: the keys under any prefix form one contiguous range, found
+with two binary searches (`np.searchsorted`). Short prefixes cover huge ranges,
+so the nodes up to PREFIX_NODE_LENGTH characters store their TOP_PER_NODE most
+popular entries, like the top-k lists of a completion trie.
+
+Candidates are ranked by popularity (rides to that destination over
+AUTOCOMPLETE_HISTORY_DAYS) and by distance from the rider.
+
+`build` writes each index version to its own directory of .npy files and
+publishes the version in the shared cache. Workers memory-map it, check the
+version every AUTOCOMPLETE_CHECK_SECONDS and swap to the new one without a
+restart.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from core.helpers.geo import haversine_km
+
+VERSION_KEY = "autocomplete:version"
+KEY_LENGTH = 24
+PREFIX_NODE_LENGTH = 3
+TOP_PER_NODE = 64
+SCAN_LIMIT = 4096
+KEPT_VERSIONS = 2
+
+_lock = threading.Lock()
+_index = None
+_checked_at = 0.0
+_NON_ALPHANUMERIC = re.compile(r"[^a-z0-9]+")
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return _NON_ALPHANUMERIC.sub(" ", text).strip()
+
+
+def _save(directory, name, array):
+    with open(os.path.join(directory, name), "wb") as handle:
+        np.save(handle, array)
+
+
+def build(labels, latitudes, longitudes, popularity, root=None):
+    """Write a new index version under `root` and publish it; returns the version."""
+    root = root or settings.AUTOCOMPLETE_DATA_DIR
+    version = str(time.time_ns())
+    directory = os.path.join(root, version)
+    os.makedirs(directory)
+
+    keys, key_entries = [], []
+    for entry, label in enumerate(labels):
+        words = normalize(label).split(" ")
+        for start in range(len(words)):
+            if words[start]:
+                keys.append(" ".join(words[start:]).encode()[:KEY_LENGTH])
+                key_entries.append(entry)
+    keys = np.array(keys, dtype=f"S{KEY_LENGTH}")
+    key_entries = np.array(key_entries, dtype=np.int32)
+    order = np.argsort(keys, kind="stable")
+    keys, key_entries = keys[order], key_entries[order]
+
+    popularity = np.asarray(popularity, dtype=np.float32)
+    nodes, node_top = [], []
+    for length in range(1, PREFIX_NODE_LENGTH + 1):
+        prefixes = keys.astype(f"S{length}")
+        for prefix, start, count in zip(*np.unique(prefixes, return_index=True, return_counts=True)):
+            if len(prefix) < length:
+                # Already a node at its own, shorter length.
+                continue
+            entries = np.unique(key_entries[start : start + count])
+            top = entries[np.argsort(-popularity[entries], kind="stable")[:TOP_PER_NODE]]
+            nodes.append(prefix)
+            node_top.append(np.pad(top, (0, TOP_PER_NODE - len(top)), constant_values=-1))
+    node_order = np.argsort(np.array(nodes, dtype=f"S{PREFIX_NODE_LENGTH}"), kind="stable")
+
+    encoded = [label.encode() for label in labels]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(label) for label in encoded])
+
+    _save(directory, "keys.npy", keys)
+    _save(directory, "key_entries.npy", key_entries)
+    _save(directory, "nodes.npy", np.array(nodes, dtype=f"S{PREFIX_NODE_LENGTH}")[node_order])
+    _save(directory, "node_top.npy", np.array(node_top, dtype=np.int32).reshape(-1, TOP_PER_NODE)[node_order])
+    _save(directory, "latitudes.npy", np.asarray(latitudes, dtype=np.float32))
+    _save(directory, "longitudes.npy", np.asarray(longitudes, dtype=np.float32))
+    _save(directory, "popularity.npy", popularity)
+    _save(directory, "offsets.npy", offsets)
+    with open(os.path.join(directory, "labels.bin"), "wb") as handle:
+        handle.write(b"".join(encoded))
+    with open(os.path.join(directory, "manifest.json"), "w") as handle:
+        json.dump({"version": version, "entries": len(labels), "keys": len(keys)}, handle)
+
+    cache.set(VERSION_KEY, version, timeout=None)
+    for stale in sorted(name for name in os.listdir(root) if name.isdigit())[:-KEPT_VERSIONS]:
+        # Workers still on an older version keep their maps; unlinked files live until unmapped.
+        shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+    return version
+
+
+class AutocompleteIndex:
+    def __init__(self, directory):
+        def load(name):
+            return np.asarray(np.load(os.path.join(directory, name), mmap_mode="r"))
+
+        self.keys = load("keys.npy")
+        self.key_entries = load("key_entries.npy")
+        self.nodes = load("nodes.npy")
+        self.node_top = load("node_top.npy")
+        self.latitudes = load("latitudes.npy")
+        self.longitudes = load("longitudes.npy")
+        self.popularity = load("popularity.npy")
+        self.offsets = load("offsets.npy")
+        labels_path = os.path.join(directory, "labels.bin")
+        self.labels = np.memmap(labels_path, dtype=np.uint8, mode="r") if os.path.getsize(labels_path) else b""
+        with open(os.path.join(directory, "manifest.json")) as handle:
+            self.version = json.load(handle)["version"]
+
+    def label(self, entry):
+        return bytes(self.labels[self.offsets[entry] : self.offsets[entry + 1]]).decode()
+
+    def candidates(self, query):
+        if len(query) <= PREFIX_NODE_LENGTH:
+            position = int(np.searchsorted(self.nodes, query))
+            if position == len(self.nodes) or self.nodes[position] != query:
+                return np.array([], dtype=np.int32)
+            top = self.node_top[position]
+            return top[top >= 0]
+        prefix = query[:KEY_LENGTH]
+        lo = int(np.searchsorted(self.keys, prefix, side="left"))
+        hi = int(np.searchsorted(self.keys, prefix + b"\xff", side="left"))
+        entries = self.key_entries[lo:hi]
+        if len(entries) > SCAN_LIMIT:
+            entries = entries[np.argpartition(-self.popularity[entries], SCAN_LIMIT)[:SCAN_LIMIT]]
+        entries = np.unique(entries)
+        if len(query) > KEY_LENGTH:
+            text = query.decode()
+            entries = np.array([entry for entry in entries if text in normalize(self.label(entry))], dtype=np.int32)
+        return entries
+
+    def suggest(self, text, latitude=None, longitude=None, limit=8):
+        query = normalize(text).encode()
+        if not query:
+            return []
+        entries = self.candidates(query)
+        if not len(entries):
+            return []
+        score = settings.AUTOCOMPLETE_POPULARITY_WEIGHT * np.log1p(self.popularity[entries])
+        distance = None
+        if latitude is not None and longitude is not None:
+            distance = haversine_km(latitude, longitude, self.latitudes[entries], self.longitudes[entries])
+            score = score - distance / settings.AUTOCOMPLETE_DISTANCE_SCALE_KM
+        best = np.argsort(-score, kind="stable")[:limit]
+        return [
+            {
+                "address": self.label(int(entries[position])),
+                "latitude": float(self.latitudes[entries[position]]),
+                "longitude": float(self.longitudes[entries[position]]),
+                "distance_km": None if distance is None else round(float(distance[position]), 3),
+            }
+            for position in best
+        ]
+
+
+def get_index():
+    """The current index, or None before the first build."""
+    global _index, _checked_at
+    now = time.monotonic()
+    if now - _checked_at < settings.AUTOCOMPLETE_CHECK_SECONDS:
+        return _index
+    with _lock:
+        if now - _checked_at >= settings.AUTOCOMPLETE_CHECK_SECONDS:
+            version = cache.get(VERSION_KEY)
+            if version is None:
+                versions = [name for name in os.listdir(settings.AUTOCOMPLETE_DATA_DIR) if name.isdigit()] if os.path.isdir(
+                    settings.AUTOCOMPLETE_DATA_DIR
+                ) else []
+                version = max(versions) if versions else None
+            if version and (_index is None or _index.version != version):
+                directory = os.path.join(settings.AUTOCOMPLETE_DATA_DIR, version)
+                if os.path.exists(os.path.join(directory, "manifest.json")):
+                    _index = AutocompleteIndex(directory)
+            _checked_at = now
+    return _index
+
+
+def suggest(text, latitude=None, longitude=None, limit=8):
+    index = get_index()
+    if index is None:
+        return []
+    return index.suggest(text, latitude, longitude, limit)
@@ -0,0 +1,234 @@
+"""
+Package delivery batching.
+
+PENDING PACKAGE_DELIVERY rides are grouped by ride type, pickup cell
+(DELIVERY_CELL_PRECISION) and DELIVERY_WINDOW_MINUTES window of their request
+time. Once a window has closed, the drop-offs of each group are split into
+capacitated routes from the centre of its pickups (`vrp.solve`). A route then
+collects its packages first, visiting their pickups nearest-first, and drops
+them off in the solver's order, so every pickup comes before its drop-off and
+both count towards the route's length. Routes are handed to available delivery
+drivers with the batch dispatch solver, using the driver's ETA to the route's
+first pickup as the cost. Routes that find no driver are re-planned on the next
+tick together with any late arrivals.
+
+The whole tick shares DELIVERY_SOLVER_SECONDS, so planning stays bounded
+however many packages are waiting.
+"""
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.helpers import geo
+from ride.helpers import assignment, vrp
+from ride.helpers.driver_locations import available_drivers
+from ride.models import DeliveryRoute, Ride
+
+logger = logging.getLogger(__name__)
+
+
+class PlannedRoute:
+    def __init__(self, group, ride_ids, stops, weight, distance_km, depot):
+        self.group = group
+        self.ride_ids = ride_ids
+        self.stops = stops
+        self.weight = weight
+        self.distance_km = distance_km
+        self.depot = depot
+
+
+def window_start(moment):
+    window = settings.DELIVERY_WINDOW_MINUTES * 60
+    return moment - timedelta(seconds=int(moment.timestamp()) % window, microseconds=moment.microsecond)
+
+
+def pending_groups(area, now=None):
+    """PENDING deliveries of closed windows keyed by (ride_type, cell, window_start)."""
+    now = now or timezone.now()
+    rides = Ride.objects.filter(
+        user__country_code=area,
+        vehicle_type="PACKAGE_DELIVERY",
+        ride_status="PENDING",
+        is_completed=False,
+        driver__isnull=True,
+        created_at__lt=window_start(now),
+        user_pickup_latitude__isnull=False,
+        user_pickup_longitude__isnull=False,
+        user_ride_end_latitude__isnull=False,
+        user_ride_end_longitude__isnull=False,
+    ).values_list(
+        "id",
+        "ride_type",
+        "created_at",
+        "user_pickup_latitude",
+        "user_pickup_longitude",
+        "user_ride_end_latitude",
+        "user_ride_end_longitude",
+        "package_weight",
+    )
+    groups = defaultdict(list)
+    for row in rides:
+        cell = geo.encode(row[3], row[4], settings.DELIVERY_CELL_PRECISION)
+        groups[(row[1], cell, window_start(row[2]))].append(row)
+    return groups
+
+
+def _stop(ride_id, kind, latitude, longitude, weight):
+    return {"ride": str(ride_id), "kind": kind, "latitude": latitude, "longitude": longitude, "weight": weight}
+
+
+def _nearest_first(xy, start):
+    """Order of the points in `xy` driving from `start` to the closest point not yet visited, each time."""
+    order, left = [start], set(range(len(xy))) - {start}
+    while left:
+        here = xy[order[-1]]
+        following = min(left, key=lambda index: float(np.linalg.norm(xy[index] - here)))
+        order.append(following)
+        left.remove(following)
+    return order
+
+
+def plan_group(group, rows, time_budget):
+    """Solve one group and return its routes, pickups then drop-offs, in solver order."""
+    ride_ids, _, _, pickup_lat, pickup_lon, end_lat, end_lon, weight = (list(column) for column in zip(*rows))
+    centre = (float(np.mean(pickup_lat)), float(np.mean(pickup_lon)))
+    solution = vrp.solve(
+        centre[0],
+        centre[1],
+        end_lat,
+        end_lon,
+        weight,
+        settings.DELIVERY_VEHICLE_CAPACITY_KG,
+        time_budget,
+        settings.DELIVERY_NEIGHBOURS,
+    )
+    pickup_xy = vrp.project(pickup_lat, pickup_lon, centre[0])
+    end_xy = vrp.project(end_lat, end_lon, centre[0])
+    centre_xy = vrp.project([centre[0]], [centre[1]], centre[0])[0]
+    routes = []
+    for route, load in zip(solution.routes, solution.loads):
+        # The solver's tour is closed, so drive it from whichever end is nearer the pickups.
+        if np.linalg.norm(end_xy[route[-1]] - centre_xy) < np.linalg.norm(end_xy[route[0]] - centre_xy):
+            route = route[::-1]
+        # Start at the pickup farthest from the first drop-off, so collecting heads towards it.
+        start = int(np.argmax(np.linalg.norm(pickup_xy[route] - end_xy[route[0]], axis=1)))
+        pickups = [route[position] for position in _nearest_first(pickup_xy[route], start)]
+        stops = [
+            _stop(ride_ids[index], "PICKUP", pickup_lat[index], pickup_lon[index], weight[index]) for index in pickups
+        ] + [_stop(ride_ids[index], "DROPOFF", end_lat[index], end_lon[index], weight[index]) for index in route]
+        routes.append(
+            PlannedRoute(
+                group,
+                [ride_ids[index] for index in route],
+                stops,
+                load,
+                vrp.path_length(np.vstack([pickup_xy[pickups], end_xy[route]])),
+                (pickup_lat[pickups[0]], pickup_lon[pickups[0]]),
+            )
+        )
+    return routes
+
+
+def plan_area(area, now=None):
+    """Plan every closed window of a service area within DELIVERY_SOLVER_SECONDS."""
+    deadline = time.monotonic() + settings.DELIVERY_SOLVER_SECONDS
+    groups = pending_groups(area, now)
+    routes = []
+    for remaining, (group, rows) in enumerate(sorted(groups.items(), key=lambda item: -len(item[1]))):
+        # Each group gets an equal share of what is left, so early groups cannot starve later ones.
+        budget = max(deadline - time.monotonic(), 0.0) / (len(groups) - remaining)
+        routes.extend(plan_group(group, rows, budget))
+    return routes
+
+
+def apply_routes(drivers, routes, rows, columns):
+    """Persist the assigned routes and move their rides to ACCEPTED; returns the rides assigned."""
+    assigned = 0
+    with transaction.atomic():
+        busy = set(
+            Ride.objects.filter(
+                driver_id__in=[drivers.driver_ids[row] for row in rows], is_completed=False
+            ).values_list("driver_id", flat=True)
+        )
+        for row, column in zip(rows, columns):
+            driver_id, route = drivers.driver_ids[row], routes[column]
+            if driver_id in busy:
+                continue
+            rides = {
+                str(ride.id): ride
+                for ride in Ride.objects.select_for_update(skip_locked=True).filter(
+                    id__in=route.ride_ids, ride_status="PENDING", is_completed=False, driver__isnull=True
+                )
+            }
+            stops = [stop for stop in route.stops if stop["ride"] in rides]
+            if not stops:
+                continue
+            delivery_route = DeliveryRoute.objects.create(
+                driver_id=driver_id,
+                vehicle_id=drivers.vehicle_ids[row],
+                cell=route.group[1],
+                window_start=route.group[2],
+                depot_latitude=route.depot[0],
+                depot_longitude=route.depot[1],
+                stops=stops,
+                total_weight=sum(stop["weight"] for stop in stops if stop["kind"] == "DROPOFF"),
+                distance_km=route.distance_km,
+            )
+            for ride in rides.values():
+                ride.driver_id = driver_id
+                ride.vehicle_id = drivers.vehicle_ids[row]
+                ride.delivery_route = delivery_route
+                ride.ride_status = "ACCEPTED"
+                ride.save(update_fields=["driver", "vehicle", "delivery_route", "ride_status", "updated_at"])
+            busy.add(driver_id)
+            assigned += len(rides)
+    return assigned
+
+
+def dispatch_area(area, now=None):
+    """Plan and assign one tick of deliveries for a service area; returns the rides assigned."""
+    routes = plan_area(area, now)
+    if not routes:
+        return 0
+    drivers = available_drivers(area)
+    drivers = drivers.subset(drivers.vehicle_types == "PACKAGE_DELIVERY")
+    if not len(drivers):
+        return 0
+
+    depots = assignment.OpenRequests(
+        list(range(len(routes))),
+        [route.group[0] for route in routes],
+        ["PACKAGE_DELIVERY"] * len(routes),
+        [route.depot[0] for route in routes],
+        [route.depot[1] for route in routes],
+    )
+    cost, _ = assignment.cost_matrix(drivers, depots, area)
+    kept = assignment.prune(cost, settings.DISPATCH_BATCH_MAX)
+    rows, columns = assignment.solve(cost[kept])
+    assigned = apply_routes(drivers, routes, kept[rows], columns)
+    logger.info(f"Delivery batching assigned {assigned} rides on {len(rows)} of {len(routes)} routes in area {area}")
+    return assigned
+
+
+def advance(ride):
+    """Drop the stops a delivery no longer needs after its latest transition."""
+    if not ride.delivery_route_id:
+        return
+    if ride.ride_status == "RIDE_START":
+        kinds = ("PICKUP",)
+    elif ride.ride_status in ("RIDE_END", "PAID", "COMPLETED", "CANCELLED"):
+        kinds = ("PICKUP", "DROPOFF")
+    else:
+        return
+    ride_id = str(ride.id)
+    with transaction.atomic():
+        route = DeliveryRoute.objects.select_for_update().get(id=ride.delivery_route_id)
+        route.stops = [stop for stop in route.stops if not (stop["ride"] == ride_id and stop["kind"] in kinds)]
+        route.is_active = bool(route.stops)
+        route.save(update_fields=["stops", "is_active", "updated_at"])
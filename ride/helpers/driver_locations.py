@@ -0,0 +1,67 @@
+"""
+Positions of drivers that can take a new ride.
+
+A driver is available when they are online in the presence store
+(core/helpers/presence.py), their vehicle is active and not deleted, and they
+have no open ride. Their position is the one sent with their latest heartbeat.
+"""
+import numpy as np
+
+from core.helpers import presence
+from core.models import VehicleRegistration
+from ride.models import Ride
+
+
+class DriverPositions:
+    """Column-oriented snapshot of available drivers, ready for numpy."""
+
+    def __init__(self, driver_ids, vehicle_ids, ride_types, vehicle_types, latitudes, longitudes):
+        self.driver_ids = driver_ids
+        self.vehicle_ids = vehicle_ids
+        self.ride_types = np.asarray(ride_types, dtype=object)
+        self.vehicle_types = np.asarray(vehicle_types, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.driver_ids)
+
+    def subset(self, mask):
+        index = np.flatnonzero(mask)
+        return DriverPositions(
+            [self.driver_ids[i] for i in index],
+            [self.vehicle_ids[i] for i in index],
+            self.ride_types[index],
+            self.vehicle_types[index],
+            self.latitudes[index],
+            self.longitudes[index],
+        )
+
+
+def available_drivers(area):
+    """Available drivers of a service area (country_code) with a known position."""
+    positions = presence.records(presence.online_in_area(area))
+    if not positions:
+        return DriverPositions([], [], [], [], [], [])
+    busy = {
+        str(driver_id)
+        for driver_id in Ride.objects.filter(driver_id__in=list(positions), is_completed=False).values_list(
+            "driver_id", flat=True
+        )
+    }
+    vehicles = (
+        VehicleRegistration.objects.filter(user_id__in=list(positions), is_active=True, is_deleted=False)
+        .order_by("-created_at")
+        .values_list("user_id", "id", "vehichle_type__ride_type", "vehichle_type__vehicle_type")
+    )
+
+    rows = {}
+    for user_id, vehicle_id, ride_type, vehicle_type in vehicles:
+        driver = str(user_id)
+        if driver in busy or driver in rows:
+            # A driver with several active vehicles is dispatched once.
+            continue
+        position = positions[driver]
+        rows[driver] = (user_id, vehicle_id, ride_type, vehicle_type, position["latitude"], position["longitude"])
+    columns = list(zip(*rows.values())) or [[], [], [], [], [], []]
+    return DriverPositions(*[list(column) for column in columns])
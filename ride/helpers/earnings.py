@@ -0,0 +1,157 @@
+"""
+Earnings and trip rollups per driver and per rider (EarningsRollup).
+
+Every ride that reaches PAID or CANCELLED adds to one row per side of the
+ride (driver and rider) and period (local day, week from Monday, month):
+trips completed or cancelled, fares, points and cancellation fees. The
+increments are written in the transaction that makes the transition, next to
+its RideEvent (Ride.save, or the bulk cancellation of ride/helpers/expiry.py),
+and only once the ride's `earnings_recorded` flag is claimed: Ride.save sets it
+with a conditional UPDATE (... WHERE earnings_recorded = false) and skips the
+rollups when no row changed, and nothing else ever writes the flag from an
+instance, so even saves from stale copies of a ride count it once.
+`backfill_earnings` counts the closed rides from before the
+rollups in chunks, off a partial index holding only the unflagged ones.
+
+A summary is then one range read over the unique (user_type, person_id,
+period, period_start) index, however long the person's history.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+ROLLUP_STATUSES = ("PAID", "CANCELLED")
+PERIODS = ("DAY", "WEEK", "MONTH")
+COUNTERS = ("completed", "cancelled", "fares", "points", "cancellation_fees")
+MAX_PERIODS = 90
+
+
+def period_start(period, day):
+    if period == "DAY":
+        return day
+    if period == "WEEK":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def previous_start(period, start):
+    if period == "DAY":
+        return start - timedelta(days=1)
+    if period == "WEEK":
+        return start - timedelta(days=7)
+    return (start - timedelta(days=1)).replace(day=1)
+
+
+def changes(to_status, user_id, driver_id, payable_amount, point_amount, cancellation_amount, moment):
+    """(lookup, deltas) pairs for one ride reaching `to_status` at `moment`."""
+    if to_status == "PAID":
+        deltas = {"completed": 1, "fares": payable_amount, "points": point_amount}
+    else:
+        deltas = {"cancelled": 1, "cancellation_fees": cancellation_amount}
+    day = timezone.localtime(moment).date()
+    for user_type, person_id in (("RIDER", driver_id), ("USER", user_id)):
+        if person_id is None:
+            continue
+        for period in PERIODS:
+            yield (user_type, person_id, period, period_start(period, day)), deltas
+
+
+def _apply(totals):
+    from ride.models import EarningsRollup
+
+    # Sorted, so concurrent transactions lock the rows in the same order.
+    for (user_type, person_id, period, start), deltas in sorted(totals.items(), key=lambda item: str(item[0])):
+        lookup = {"user_type": user_type, "person_id": person_id, "period": period, "period_start": start}
+        increments = {field: F(field) + value for field, value in deltas.items()}
+        if EarningsRollup.objects.filter(**lookup).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                EarningsRollup.objects.create(**lookup, **deltas)
+        except IntegrityError:
+            # Another transaction created the row first.
+            EarningsRollup.objects.filter(**lookup).update(**increments)
+
+
+def record_events(events):
+    """Add PAID/CANCELLED RideEvents to the rollups; call in the transaction that wrote them."""
+    totals = defaultdict(Counter)
+    for event in events:
+        if event.to_status not in ROLLUP_STATUSES:
+            continue
+        for key, deltas in changes(
+            event.to_status,
+            event.user_id,
+            event.driver_id,
+            event.payable_amount,
+            event.point_amount,
+            event.cancellation_amount,
+            event.occurred_at,
+        ):
+            totals[key].update(deltas)
+    _apply(totals)
+
+
+def backfill_batch(limit):
+    """Count up to `limit` closed rides the rollups have not seen; returns how many it counted."""
+    from ride.models import Ride
+
+    with transaction.atomic():
+        rows = list(
+            Ride.objects.select_for_update(skip_locked=True)
+            .filter(ride_status__in=ROLLUP_STATUSES, earnings_recorded=False)
+            .order_by("id")
+            .values(
+                "id", "ride_status", "user_id", "driver_id", "payable_amount", "point_amount",
+                "cancellation_amount", "cancelled_at", "updated_at",
+            )[:limit]
+        )
+        if not rows:
+            return 0
+        totals = defaultdict(Counter)
+        for row in rows:
+            # No transition time is kept for old rides; a cancellation has its own, a payment its last update.
+            moment = row["cancelled_at"] if row["ride_status"] == "CANCELLED" and row["cancelled_at"] else row["updated_at"]
+            for key, deltas in changes(
+                row["ride_status"],
+                row["user_id"],
+                row["driver_id"],
+                row["payable_amount"],
+                row["point_amount"],
+                row["cancellation_amount"],
+                moment,
+            ):
+                totals[key].update(deltas)
+        _apply(totals)
+        # A bulk UPDATE, so neither the version nor updated_at of the rides moves.
+        Ride.objects.filter(id__in=[row["id"] for row in rows]).update(earnings_recorded=True)
+    return len(rows)
+
+
+def summary(user_type, person_id, period, count, today=None):
+    """The last `count` periods up to the current one, newest first and zero-filled, and their totals."""
+    from ride.models import EarningsRollup
+
+    starts = [period_start(period, today or timezone.localdate())]
+    while len(starts) < count:
+        starts.append(previous_start(period, starts[-1]))
+    found = {
+        row["period_start"]: row
+        for row in EarningsRollup.objects.filter(
+            user_type=user_type, person_id=person_id, period=period, period_start__gte=starts[-1]
+        ).values("period_start", *COUNTERS)
+    }
+    periods = [
+        {"period_start": start, **{field: found.get(start, {}).get(field, 0) for field in COUNTERS}}
+        for start in starts
+    ]
+    totals = {field: sum(entry[field] for entry in periods) for field in COUNTERS}
+    for entry in (*periods, totals):
+        entry["total"] = entry["fares"] + entry["cancellation_fees"]
+        if user_type == "RIDER":
+            # Fares are what the rider paid after points; the points part still reaches the driver.
+            entry["total"] += entry["points"]
+    return totals, periods
@@ -0,0 +1,219 @@
+"""
+Precomputed cell-to-cell ETA/distance matrix per service area.
+
+A service area is a `country_code`, the same key `ConstantTable` is looked up
+by. The `refresh_eta_matrix` command collects the busiest geohash cells seen on
+recent rides (`user_pickup_*` and `driver_pickup_*`), precomputes the pairwise
+road distance and ETA between cell centroids and stores the matrix in the
+Django cache. Workers memoise it per process, so ranking N drivers against one
+rider is a couple of numpy indexing operations; only the final few candidates
+are recomputed from their exact coordinates.
+"""
+import logging
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from core.helpers import geo
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = "eta_matrix:{area}"
+# Distances are stored in decametres and ETAs in seconds as uint16, which keeps
+# a 1,500-cell matrix under 10 MB while covering trips of up to ~650 km / 18 h.
+_UINT16_MAX = np.iinfo(np.uint16).max
+
+_local_matrices = {}
+
+
+def estimate(latitudes, longitudes, rider_latitude, rider_longitude):
+    """Exact (coordinate-level) road distance in km and ETA in seconds."""
+    distance_km = geo.haversine_km(latitudes, longitudes, rider_latitude, rider_longitude) * settings.ETA_ROAD_FACTOR
+    return distance_km, distance_km / settings.ETA_AVERAGE_SPEED_KMH * 3600.0
+
+
+class EtaMatrix:
+    """Distance/ETA matrix between the geohash cells of one service area."""
+
+    def __init__(self, area, precision, cell_ids, distance_dam, eta_seconds, built_at):
+        self.area = area
+        self.precision = precision
+        self.cell_ids = cell_ids
+        self.distance_dam = distance_dam
+        self.eta_seconds = eta_seconds
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    @classmethod
+    def build(cls, area, latitudes, longitudes, precision=None, max_cells=None):
+        """Build a matrix over the most frequent cells among the given coordinates."""
+        precision = precision or settings.ETA_MATRIX_PRECISION
+        max_cells = max_cells or settings.ETA_MATRIX_MAX_CELLS
+
+        ids = geo.cell_ids(latitudes, longitudes, precision)
+        unique, counts = np.unique(ids, return_counts=True)
+        if len(unique) > max_cells:
+            unique = unique[np.argsort(counts, kind="stable")[::-1][:max_cells]]
+        unique = np.sort(unique)
+
+        latitudes, longitudes = geo.cell_centroids(unique, precision)
+        distance_km, eta_seconds = estimate(
+            latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :]
+        )
+        return cls(
+            area=area,
+            precision=precision,
+            cell_ids=unique,
+            distance_dam=np.minimum(np.rint(distance_km * 100.0), _UINT16_MAX).astype(np.uint16),
+            eta_seconds=np.minimum(np.rint(eta_seconds), _UINT16_MAX).astype(np.uint16),
+            built_at=timezone.now(),
+        )
+
+    def cell_index(self, cell_ids):
+        """Return (row index, found mask) of the given cell ids in the matrix."""
+        cell_ids = np.asarray(cell_ids, dtype=np.int64)
+        if not len(self.cell_ids):
+            return np.zeros(cell_ids.shape, dtype=np.intp), np.zeros(cell_ids.shape, dtype=bool)
+        index = np.minimum(np.searchsorted(self.cell_ids, cell_ids), len(self.cell_ids) - 1)
+        return index, self.cell_ids[index] == cell_ids
+
+    def lookup(self, latitudes, longitudes, rider_latitude, rider_longitude):
+        """
+        Distance (km) and ETA (s) from each of N points to one rider.
+
+        Points whose cell (or the rider's cell) is not in the matrix fall back to
+        the exact estimate, so the result is always complete.
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        rider_index, rider_found = self.cell_index(
+            geo.cell_ids([rider_latitude], [rider_longitude], self.precision)
+        )
+        index, found = self.cell_index(geo.cell_ids(latitudes, longitudes, self.precision))
+        if not rider_found[0]:
+            found[:] = False
+
+        distance_km = np.empty(latitudes.shape, dtype=np.float64)
+        eta_seconds = np.empty(latitudes.shape, dtype=np.float64)
+        distance_km[found] = self.distance_dam[index[found], rider_index[0]] / 100.0
+        eta_seconds[found] = self.eta_seconds[index[found], rider_index[0]]
+
+        missing = ~found
+        if missing.any():
+            distance_km[missing], eta_seconds[missing] = estimate(
+                latitudes[missing], longitudes[missing], rider_latitude, rider_longitude
+            )
+        return distance_km, eta_seconds
+
+    def pairwise(self, latitudes, longitudes, target_latitudes, target_longitudes):
+        """N x M distance (km) and ETA (s) matrices between two point sets."""
+        index, found = self.cell_index(geo.cell_ids(latitudes, longitudes, self.precision))
+        target_index, target_found = self.cell_index(
+            geo.cell_ids(target_latitudes, target_longitudes, self.precision)
+        )
+        distance_km = self.distance_dam[np.ix_(index, target_index)] / 100.0
+        eta_seconds = self.eta_seconds[np.ix_(index, target_index)].astype(np.float64)
+
+        missing = ~(found[:, None] & target_found[None, :])
+        if missing.any():
+            rows, columns = np.nonzero(missing)
+            distance_km[rows, columns], eta_seconds[rows, columns] = estimate(
+                np.asarray(latitudes)[rows],
+                np.asarray(longitudes)[rows],
+                np.asarray(target_latitudes)[columns],
+                np.asarray(target_longitudes)[columns],
+            )
+        return distance_km, eta_seconds
+
+
+def store_matrix(matrix):
+    cache.set(CACHE_KEY.format(area=matrix.area), matrix, timeout=None)
+    _local_matrices[matrix.area] = (time.monotonic(), matrix)
+
+
+def get_matrix(area):
+    """Return the area's matrix, memoised per process for ETA_MATRIX_LOCAL_TTL seconds."""
+    loaded = _local_matrices.get(area)
+    if loaded is not None and time.monotonic() - loaded[0] < settings.ETA_MATRIX_LOCAL_TTL:
+        return loaded[1]
+    matrix = cache.get(CACHE_KEY.format(area=area))
+    _local_matrices[area] = (time.monotonic(), matrix)
+    return matrix
+
+
+def lookup(area, latitudes, longitudes, rider_latitude, rider_longitude):
+    """Matrix lookup for N points x 1 rider, or exact estimates when the area has no matrix."""
+    matrix = get_matrix(area)
+    if matrix is None:
+        return estimate(
+            np.asarray(latitudes, dtype=np.float64),
+            np.asarray(longitudes, dtype=np.float64),
+            rider_latitude,
+            rider_longitude,
+        )
+    return matrix.lookup(latitudes, longitudes, rider_latitude, rider_longitude)
+
+
+def rank(area, latitudes, longitudes, rider_latitude, rider_longitude, exact_candidates=None):
+    """
+    Rank N points by pickup ETA to a rider.
+
+    Every point is scored from the matrix in one vectorized lookup; only the
+    best `exact_candidates` are then recomputed from their exact coordinates and
+    re-sorted. Returns (order, distance_km, eta_seconds) with the arrays indexed
+    like the input.
+    """
+    if exact_candidates is None:
+        exact_candidates = settings.ETA_EXACT_CANDIDATES
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    distance_km, eta_seconds = lookup(area, latitudes, longitudes, rider_latitude, rider_longitude)
+
+    order = np.argsort(eta_seconds, kind="stable")
+    head = order[:exact_candidates]
+    distance_km[head], eta_seconds[head] = estimate(
+        latitudes[head], longitudes[head], rider_latitude, rider_longitude
+    )
+    order[: len(head)] = head[np.argsort(eta_seconds[head], kind="stable")]
+    return order, distance_km, eta_seconds
+
+
+def area_coordinates(area, days=None):
+    """Pickup coordinates (rider requested and driver actual) of recent rides in an area."""
+    from ride.models import Ride
+
+    days = days or settings.ETA_MATRIX_HISTORY_DAYS
+    rides = Ride.objects.filter(
+        user__country_code=area, created_at__gte=timezone.now() - timedelta(days=days)
+    ).filter(
+        Q(user_pickup_latitude__isnull=False, user_pickup_longitude__isnull=False)
+        | Q(driver_pickup_latitude__isnull=False, driver_pickup_longitude__isnull=False)
+    )
+    latitudes, longitudes = [], []
+    for row in rides.values_list(
+        "user_pickup_latitude", "user_pickup_longitude", "driver_pickup_latitude", "driver_pickup_longitude"
+    ).iterator(chunk_size=5000):
+        for latitude, longitude in (row[:2], row[2:]):
+            if latitude is not None and longitude is not None:
+                latitudes.append(latitude)
+                longitudes.append(longitude)
+    return np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64)
+
+
+def refresh_area(area):
+    """Rebuild and store the matrix for one area; returns None when it has no rides."""
+    latitudes, longitudes = area_coordinates(area)
+    if not len(latitudes):
+        logger.info(f"No ride coordinates for area {area}, ETA matrix not built")
+        return None
+    matrix = EtaMatrix.build(area, latitudes, longitudes)
+    store_matrix(matrix)
+    logger.info(f"ETA matrix for area {area} refreshed with {len(matrix)} cells")
+    return matrix
@@ -0,0 +1,94 @@
+"""
+Cancels rides that stalled in PENDING or ACCEPTED past their timeout, so they
+stop blocking the rider and cluttering open-ride lookups.
+
+Each pass walks the partial index on (ride_status, updated_at) over open rides
+from the oldest row and stops at the cutoff, so it never reads rides that are
+still within their timeout, let alone the whole table. Rides are cancelled
+RIDE_EXPIRY_BATCH at a time: the batch is claimed FOR UPDATE SKIP LOCKED (rows
+a request is transitioning right now are left for the next pass) and cancelled
+with one UPDATE in a short transaction, so locks are held per batch only.
+
+The UPDATE bypasses Ride.save, so the cancelled rides are published to the
+active-ride cache directly; that is what the rider and driver apps poll
+through RideStatusAPIView. Their RideEvents and earnings rollups are
+written in the same transaction.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ride.helpers import active_rides, delivery, earnings, pooling
+from ride.models import Ride, RideEvent
+
+logger = logging.getLogger(__name__)
+
+
+def timeouts():
+    """Minutes a ride may sit in each status before it is cancelled."""
+    return {
+        "PENDING": settings.RIDE_EXPIRE_PENDING_MINUTES,
+        "ACCEPTED": settings.RIDE_EXPIRE_ACCEPTED_MINUTES,
+    }
+
+
+def expire_batch(ride_status, cutoff, limit):
+    """Cancel up to `limit` open rides last updated in `ride_status` before `cutoff`; returns their ids."""
+    with transaction.atomic():
+        ids = list(
+            Ride.objects.select_for_update(skip_locked=True)
+            .filter(ride_status=ride_status, is_completed=False, updated_at__lt=cutoff)
+            .order_by("updated_at")
+            .values_list("id", flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        # Stamped now, not at the start of the sweep: the events' ids are handed out now, and the
+        # projections rely on later ids never carrying much earlier times.
+        now = timezone.now()
+        Ride.objects.filter(id__in=ids).update(
+            ride_status="CANCELLED",
+            cancelled_by="NONE",
+            cancelled_at=now,
+            cancelled_reason=f"No progress from {ride_status.lower()} within {timeouts()[ride_status]} minutes",
+            is_completed=True,
+            earnings_recorded=True,
+            updated_at=now,
+            version=F("version") + 1,
+        )
+        rows = list(
+            Ride.objects.filter(id__in=ids).values(
+                "ride_pool_id", "delivery_route_id", *RideEvent.SOURCE.values()
+            )
+        )
+        events = RideEvent.objects.bulk_create([RideEvent.for_row(row, ride_status, occurred_at=now) for row in rows])
+        earnings.record_events(events)
+        active_rides.publish_closed(rows, "CANCELLED")
+
+    shared = [row["id"] for row in rows if row["ride_pool_id"] or row["delivery_route_id"]]
+    for ride in Ride.objects.filter(id__in=shared):
+        pooling.advance(ride)
+        delivery.advance(ride)
+    return ids
+
+
+def expire(now=None):
+    """Run one sweep over every status with a timeout; returns {status: cancelled ride ids}."""
+    now = now or timezone.now()
+    expired = {}
+    for ride_status, minutes in timeouts().items():
+        cutoff = now - timedelta(minutes=minutes)
+        expired[ride_status] = []
+        while True:
+            ids = expire_batch(ride_status, cutoff, settings.RIDE_EXPIRY_BATCH)
+            expired[ride_status].extend(ids)
+            if len(ids) < settings.RIDE_EXPIRY_BATCH:
+                break
+        if expired[ride_status]:
+            logger.info(f"Expired {len(expired[ride_status])} {ride_status} rides")
+            logger.debug(f"Expired {ride_status} rides: {[str(ride_id) for ride_id in expired[ride_status]]}")
+    return expired
@@ -0,0 +1,223 @@
+"""
+Shared-ride pooling matcher.
+
+A pooled request is checked against the active `RidePool`s whose current cell is
+in or next to the pickup's cell (POOL_CELL_PRECISION). For each candidate trip
+every insertion position of the new pickup and drop-off into its remaining
+stops is scored at once: trips are padded to the same number of stops, so
+hundreds of trips are evaluated with a handful of numpy operations.
+
+An insertion is feasible when the vehicle never carries more than its seats,
+the new rider's in-vehicle distance stays within POOL_MAX_DETOUR_RATIO of their
+direct trip, and the trip grows by at most POOL_MAX_ADDED_KM, which also bounds
+the delay of riders already on board.
+"""
+import logging
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from core.helpers import geo
+from ride.models import RidePool
+
+logger = logging.getLogger(__name__)
+
+
+def _stop(ride, kind):
+    if kind == "PICKUP":
+        latitude, longitude = ride.user_pickup_latitude, ride.user_pickup_longitude
+    else:
+        latitude, longitude = ride.user_ride_end_latitude, ride.user_ride_end_longitude
+    return {"ride": str(ride.id), "kind": kind, "latitude": latitude, "longitude": longitude, "seats": ride.seats}
+
+
+def _onboard_seats(stops):
+    """Seats of riders whose pickup is already done, i.e. only their drop-off remains."""
+    waiting = {stop["ride"] for stop in stops if stop["kind"] == "PICKUP"}
+    return sum(stop["seats"] for stop in stops if stop["kind"] == "DROPOFF" and stop["ride"] not in waiting)
+
+
+def _route_arrays(pools):
+    """Padded (T, K + 1) route arrays; route point 0 is the vehicle's current position."""
+    points = max(len(pool.stops) for pool in pools) + 1
+    latitudes = np.full((len(pools), points), np.nan)
+    longitudes = np.full((len(pools), points), np.nan)
+    load = np.zeros((len(pools), points))
+    valid = np.zeros((len(pools), points), dtype=bool)
+    for t, pool in enumerate(pools):
+        running = _onboard_seats(pool.stops)
+        latitudes[t, 0], longitudes[t, 0], load[t, 0], valid[t, 0] = (
+            pool.current_latitude, pool.current_longitude, running, True
+        )
+        for k, stop in enumerate(pool.stops, start=1):
+            running += stop["seats"] if stop["kind"] == "PICKUP" else -stop["seats"]
+            latitudes[t, k], longitudes[t, k], load[t, k], valid[t, k] = (
+                stop["latitude"], stop["longitude"], running, True
+            )
+    capacity = np.array([pool.seat_capacity for pool in pools], dtype=np.float64)
+    return latitudes, longitudes, load, valid, capacity
+
+
+def evaluate(pools, pickup, dropoff, seats=1):
+    """
+    Cheapest feasible insertion over all pools.
+
+    `pickup` and `dropoff` are (latitude, longitude). Returns
+    (pool, pickup_after, dropoff_after, added_km) where the positions index the
+    route (0 = vehicle, k = k-th remaining stop), or None.
+    """
+    if not pools:
+        return None
+    latitudes, longitudes, load, valid, capacity = _route_arrays(pools)
+    trips, points = latitudes.shape
+
+    def to_point(point):
+        return geo.haversine_km(latitudes, longitudes, point[0], point[1])
+
+    def from_point_to_next(point):
+        distance = np.zeros((trips, points))
+        distance[:, :-1] = geo.haversine_km(point[0], point[1], latitudes[:, 1:], longitudes[:, 1:])
+        return distance
+
+    has_next = np.zeros((trips, points), dtype=bool)
+    has_next[:, :-1] = valid[:, 1:]
+    leg = np.zeros((trips, points))
+    leg[:, :-1] = np.where(
+        has_next[:, :-1], geo.haversine_km(latitudes[:, :-1], longitudes[:, :-1], latitudes[:, 1:], longitudes[:, 1:]), 0.0
+    )
+    # cumulative[:, k] is the route length from point 0 to point k.
+    cumulative = np.zeros((trips, points + 1))
+    cumulative[:, 1:] = np.cumsum(leg, axis=1)
+
+    direct = float(geo.haversine_km(pickup[0], pickup[1], dropoff[0], dropoff[1]))
+    to_pickup, pickup_to_next = to_point(pickup), from_point_to_next(pickup)
+    to_dropoff, dropoff_to_next = to_point(dropoff), from_point_to_next(dropoff)
+
+    # Added length when inserting the pickup after i, the drop-off after j (i < j), or both after i.
+    pickup_cost = np.where(has_next, to_pickup + pickup_to_next - leg, to_pickup)
+    dropoff_cost = np.where(has_next, to_dropoff + dropoff_to_next - leg, to_dropoff)
+    together_cost = np.where(has_next, to_pickup + direct + dropoff_to_next - leg, to_pickup + direct)
+
+    i = np.arange(points)[:, None]
+    j = np.arange(points)[None, :]
+    same = i == j
+    added = np.where(same, together_cost[:, :, None], pickup_cost[:, :, None] + dropoff_cost[:, None, :])
+
+    # The new rider rides from the pickup through points i+1..j, then to the drop-off.
+    in_vehicle = np.where(
+        same,
+        direct,
+        pickup_to_next[:, :, None] + cumulative[:, None, :points] - cumulative[:, 1:, None] + to_dropoff[:, None, :],
+    )
+
+    # The new rider is on board over legs i..j, so the peak load there must leave room for them.
+    peak_load = np.full((trips, points, points), np.inf)
+    for start in range(points):
+        peak_load[:, start, start:] = np.maximum.accumulate(load[:, start:], axis=1)
+
+    feasible = (
+        valid[:, :, None]
+        & valid[:, None, :]
+        & (j >= i)[None]
+        & (peak_load + seats <= capacity[:, None, None])
+        & (in_vehicle <= direct * (1.0 + settings.POOL_MAX_DETOUR_RATIO) + 1e-9)
+        & (added <= settings.POOL_MAX_ADDED_KM)
+    )
+    score = np.where(feasible, added, np.inf)
+    best = int(np.argmin(score))
+    if not np.isfinite(score.flat[best]):
+        return None
+    trip, pickup_after, dropoff_after = np.unravel_index(best, score.shape)
+    return pools[trip], int(pickup_after), int(dropoff_after), float(score.flat[best])
+
+
+def _insert(stops, ride, pickup_after, dropoff_after):
+    stops = list(stops)
+    stops.insert(pickup_after, _stop(ride, "PICKUP"))
+    stops.insert(dropoff_after + 1, _stop(ride, "DROPOFF"))
+    return stops
+
+
+def _set_position(pool, latitude, longitude):
+    if latitude is None or longitude is None:
+        return
+    pool.current_latitude = latitude
+    pool.current_longitude = longitude
+    pool.cell = geo.encode(latitude, longitude, settings.POOL_CELL_PRECISION)
+
+
+def candidate_pools(ride):
+    cells = geo.neighbors(geo.encode(ride.user_pickup_latitude, ride.user_pickup_longitude, settings.POOL_CELL_PRECISION))
+    pools = RidePool.objects.filter(
+        is_active=True,
+        cell__in=cells,
+        driver__isnull=False,
+        vehicle__vehichle_type__ride_type=ride.ride_type,
+        vehicle__vehichle_type__vehicle_type=ride.vehicle_type,
+    )
+    return [pool for pool in pools if len(pool.stops) + 2 <= settings.POOL_MAX_STOPS]
+
+
+def match(ride):
+    """Insert a pooled ride into the best active trip; returns the pool or None."""
+    pickup = (ride.user_pickup_latitude, ride.user_pickup_longitude)
+    dropoff = (ride.user_ride_end_latitude, ride.user_ride_end_longitude)
+    best = evaluate(candidate_pools(ride), pickup, dropoff, ride.seats)
+    if best is None:
+        return None
+
+    with transaction.atomic():
+        pool = RidePool.objects.select_for_update().get(id=best[0].id)
+        if pool.stops != best[0].stops or not pool.is_active:
+            # The trip moved on since it was scored; re-check it alone.
+            best = evaluate([pool], pickup, dropoff, ride.seats) if pool.is_active else None
+            if best is None:
+                return None
+        _, pickup_after, dropoff_after, _ = best
+        pool.stops = _insert(pool.stops, ride, pickup_after, dropoff_after)
+        pool.save(update_fields=["stops", "updated_at"])
+
+        ride.ride_pool = pool
+        ride.driver_id = pool.driver_id
+        ride.vehicle_id = pool.vehicle_id
+        ride.ride_status = "ACCEPTED"
+        ride.save(update_fields=["ride_pool", "driver", "vehicle", "ride_status", "updated_at"])
+    return pool
+
+
+def start_pool(ride, latitude, longitude):
+    """Open a new shared trip for a pooled ride that was just given a driver."""
+    vehicle = ride.vehicle
+    pool = RidePool(
+        driver_id=ride.driver_id,
+        vehicle=vehicle,
+        seat_capacity=(vehicle.vehicle_seat_number if vehicle and vehicle.vehicle_seat_number else settings.POOL_DEFAULT_SEATS),
+        stops=[_stop(ride, "PICKUP"), _stop(ride, "DROPOFF")],
+    )
+    _set_position(pool, latitude, longitude)
+    pool.save()
+    ride.ride_pool = pool
+    ride.save(update_fields=["ride_pool", "updated_at"])
+    return pool
+
+
+def advance(ride):
+    """Drop the stops a pooled ride no longer needs after its latest transition."""
+    if not ride.ride_pool_id:
+        return
+    ride_id = str(ride.id)
+    with transaction.atomic():
+        pool = RidePool.objects.select_for_update().get(id=ride.ride_pool_id)
+        if ride.ride_status == "RIDE_START":
+            pool.stops = [stop for stop in pool.stops if not (stop["ride"] == ride_id and stop["kind"] == "PICKUP")]
+            _set_position(pool, ride.driver_pickup_latitude, ride.driver_pickup_longitude)
+        elif ride.ride_status in ("RIDE_END", "PAID", "COMPLETED"):
+            pool.stops = [stop for stop in pool.stops if stop["ride"] != ride_id]
+            _set_position(pool, ride.driver_ride_end_latitude, ride.driver_ride_end_longitude)
+        elif ride.ride_status == "CANCELLED":
+            pool.stops = [stop for stop in pool.stops if stop["ride"] != ride_id]
+        elif ride.ride_status == "WAITING":
+            _set_position(pool, ride.driver_waiting_latitude, ride.driver_waiting_longitude)
+        pool.is_active = bool(pool.stops)
+        pool.save()
@@ -0,0 +1,141 @@
+"""
+Read models projected incrementally from the RideEvent log.
+
+Each projector turns events into counter increments on its own tables and
+remembers the last event id it applied in a ProjectionCheckpoint. A run
+locks the checkpoint row, reads the next RIDE_EVENT_PROJECTION_BATCH events
+after it, adds the increments and moves the checkpoint, all in one
+transaction, so every event is applied exactly once however often or
+wherever `project_ride_events` runs.
+
+Ids are handed out when a transaction inserts its event, not when it
+commits, so a later id can become visible before an earlier one. Projectors
+therefore only consume events older than RIDE_EVENT_PROJECTION_LAG_SECONDS, by
+which time every transition transaction has long committed, and a batch stops
+at the first event that is not: the checkpoint never moves past an event that
+has yet to be applied.
+
+Days and hours are local (TIME_ZONE) calendar buckets.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from ride.models import DriverDailyStats, ProjectionCheckpoint, RideEvent, RideFunnelDaily, ZoneHourlyDemand
+
+REQUESTED_FROM = (None, "SCHEDULED")
+
+
+def _day(moment):
+    return timezone.localtime(moment).date()
+
+
+def _hour(moment):
+    return timezone.localtime(moment).replace(minute=0, second=0, microsecond=0)
+
+
+class DriverDailyProjector:
+    name = "driver_daily_stats"
+    models = (DriverDailyStats,)
+
+    def changes(self, event):
+        if event.driver_id is None:
+            return
+        lookup = {"driver_id": event.driver_id, "day": _day(event.occurred_at)}
+        if event.to_status == "ACCEPTED":
+            yield DriverDailyStats, lookup, {"accepted": 1}
+        elif event.to_status == "PAID":
+            yield DriverDailyStats, lookup, {"completed": 1, "earnings": event.payable_amount}
+        elif event.to_status == "CANCELLED":
+            yield DriverDailyStats, lookup, {"cancelled": 1}
+
+
+class ZoneHourlyDemandProjector:
+    name = "zone_hourly_demand"
+    models = (ZoneHourlyDemand,)
+    counters = {"ACCEPTED": "accepted", "PAID": "completed", "CANCELLED": "cancelled"}
+
+    def changes(self, event):
+        lookup = {"zone_id": event.zone_id, "hour": _hour(event.occurred_at)}
+        if event.to_status == "PENDING" and event.from_status in REQUESTED_FROM:
+            yield ZoneHourlyDemand, lookup, {"requested": 1}
+        elif event.to_status in self.counters:
+            yield ZoneHourlyDemand, lookup, {self.counters[event.to_status]: 1}
+
+
+class RideFunnelProjector:
+    name = "ride_funnel_daily"
+    models = (RideFunnelDaily,)
+    stages = {"ACCEPTED": "accepted", "RIDE_START": "started", "RIDE_END": "ended", "PAID": "paid", "CANCELLED": "cancelled"}
+
+    def changes(self, event):
+        # Cohorts by the day the ride was requested, so each row reads as a conversion funnel.
+        lookup = {"day": _day(event.requested_at)}
+        if event.to_status == "PENDING" and event.from_status in REQUESTED_FROM:
+            yield RideFunnelDaily, lookup, {"requested": 1}
+        elif event.to_status in self.stages:
+            yield RideFunnelDaily, lookup, {self.stages[event.to_status]: 1}
+
+
+PROJECTORS = {
+    projector.name: projector
+    for projector in (DriverDailyProjector(), ZoneHourlyDemandProjector(), RideFunnelProjector())
+}
+
+
+def _apply(totals):
+    for (model, lookup), deltas in totals.items():
+        lookup = dict(lookup)
+        updated = model.objects.filter(**lookup).update(**{field: F(field) + value for field, value in deltas.items()})
+        if not updated:
+            model.objects.create(**lookup, **deltas)
+
+
+def run(projector, now=None):
+    """Apply the next batch of events to `projector`'s read models; returns how many events it consumed."""
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.RIDE_EVENT_PROJECTION_LAG_SECONDS)
+    with transaction.atomic():
+        checkpoint, _ = ProjectionCheckpoint.objects.select_for_update().get_or_create(name=projector.name)
+        events = []
+        for event in RideEvent.objects.filter(id__gt=checkpoint.position).order_by("id")[
+            : settings.RIDE_EVENT_PROJECTION_BATCH
+        ]:
+            if event.occurred_at > cutoff:
+                break
+            events.append(event)
+        if not events:
+            return 0
+        totals = defaultdict(Counter)
+        for event in events:
+            for model, lookup, deltas in projector.changes(event):
+                totals[model, tuple(lookup.items())].update(deltas)
+        _apply(totals)
+        checkpoint.position = events[-1].id
+        checkpoint.save(update_fields=["position", "updated_at"])
+    return len(events)
+
+
+def catch_up(now=None):
+    """Run every projector until it has consumed all settled events; returns {name: events consumed}."""
+    consumed = {}
+    for name, projector in PROJECTORS.items():
+        consumed[name] = 0
+        while True:
+            count = run(projector, now)
+            consumed[name] += count
+            if count < settings.RIDE_EVENT_PROJECTION_BATCH:
+                break
+    return consumed
+
+
+def rebuild(name):
+    """Empty a projector's read models and rewind its checkpoint; the next runs replay the whole log."""
+    projector = PROJECTORS[name]
+    with transaction.atomic():
+        ProjectionCheckpoint.objects.select_for_update().filter(name=name).update(position=0)
+        for model in projector.models:
+            model.objects.all().delete()
@@ -0,0 +1,105 @@
+"""
+Upfront fares as signed, stateless quote tokens.
+
+The quote endpoint prices a trip once, with the peak-hour, surge and zone
+rates in force at that moment, and returns the fare together with a token:
+the quote (rider, ride and vehicle type, both coordinates, package weight,
+distance, rates, fare and expiry) serialized and HMAC-signed with
+django.core.signing under RIDE_QUOTE_SECRET (SECRET_KEY when unset).
+
+Creating a ride with the token only checks the signature, the expiry, the
+rider and that the trip is the one quoted; nothing is stored, so any app
+server can do it without a database or cache read. The ride keeps the quoted
+fare as `price` with `is_price_locked` set, and ride end charges that price
+instead of pricing the trip a second time.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from haversine import Unit, haversine
+
+from core.helpers import zones
+from core.models import ConstantTable
+from ride.helpers import surge
+
+SALT = "ride.quote"
+# Fields of a quote that must match the ride created from it.
+TRIP_FIELDS = (
+    "ride_type",
+    "vehicle_type",
+    "user_pickup_latitude",
+    "user_pickup_longitude",
+    "user_ride_end_latitude",
+    "user_ride_end_longitude",
+    "package_weight",
+)
+
+
+class InvalidQuote(ValueError):
+    pass
+
+
+def _key():
+    return settings.RIDE_QUOTE_SECRET or None
+
+
+def price(user, trip, now=None):
+    """The quote for `trip` (a dict of TRIP_FIELDS) priced for `user` right now."""
+    now = now or timezone.now()
+    pickup = (trip["user_pickup_latitude"], trip["user_pickup_longitude"])
+    dropoff = (trip["user_ride_end_latitude"], trip["user_ride_end_longitude"])
+    constant_table = ConstantTable.constant_table_instance(country_code=user.country_code)
+    is_peak_hours = constant_table.is_peak_hour(
+        peak_hours=constant_table.peak_hours, current_time=timezone.localtime(now).time()
+    )
+    surge_multiplier = surge.multiplier(*pickup)
+    zone = zones.pricing_zone(*pickup, user.country_code) or zones.pricing_zone(*dropoff, user.country_code)
+    distance = haversine(pickup, dropoff, unit=Unit.KILOMETERS)
+    fare = constant_table.calculate_fare(
+        country_code=user.country_code,
+        ride_type=trip["ride_type"],
+        distance=distance,
+        duration=int(distance / settings.ETA_AVERAGE_SPEED_KMH * 3600),
+        is_peak_hours=is_peak_hours,
+        surge_multiplier=surge_multiplier,
+        is_delivery=trip["vehicle_type"] == "PACKAGE_DELIVERY",
+        package_weight=trip["package_weight"],
+        zone=zone,
+    )[0]
+    return {
+        **{field: trip[field] for field in TRIP_FIELDS},
+        "user": str(user.pk),
+        "distance": distance,
+        "is_peak_hours": is_peak_hours,
+        "surge_multiplier": surge_multiplier,
+        "price": round(fare, 2),
+        "expires_at": int(now.timestamp()) + settings.RIDE_QUOTE_TTL_SECONDS,
+    }
+
+
+def sign(quote):
+    return signing.dumps(quote, key=_key(), salt=SALT, compress=True)
+
+
+def verify(token, user, trip, now=None):
+    """The signed quote, if it is `user`'s, unexpired and for `trip`; raises InvalidQuote otherwise."""
+    try:
+        quote = signing.loads(token, key=_key(), salt=SALT)
+    except signing.BadSignature:
+        raise InvalidQuote("Invalid price quote")
+    if quote["user"] != str(user.pk):
+        raise InvalidQuote("Invalid price quote")
+    if (now or time.time()) > quote["expires_at"]:
+        raise InvalidQuote("Price quote has expired, please request a new one")
+    for field in TRIP_FIELDS:
+        quoted, requested = quote[field], trip.get(field)
+        if isinstance(quoted, (int, float)) and isinstance(requested, (int, float)):
+            matches = math.isclose(quoted, requested, abs_tol=1e-6)
+        else:
+            matches = quoted == requested
+        if not matches:
+            raise InvalidQuote("Ride does not match its price quote")
+    return quote
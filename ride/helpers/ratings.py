@@ -0,0 +1,138 @@
+"""
+Ratings after a ride, and the running aggregates on the rated User.
+
+The rider rates the driver (Ride.rating) and the driver rates the rider
+(Ride.user_rating), once each, after the ride is paid. A rating claims the
+ride's flag with a conditional UPDATE and adds itself to the rated user in a
+single UPDATE of F() expressions, in one transaction: count and sum for the
+lifetime average, and a decayed weighted sum and weight for the average shown
+as User.rating / User.rating_average. Each earlier rating keeps RATING_DECAY
+of its weight per newer one, so the average follows recent trips without a
+window to keep, and a user's first ratings are not dragged toward zero.
+
+`rebuild_ratings` recomputes every aggregate from the rides, a chunk of users
+at a time.
+"""
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from core.models import User
+from ride.models import Ride
+
+RATEABLE_STATUSES = ("PAID", "COMPLETED")
+AGGREGATE_FIELDS = ("rating", "rating_average", "rating_count", "rating_sum", "rating_weight", "rating_weighted_sum")
+
+
+@dataclass(frozen=True)
+class Side:
+    rater: str
+    rated: str
+    score: str
+    feedback: str
+    flag: str
+    rated_at: str
+
+
+# Keyed by who is rated, as User.user_type: RIDER is the driver.
+SIDES = {
+    "RIDER": Side("user", "driver", "rating", "ride_feedback", "is_rated", "rated_at"),
+    "USER": Side("driver", "user", "user_rating", "user_feedback", "is_user_rated", "user_rated_at"),
+}
+
+
+def _increments(score, now):
+    weight = F("rating_weight") * settings.RATING_DECAY + 1
+    weighted_sum = F("rating_weighted_sum") * settings.RATING_DECAY + score
+    # Every right-hand side reads the row as it was before this UPDATE.
+    return {
+        "rating_count": F("rating_count") + 1,
+        "rating_sum": F("rating_sum") + score,
+        "rating_weight": weight,
+        "rating_weighted_sum": weighted_sum,
+        "rating_average": weighted_sum / weight,
+        "rating": Round(weighted_sum / weight),
+        "updated_at": now,
+    }
+
+
+def rate(rated, rater, ride_id, score, feedback=None):
+    """Record `rater`'s rating of the other side of a paid ride; returns the rated user's id, or None if there is no such unrated ride."""
+    side = SIDES[rated]
+    now = timezone.now()
+    with transaction.atomic():
+        rated_id = (
+            Ride.objects.select_for_update()
+            .filter(
+                pk=ride_id,
+                ride_status__in=RATEABLE_STATUSES,
+                **{side.rater: rater, side.flag: False, f"{side.rated}__isnull": False},
+            )
+            .values_list(f"{side.rated}_id", flat=True)
+            .first()
+        )
+        if rated_id is None:
+            return None
+        Ride.objects.filter(pk=ride_id).update(
+            **{side.score: score, side.feedback: feedback, side.flag: True, side.rated_at: now}
+        )
+        User.objects.filter(pk=rated_id).update(**_increments(score, now))
+    return rated_id
+
+
+def aggregate(scores):
+    """The aggregate fields for a user's ratings, oldest first."""
+    values = {
+        "rating": 0,
+        "rating_average": 0.0,
+        "rating_count": 0,
+        "rating_sum": 0,
+        "rating_weight": 0.0,
+        "rating_weighted_sum": 0.0,
+    }
+    for score in scores:
+        values["rating_count"] += 1
+        values["rating_sum"] += score
+        values["rating_weight"] = values["rating_weight"] * settings.RATING_DECAY + 1
+        values["rating_weighted_sum"] = values["rating_weighted_sum"] * settings.RATING_DECAY + score
+    if values["rating_count"]:
+        values["rating_average"] = values["rating_weighted_sum"] / values["rating_weight"]
+        values["rating"] = round(values["rating_average"])
+    return values
+
+
+def rebuild_batch(after, limit):
+    """Recompute the aggregates of up to `limit` users after pk `after` (None to start); returns (last pk, users changed)."""
+    now = timezone.now()
+    queryset = User.objects.select_for_update().order_by("pk").only("pk", *AGGREGATE_FIELDS)
+    if after is not None:
+        queryset = queryset.filter(pk__gt=after)
+    with transaction.atomic():
+        # Locked first: a rating committing after this reads the rebuilt row and adds to it.
+        users = {user.pk: user for user in queryset[:limit]}
+        if not users:
+            return None, 0
+        ratings = defaultdict(list)
+        for side in SIDES.values():
+            rows = (
+                Ride.objects.filter(**{f"{side.rated}_id__in": list(users), side.flag: True})
+                .annotate(moment=Coalesce(side.rated_at, "updated_at"))
+                .values_list(f"{side.rated}_id", "moment", side.score)
+            )
+            for rated_id, moment, score in rows.iterator(chunk_size=2000):
+                ratings[rated_id].append((moment, score))
+        changed = []
+        for pk, user in users.items():
+            values = aggregate(score for _, score in sorted(ratings[pk], key=lambda rating: rating[0]))
+            if any(getattr(user, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(user, field, value)
+                user.updated_at = now
+                changed.append(user)
+        User.objects.bulk_update(changed, [*AGGREGATE_FIELDS, "updated_at"])
+    return list(users)[-1], len(changed)
@@ -0,0 +1,104 @@
+"""
+Book-ahead rides.
+
+A scheduled ride is stored with ride_status="SCHEDULED" and its pickup time in
+`scheduled_for`, so the Ride table itself is the durable queue. A partial
+index over the SCHEDULED rows on scheduled_for turns "what is due" into an
+index range scan however many bookings are waiting.
+
+`release_due` claims due rows with SELECT ... FOR UPDATE SKIP LOCKED, so
+several schedulers can run side by side, and moves them to PENDING in the same
+transaction. A crash before the commit leaves them SCHEDULED for the next
+pass; once committed a ride is no longer SCHEDULED and cannot fire twice.
+A rider has one ride under way at a time: a booking that falls due while its
+rider is already on a ride (or a second booking due in the same pass) is
+cancelled instead of released.
+
+Rides are released SCHEDULED_RIDE_LEAD_MINUTES before pickup so dispatch has
+time to find a driver. Surge and peak hours are priced at release, not at
+booking, except for a booking made with an upfront quote: its price is
+locked, so the quoted peak hours and surge stay with it.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from core.models import ConstantTable
+from ride.helpers import active_rides, pooling, surge
+from ride.models import Ride
+
+
+def _lead():
+    return timedelta(minutes=settings.SCHEDULED_RIDE_LEAD_MINUTES)
+
+
+def _dispatch(rides):
+    for ride in rides:
+        surge.record_demand(ride.user_pickup_latitude, ride.user_pickup_longitude)
+        if ride.is_pooled:
+            pooling.match(ride)
+
+
+def release_due(now=None, limit=None):
+    """Move the SCHEDULED rides due by `now` to PENDING; returns the rides released."""
+    now = now or timezone.now()
+    tables = {}
+    with transaction.atomic():
+        due = list(
+            Ride.objects.select_for_update(skip_locked=True, of=("self",))
+            .select_related("user")
+            .filter(ride_status="SCHEDULED", scheduled_for__lte=now + _lead())
+            .order_by("scheduled_for")[: limit or settings.SCHEDULED_RIDE_BATCH]
+        )
+        riding = set(
+            Ride.objects.filter(
+                user_id__in={ride.user_id for ride in due},
+                ride_status__in=active_rides.IN_PROGRESS_STATUSES,
+                is_completed=False,
+            ).values_list("user_id", flat=True)
+        )
+        rides = []
+        for ride in due:
+            if ride.user_id in riding:
+                ride.ride_status = "CANCELLED"
+                ride.cancelled_by = "NONE"
+                ride.cancelled_at = timezone.now()
+                ride.cancelled_reason = "Rider already had a ride in progress when the booking was due"
+                ride.is_completed = True
+                ride.save(
+                    update_fields=[
+                        "ride_status", "cancelled_by", "cancelled_at", "cancelled_reason", "is_completed", "updated_at",
+                    ]
+                )
+                continue
+            riding.add(ride.user_id)
+            rides.append(ride)
+            ride.ride_status = "PENDING"
+            if ride.is_price_locked:
+                # Priced, peak hours and surge included, when the quote was issued.
+                ride.save(update_fields=["ride_status", "updated_at"])
+                continue
+            country_code = ride.user.country_code if ride.user else None
+            if country_code not in tables:
+                tables[country_code] = ConstantTable.constant_table_instance(country_code=country_code)
+            constant_table = tables[country_code]
+            ride.is_peak_hours = constant_table.is_peak_hour(
+                peak_hours=constant_table.peak_hours, current_time=timezone.localtime(ride.scheduled_for).time()
+            )
+            ride.surge_multiplier = surge.multiplier(ride.user_pickup_latitude, ride.user_pickup_longitude)
+            ride.save(update_fields=["ride_status", "is_peak_hours", "surge_multiplier", "updated_at"])
+        transaction.on_commit(lambda: _dispatch(rides))
+    return rides
+
+
+def next_due():
+    """When the earliest booking is due for release, or None if nothing is scheduled."""
+    scheduled_for = (
+        Ride.objects.filter(ride_status="SCHEDULED")
+        .order_by("scheduled_for")
+        .values_list("scheduled_for", flat=True)
+        .first()
+    )
+    return None if scheduled_for is None else scheduled_for - _lead()
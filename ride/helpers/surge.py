@@ -0,0 +1,151 @@
+"""
+Dynamic surge pricing from live supply/demand per geohash cell.
+
+Ride requests and driver sightings are counted into time buckets in the Django
+cache (Redis in production), so recording is one or two atomic cache calls per
+event. A driver is counted in the bucket of their first heartbeat in a cell and
+then not again until that bucket has left the window, so, like each request,
+each driver online in a cell counts once in the window's sum however often they
+report. The `run_surge_engine` command sums the buckets of the sliding window for
+every cell each tick, turns the demand/supply ratio into a multiplier, smooths
+it and writes it back under one key per cell, which `CreateRideAPIView` reads in
+O(1).
+"""
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core.helpers import geo
+
+logger = logging.getLogger(__name__)
+
+DEMAND_KEY = "surge:demand:{cell}:{bucket}"
+SUPPLY_KEY = "surge:supply:{cell}:{bucket}"
+SEEN_KEY = "surge:seen:{cell}:{driver_id}"
+MULTIPLIER_KEY = "surge:multiplier:{cell}"
+
+
+def surge_cell(latitude, longitude):
+    return geo.encode(latitude, longitude, settings.SURGE_PRECISION)
+
+
+def _current_bucket():
+    return int(time.time() // settings.SURGE_BUCKET_SECONDS)
+
+
+def _bucket_count():
+    return max(settings.SURGE_WINDOW_SECONDS // settings.SURGE_BUCKET_SECONDS, 1)
+
+
+def _window_buckets():
+    current = _current_bucket()
+    return range(current - _bucket_count() + 1, current + 1)
+
+
+def _seen_timeout(bucket):
+    """Seconds until `bucket` leaves the window, when its drivers may be counted again."""
+    return max(math.ceil((bucket + _bucket_count()) * settings.SURGE_BUCKET_SECONDS - time.time()), 1)
+
+
+def _increment(key):
+    timeout = settings.SURGE_WINDOW_SECONDS + settings.SURGE_BUCKET_SECONDS
+    cache.add(key, 0, timeout=timeout)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The bucket expired between add() and incr(); it is outside the window anyway.
+        pass
+
+
+def record_demand(latitude, longitude):
+    """Count a new PENDING ride request at the pickup location."""
+    _increment(DEMAND_KEY.format(cell=surge_cell(latitude, longitude), bucket=_current_bucket()))
+
+
+def record_supply(driver_id, latitude, longitude):
+    """Count an ONLINE driver seen at a location, once per driver and cell per window."""
+    cell = surge_cell(latitude, longitude)
+    bucket = _current_bucket()
+    seen = cache.add(SEEN_KEY.format(cell=cell, driver_id=driver_id), bucket, timeout=_seen_timeout(bucket))
+    if seen:
+        _increment(SUPPLY_KEY.format(cell=cell, bucket=bucket))
+
+
+def record_supply_many(sightings):
+    """`record_supply` for (driver_id, latitude, longitude) sightings; one get_many skips those already counted."""
+    bucket = _current_bucket()
+    cells = {}
+    for driver_id, latitude, longitude in sightings:
+        cell = surge_cell(latitude, longitude)
+        cells[SEEN_KEY.format(cell=cell, driver_id=driver_id)] = cell
+    seen = cache.get_many(list(cells))
+    timeout = _seen_timeout(bucket)
+    for key, cell in cells.items():
+        if key not in seen and cache.add(key, bucket, timeout=timeout):
+            _increment(SUPPLY_KEY.format(cell=cell, bucket=bucket))
+
+
+def multiplier(latitude, longitude):
+    """Current smoothed surge multiplier at a location (1.0 when there is no surge)."""
+    return cache.get(MULTIPLIER_KEY.format(cell=surge_cell(latitude, longitude)), 1.0)
+
+
+def raw_multiplier(demand, supply):
+    """Unsmoothed multiplier for a demand/supply pair."""
+    if demand < settings.SURGE_MIN_DEMAND:
+        return 1.0
+    ratio = demand / max(supply, 1)
+    value = 1.0 + settings.SURGE_SENSITIVITY * (ratio - 1.0)
+    return min(max(value, 1.0), settings.SURGE_MAX_MULTIPLIER)
+
+
+class SurgeEngine:
+    """Recomputes the per-cell multipliers from the sliding-window counters."""
+
+    def __init__(self, cells):
+        self.cells = sorted(set(cells))
+
+    def tick(self):
+        """Recompute every cell once; returns the cells whose multiplier is above 1."""
+        buckets = list(_window_buckets())
+        keys = []
+        for cell in self.cells:
+            for bucket in buckets:
+                keys.append(DEMAND_KEY.format(cell=cell, bucket=bucket))
+                keys.append(SUPPLY_KEY.format(cell=cell, bucket=bucket))
+        counts = cache.get_many(keys)
+        previous = cache.get_many([MULTIPLIER_KEY.format(cell=cell) for cell in self.cells])
+
+        alpha = settings.SURGE_SMOOTHING
+        updates = {}
+        surging = {}
+        for cell in self.cells:
+            demand = sum(counts.get(DEMAND_KEY.format(cell=cell, bucket=bucket), 0) for bucket in buckets)
+            supply = sum(counts.get(SUPPLY_KEY.format(cell=cell, bucket=bucket), 0) for bucket in buckets)
+            key = MULTIPLIER_KEY.format(cell=cell)
+            last = previous.get(key, 1.0)
+            value = round(last + alpha * (raw_multiplier(demand, supply) - last), 2)
+            if value != last or key in previous:
+                updates[key] = value
+            if value > 1.0:
+                surging[cell] = value
+        if updates:
+            cache.set_many(updates, timeout=settings.SURGE_WINDOW_SECONDS * 2)
+        return surging
+
+
+def area_cells(areas):
+    """Surge cells covering the ETA matrices of the given service areas."""
+    from ride.helpers import eta_matrix
+
+    cells = set()
+    for area in areas:
+        matrix = eta_matrix.get_matrix(area)
+        if matrix is None:
+            continue
+        for geohash in geo.to_geohash(matrix.cell_ids, matrix.precision):
+            cells.add(geohash[: settings.SURGE_PRECISION])
+    return cells
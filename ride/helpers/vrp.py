@@ -0,0 +1,143 @@
+"""
+Capacitated vehicle routing for package delivery batches.
+
+Stops are projected to a local plane in km, routes are built with the
+Clarke-Wright savings heuristic restricted to each stop's nearest neighbours
+(so 5,000 stops cost ~100k candidate merges rather than 12.5M), and each route
+is then improved with 2-opt, scoring all move pairs of a route in one numpy
+operation.
+
+The solver is anytime: every stage stops at the deadline and the current
+routes are always feasible (unmerged stops are simply their own route), so it
+fits inside a dispatch tick.
+"""
+import math
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from core.helpers.geo import EARTH_RADIUS_KM
+
+
+class Solution:
+    """Routes as lists of stop indices, each starting and ending at the depot."""
+
+    def __init__(self, routes, loads, distance_km):
+        self.routes = routes
+        self.loads = loads
+        self.distance_km = distance_km
+
+    def __len__(self):
+        return len(self.routes)
+
+
+def project(latitudes, longitudes, origin_latitude):
+    """Equirectangular projection to km; accurate at city scale."""
+    scale = math.cos(math.radians(origin_latitude))
+    return np.column_stack(
+        [
+            np.radians(np.asarray(longitudes, dtype=np.float64)) * EARTH_RADIUS_KM * scale,
+            np.radians(np.asarray(latitudes, dtype=np.float64)) * EARTH_RADIUS_KM,
+        ]
+    )
+
+
+def path_length(points):
+    return float(np.linalg.norm(np.diff(points, axis=0), axis=1).sum())
+
+
+def route_length(xy, depot, route):
+    return path_length(np.vstack([depot, xy[route], depot]))
+
+
+def savings(xy, depot, demands, capacity, neighbours, deadline):
+    """Clarke-Wright parallel savings over nearest-neighbour pairs."""
+    count = len(xy)
+    route_of = list(range(count))
+    routes = {index: [index] for index in range(count)}
+    loads = {index: float(demands[index]) for index in range(count)}
+    k = min(neighbours, count - 1)
+    if k <= 0:
+        return routes, loads
+
+    from_depot = np.linalg.norm(xy - depot, axis=1)
+    distances, indices = cKDTree(xy).query(xy, k=k + 1)
+    first = np.repeat(np.arange(count), k)
+    second = indices[:, 1:].ravel()
+    low, high = np.minimum(first, second), np.maximum(first, second)
+    _, unique = np.unique(low * count + high, return_index=True)
+    low, high = low[unique], high[unique]
+    saving = from_depot[low] + from_depot[high] - distances[:, 1:].ravel()[unique]
+    order = np.argsort(-saving, kind="stable")
+
+    for step, pair in enumerate(order):
+        if saving[pair] <= 0:
+            break
+        if step % 1024 == 0 and time.monotonic() > deadline:
+            break
+        a, b = int(low[pair]), int(high[pair])
+        route_a, route_b = route_of[a], route_of[b]
+        if route_a == route_b or loads[route_a] + loads[route_b] > capacity:
+            continue
+        first_route, second_route = routes[route_a], routes[route_b]
+        if first_route[-1] == a and second_route[0] == b:
+            merged = first_route + second_route
+        elif second_route[-1] == b and first_route[0] == a:
+            merged = second_route + first_route
+        elif first_route[-1] == a and second_route[-1] == b:
+            merged = first_route + second_route[::-1]
+        elif first_route[0] == a and second_route[0] == b:
+            merged = first_route[::-1] + second_route
+        else:
+            # a or b is interior to its route, so the two cannot be joined there.
+            continue
+        keep, drop = (route_a, route_b) if len(first_route) >= len(second_route) else (route_b, route_a)
+        for node in routes[drop]:
+            route_of[node] = keep
+        routes[keep] = merged
+        loads[keep] = loads[route_a] + loads[route_b]
+        del routes[drop], loads[drop]
+    return routes, loads
+
+
+def two_opt(xy, depot, route, deadline):
+    """Best-improvement 2-opt on one route; returns the improved stop order."""
+    if len(route) < 3:
+        return route
+    points = np.vstack([depot, xy[route], depot])
+    distance = np.linalg.norm(points[:, None, :] - points[None, :, :], axis=2)
+    order = np.arange(len(points))
+    # Edges (i, i+1) and (j, j+1) with j >= i + 2; reversing order[i+1 : j+1] swaps them.
+    i, j = np.triu_indices(len(points) - 1, k=2)
+    while time.monotonic() < deadline:
+        delta = (
+            distance[order[i], order[j]]
+            + distance[order[i + 1], order[j + 1]]
+            - distance[order[i], order[i + 1]]
+            - distance[order[j], order[j + 1]]
+        )
+        best = int(np.argmin(delta))
+        if delta[best] > -1e-9:
+            break
+        order[i[best] + 1 : j[best] + 1] = order[i[best] + 1 : j[best] + 1][::-1]
+    return [route[position - 1] for position in order[1:-1]]
+
+
+def solve(depot_latitude, depot_longitude, latitudes, longitudes, demands, capacity, time_budget, neighbours=20):
+    """Savings + 2-opt CVRP from one depot, bounded by `time_budget` seconds."""
+    deadline = time.monotonic() + time_budget
+    xy = project(latitudes, longitudes, depot_latitude)
+    depot = project([depot_latitude], [depot_longitude], depot_latitude)[0]
+    demands = np.asarray(demands, dtype=np.float64)
+    if not len(xy):
+        return Solution([], [], 0.0)
+
+    routes, loads = savings(xy, depot, demands, capacity, neighbours, deadline)
+    ordered = sorted(routes, key=lambda key: len(routes[key]), reverse=True)
+    improved = [two_opt(xy, depot, routes[key], deadline) for key in ordered]
+    return Solution(
+        improved,
+        [loads[key] for key in ordered],
+        sum(route_length(xy, depot, route) for route in improved),
+    )
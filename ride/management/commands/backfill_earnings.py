@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ride.helpers import earnings
+
+
+class Command(BaseCommand):
+    help = "Count paid and cancelled rides from before the earnings rollups into them, a chunk per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        counted = 0
+        while True:
+            count = earnings.backfill_batch(options["batch_size"])
+            counted += count
+            if count < options["batch_size"]:
+                break
+        self.stdout.write(f"Counted {counted} rides into the earnings rollups")
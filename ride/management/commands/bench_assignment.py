@@ -0,0 +1,96 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from core.models import RIDE_TYPE
+from ride.helpers import assignment
+from ride.helpers.driver_locations import DriverPositions
+from ride.models import Ride
+
+
+class Command(BaseCommand):
+    help = "Compare greedy and batch-optimal matching on replayed (or synthetic) rides."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--area", help="country_code whose rides are replayed")
+        parser.add_argument("--size", type=int, default=2000, help="requests and drivers per batch")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        size = options["size"]
+        rng = np.random.default_rng(options["seed"])
+        area = options["area"]
+        requests, drivers = self.replayed(area, size) if area else (None, None)
+        if requests is None:
+            self.stdout.write("Using synthetic rides around Lagos")
+            requests, drivers = self.synthetic(size, rng)
+
+        cost, distance_km = assignment.cost_matrix(drivers, requests, area)
+        self.stdout.write(f"{len(drivers)} drivers x {len(requests)} requests")
+
+        for name, solver in (("greedy", assignment.greedy), ("optimal", assignment.solve)):
+            started = time.perf_counter()
+            rows, columns = solver(cost)
+            elapsed = time.perf_counter() - started
+            total = distance_km[rows, columns].sum()
+            self.stdout.write(
+                f"{name:>8}: {len(rows)} matched, total pickup {total:.1f} km, "
+                f"mean {total / max(len(rows), 1):.2f} km, solved in {elapsed * 1000:.1f} ms"
+            )
+
+    def replayed(self, area, size):
+        """Requests are the latest pickups; drivers stand at the drop-offs of the rides before them."""
+        rides = list(
+            Ride.objects.filter(
+                user__country_code=area,
+                user_pickup_latitude__isnull=False,
+                driver_ride_end_latitude__isnull=False,
+            )
+            .order_by("-created_at")
+            .values_list(
+                "id",
+                "ride_type",
+                "vehicle_type",
+                "user_pickup_latitude",
+                "user_pickup_longitude",
+                "driver_ride_end_latitude",
+                "driver_ride_end_longitude",
+            )[: size * 2]
+        )
+        if len(rides) < 2:
+            return None, None
+        half = len(rides) // 2
+        request_rows, driver_rows = rides[:half], rides[half:]
+        requests = assignment.OpenRequests(
+            [row[0] for row in request_rows],
+            [row[1] for row in request_rows],
+            [row[2] for row in request_rows],
+            [row[3] for row in request_rows],
+            [row[4] for row in request_rows],
+        )
+        drivers = DriverPositions(
+            [row[0] for row in driver_rows],
+            [None] * len(driver_rows),
+            [row[1] for row in driver_rows],
+            [row[2] for row in driver_rows],
+            [row[5] for row in driver_rows],
+            [row[6] for row in driver_rows],
+        )
+        return requests, drivers
+
+    def synthetic(self, size, rng):
+        ride_types = [choice for choice, _ in RIDE_TYPE]
+
+        def points():
+            return 6.45 + rng.random(size) * 0.2, 3.30 + rng.random(size) * 0.25
+
+        latitudes, longitudes = points()
+        requests = assignment.OpenRequests(
+            list(range(size)), rng.choice(ride_types, size), ["RIDES"] * size, latitudes, longitudes
+        )
+        latitudes, longitudes = points()
+        drivers = DriverPositions(
+            list(range(size)), [None] * size, rng.choice(ride_types, size), ["RIDES"] * size, latitudes, longitudes
+        )
+        return requests, drivers
@@ -0,0 +1,38 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ride.helpers import autocomplete
+
+
+class Command(BaseCommand):
+    help = "Replay simulated keystrokes against the autocomplete index and report latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=2000, help="destinations typed out key by key")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        index = autocomplete.get_index()
+        if index is None:
+            raise CommandError("No autocomplete index; run build_autocomplete first")
+        rng = np.random.default_rng(options["seed"])
+        entries = rng.integers(0, len(index.offsets) - 1, options["queries"])
+
+        timings = []
+        for entry in entries:
+            label = index.label(int(entry))
+            latitude = float(index.latitudes[entry]) + rng.normal(0, 0.05)
+            longitude = float(index.longitudes[entry]) + rng.normal(0, 0.05)
+            for end in range(1, min(len(label), 16) + 1):
+                started = time.perf_counter()
+                index.suggest(label[:end], latitude, longitude)
+                timings.append(time.perf_counter() - started)
+
+        timings = np.array(timings) * 1000
+        self.stdout.write(
+            f"{len(timings)} keystrokes: p50 {np.percentile(timings, 50):.3f} ms, "
+            f"p99 {np.percentile(timings, 99):.3f} ms, max {timings.max():.3f} ms, "
+            f"{len(timings) / (timings.sum() / 1000):.0f} keystrokes/s on one core"
+        )
@@ -0,0 +1,97 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from core.renderers import MessagePackRenderer, ORJSONRenderer
+from ride.models import Ride
+from ride.serializer import RideStatusSerializer, ride_status_reader
+
+
+def sample_ride():
+    now = timezone.now()
+    return Ride(
+        user_id=uuid.uuid4(),
+        driver_id=uuid.uuid4(),
+        vehicle_id=uuid.uuid4(),
+        user_location_latitude=6.5244,
+        user_location_longitude=3.3792,
+        user_location_address="14 Allen Avenue, Ikeja, Lagos",
+        user_pickup_latitude=6.5251,
+        user_pickup_longitude=3.3801,
+        user_pickup_address="16 Allen Avenue, Ikeja, Lagos",
+        user_ride_end_latitude=6.4281,
+        user_ride_end_longitude=3.4219,
+        user_ride_end_address="Eko Hotel, Adetokunbo Ademola Street, Victoria Island",
+        driver_waiting_latitude=6.5250,
+        driver_waiting_longitude=3.3800,
+        driver_waiting_address="16 Allen Avenue, Ikeja, Lagos",
+        driver_pickup_latitude=6.5251,
+        driver_pickup_longitude=3.3801,
+        driver_pickup_address="16 Allen Avenue, Ikeja, Lagos",
+        ride_type="ECONOMY",
+        vehicle_type="RIDES",
+        ride_status="RIDE_START",
+        ride_distance=14.2,
+        ride_distance_unit="KILOMETERS",
+        ride_start_time=now - timedelta(minutes=12),
+        ride_duration=timedelta(minutes=12),
+        price=5400.0,
+        surge_multiplier=1.3,
+        waiting_at=now - timedelta(minutes=15),
+        payment_method="CASH",
+    )
+
+
+def sample_row(ride):
+    """The .values() row RideStatusReader would fetch for `ride`."""
+    row = {column: getattr(ride, column) for column in ride_status_reader.columns() if "__" not in column}
+    row.update(driver__first_name="Tunde", driver__last_name="Bakare", vehicle__vehicle_plate_number="LND-482-KJ")
+    return row
+
+
+class Command(BaseCommand):
+    help = "Compare ride_status/ response serialization with the stdlib JSON, orjson and MessagePack renderers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20000)
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        ride = sample_ride()
+        renderers = (
+            ("json (stdlib)", JSONRenderer()),
+            ("orjson", ORJSONRenderer()),
+            ("msgpack", MessagePackRenderer()),
+        )
+
+        started = time.perf_counter()
+        for _ in range(iterations // 10):
+            RideStatusSerializer(ride).data
+        serialize_us = (time.perf_counter() - started) / (iterations // 10) * 1e6
+        self.stdout.write(f"RideStatusSerializer: {serialize_us:.1f} µs per ride")
+
+        row = sample_row(ride)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            ride_status_reader.to_representation(row)
+        project_us = (time.perf_counter() - started) / iterations * 1e6
+        self.stdout.write(f"    RideStatusReader: {project_us:.1f} µs per ride ({serialize_us / project_us:.0f}x)")
+
+        body = {"status": True, "message": "success", "ride_data": RideStatusSerializer(ride).data}
+        baseline = None
+        for name, renderer in renderers:
+            media_type = renderer.media_type
+            size = len(renderer.render(body, media_type))
+            started = time.perf_counter()
+            for _ in range(iterations):
+                renderer.render(body, media_type)
+            render_us = (time.perf_counter() - started) / iterations * 1e6
+            baseline = baseline or render_us
+            self.stdout.write(
+                f"{name:>14}: {render_us:6.2f} µs per response ({1e6 / render_us:,.0f}/s, "
+                f"{baseline / render_us:.1f}x), {size} bytes"
+            )
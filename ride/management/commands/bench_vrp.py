@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ride.helpers import vrp
+
+
+class Command(BaseCommand):
+    help = "Benchmark the delivery route solver on synthetic 500-5,000 stop instances around Lagos."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000, 5000])
+        parser.add_argument("--budget", type=float, default=None, help="seconds per instance (default: DELIVERY_SOLVER_SECONDS)")
+        parser.add_argument("--capacity", type=float, default=None, help="kg per vehicle (default: DELIVERY_VEHICLE_CAPACITY_KG)")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        budget = settings.DELIVERY_SOLVER_SECONDS if options["budget"] is None else options["budget"]
+        capacity = options["capacity"] or settings.DELIVERY_VEHICLE_CAPACITY_KG
+        depot_latitude, depot_longitude = 6.52, 3.37
+
+        for size in options["sizes"]:
+            latitudes = depot_latitude + rng.normal(0, 0.06, size)
+            longitudes = depot_longitude + rng.normal(0, 0.08, size)
+            weights = rng.uniform(0.5, 10.0, size)
+            xy = vrp.project(latitudes, longitudes, depot_latitude)
+            depot = vrp.project([depot_latitude], [depot_longitude], depot_latitude)[0]
+
+            isolated = 2 * np.linalg.norm(xy - depot, axis=1).sum()
+            started = time.perf_counter()
+            routes, _ = vrp.savings(xy, depot, weights, capacity, settings.DELIVERY_NEIGHBOURS, time.monotonic() + budget)
+            savings_seconds = time.perf_counter() - started
+            savings_km = sum(vrp.route_length(xy, depot, route) for route in routes.values())
+
+            started = time.perf_counter()
+            solution = vrp.solve(
+                depot_latitude, depot_longitude, latitudes, longitudes, weights, capacity, budget, settings.DELIVERY_NEIGHBOURS
+            )
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{size:>5} stops: {len(solution)} routes, isolated {isolated:.0f} km, "
+                f"savings {savings_km:.0f} km in {savings_seconds * 1000:.0f} ms, "
+                f"+2-opt {solution.distance_km:.0f} km in {elapsed * 1000:.0f} ms (budget {budget:.1f} s)"
+            )
@@ -0,0 +1,70 @@
+import csv
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count
+from django.utils import timezone
+
+from core.helpers import geocoder
+from ride.helpers import autocomplete
+from ride.models import Ride
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the destination autocomplete index from the gazetteer, an optional POI CSV "
+        "(name, latitude, longitude) and historical ride destinations; workers pick it up without a restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--poi", help="CSV of points of interest with name, latitude and longitude columns")
+        parser.add_argument("--no-gazetteer", action="store_true", help="skip the reverse-geocoding gazetteer")
+
+    def handle(self, *args, **options):
+        entries = {}
+
+        def add(label, latitude, longitude, rides=0):
+            key = autocomplete.normalize(label)
+            if not key:
+                return
+            entry = entries.setdefault(key, [label, latitude, longitude, 0])
+            entry[3] += rides
+
+        if not options["no_gazetteer"]:
+            gazetteer = geocoder.get_geocoder()
+            if gazetteer is not None:
+                points = np.asarray(gazetteer.points, dtype=np.float64)
+                latitudes = np.degrees(np.arcsin(np.clip(points[:, 2], -1.0, 1.0)))
+                longitudes = np.degrees(np.arctan2(points[:, 1], points[:, 0]))
+                for index in range(len(points)):
+                    add(gazetteer.label(index), float(latitudes[index]), float(longitudes[index]))
+
+        if options["poi"]:
+            with open(options["poi"], newline="", encoding="utf-8") as handle:
+                for row in csv.DictReader(handle):
+                    if row.get("name") and row.get("latitude") and row.get("longitude"):
+                        add(row["name"], float(row["latitude"]), float(row["longitude"]))
+
+        since = timezone.now() - timedelta(days=settings.AUTOCOMPLETE_HISTORY_DAYS)
+        destinations = (
+            Ride.objects.filter(
+                created_at__gte=since,
+                user_ride_end_address__isnull=False,
+                user_ride_end_latitude__isnull=False,
+                user_ride_end_longitude__isnull=False,
+            )
+            .exclude(user_ride_end_address="")
+            .values("user_ride_end_address")
+            .annotate(rides=Count("id"), latitude=Avg("user_ride_end_latitude"), longitude=Avg("user_ride_end_longitude"))
+            .order_by()
+        )
+        for row in destinations:
+            add(row["user_ride_end_address"], row["latitude"], row["longitude"], row["rides"])
+
+        if not entries:
+            raise CommandError("Nothing to index")
+        labels, latitudes, longitudes, popularity = zip(*entries.values())
+        version = autocomplete.build(labels, latitudes, longitudes, popularity)
+        self.stdout.write(f"Built autocomplete index {version} with {len(labels)} entries")
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ride.helpers import expiry
+
+
+class Command(BaseCommand):
+    help = "Cancel PENDING and ACCEPTED rides that stalled past their timeout, every RIDE_EXPIRY_TICK_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="run a single sweep and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            expired = expiry.expire()
+            if options["once"]:
+                for ride_status, ids in expired.items():
+                    self.stdout.write(f"{ride_status}: {len(ids)} rides expired")
+                break
+            time.sleep(max(settings.RIDE_EXPIRY_TICK_SECONDS - (time.monotonic() - started), 0))
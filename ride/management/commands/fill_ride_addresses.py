@@ -0,0 +1,41 @@
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+from core.helpers import geocoder
+from ride.helpers.addresses import ADDRESS_FIELDS, fill_missing
+from ride.models import Ride
+
+
+class Command(BaseCommand):
+    help = "Backfill missing ride addresses from the offline reverse geocoder."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if geocoder.get_geocoder() is None:
+            raise CommandError("No gazetteer index found; run build_gazetteer first")
+        missing = reduce(
+            or_,
+            (
+                Q(**{f"{latitude}__isnull": False, f"{longitude}__isnull": False})
+                & (Q(**{f"{address}__isnull": True}) | Q(**{address: ""}))
+                for latitude, longitude, address in ADDRESS_FIELDS
+            ),
+        )
+        fields = [address for _, _, address in ADDRESS_FIELDS]
+        batch, updated = [], 0
+        for ride in Ride.objects.filter(missing).only("id", *[name for triple in ADDRESS_FIELDS for name in triple]).iterator(
+            chunk_size=options["batch_size"]
+        ):
+            if fill_missing(ride):
+                batch.append(ride)
+            if len(batch) >= options["batch_size"]:
+                updated += Ride.objects.bulk_update(batch, fields)
+                batch = []
+        if batch:
+            updated += Ride.objects.bulk_update(batch, fields)
+        self.stdout.write(f"Filled addresses on {updated} rides")
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import ConstantTable
+from ride.helpers import delivery
+
+
+class Command(BaseCommand):
+    help = "Batch PENDING package deliveries into routes and assign them every DELIVERY_TICK_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--area", action="append", help="country_code to plan (default: every ConstantTable area)")
+        parser.add_argument("--once", action="store_true", help="run a single tick and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            areas = options["area"] or list(
+                ConstantTable.objects.exclude(country_code__isnull=True)
+                .values_list("country_code", flat=True)
+                .order_by()
+                .distinct()
+            )
+            for area in areas:
+                assigned = delivery.dispatch_area(area)
+                if options["once"]:
+                    self.stdout.write(f"{area}: {assigned} deliveries assigned")
+            if options["once"]:
+                break
+            time.sleep(max(settings.DELIVERY_TICK_SECONDS - (time.monotonic() - started), 0))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ride.helpers import projections
+
+
+class Command(BaseCommand):
+    help = "Keep the RideEvent read models (driver daily stats, zone hourly demand, ride funnel) up to date."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="catch up once and exit")
+        parser.add_argument(
+            "--rebuild",
+            choices=sorted(projections.PROJECTORS),
+            help="empty this read model and replay the whole event log into it first",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            projections.rebuild(options["rebuild"])
+            self.stdout.write(f"{options['rebuild']} emptied; replaying the event log")
+        while True:
+            started = time.monotonic()
+            consumed = projections.catch_up()
+            if options["once"]:
+                for name, count in consumed.items():
+                    self.stdout.write(f"{name}: {count} events applied")
+                break
+            time.sleep(max(settings.RIDE_EVENT_PROJECTION_TICK_SECONDS - (time.monotonic() - started), 0))
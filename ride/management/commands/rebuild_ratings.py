@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from ride.helpers import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute every user's rating aggregates from their rated rides, a chunk of users per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        after, changed = None, 0
+        while True:
+            after, count = ratings.rebuild_batch(after, options["batch_size"])
+            changed += count
+            if after is None:
+                break
+        self.stdout.write(f"Rebuilt rating aggregates; {changed} users changed")
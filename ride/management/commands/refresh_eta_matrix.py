@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import User
+from ride.helpers import eta_matrix
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cell-to-cell ETA matrix cache for each service area."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--area", action="append", help="country_code to refresh (default: every area with users)")
+        parser.add_argument("--loop", action="store_true", help="keep refreshing every --interval seconds")
+        parser.add_argument("--interval", type=int, default=900)
+
+    def handle(self, *args, **options):
+        while True:
+            areas = options["area"] or list(
+                User.objects.exclude(country_code__isnull=True).values_list("country_code", flat=True).order_by().distinct()
+            )
+            for area in areas:
+                matrix = eta_matrix.refresh_area(area)
+                if matrix is None:
+                    self.stdout.write(f"{area}: no ride coordinates")
+                else:
+                    self.stdout.write(f"{area}: {len(matrix)} cells")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ride.helpers import scheduler
+
+
+class Command(BaseCommand):
+    help = "Release book-ahead rides to dispatch as they fall due."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="release what is due now and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            released = scheduler.release_due()
+            if options["once"]:
+                self.stdout.write(f"{len(released)} scheduled rides released")
+                break
+            if len(released) == settings.SCHEDULED_RIDE_BATCH:
+                continue
+            # Sleep until the next booking is due, but wake every poll to pick up new, sooner ones.
+            due = scheduler.next_due()
+            wait = settings.SCHEDULED_RIDE_POLL_SECONDS
+            if due is not None:
+                wait = min(max((due - timezone.now()).total_seconds(), 0), wait)
+            time.sleep(wait)
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import ConstantTable
+from ride.helpers import assignment
+
+
+class Command(BaseCommand):
+    help = "Assign PENDING rides to drivers in batches every DISPATCH_INTERVAL_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--area", action="append", help="country_code to dispatch (default: every ConstantTable area)")
+        parser.add_argument("--once", action="store_true", help="run a single batch and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            areas = options["area"] or list(
+                ConstantTable.objects.exclude(country_code__isnull=True)
+                .values_list("country_code", flat=True)
+                .order_by()
+                .distinct()
+            )
+            for area in areas:
+                assigned = assignment.dispatch_area(area)
+                if options["once"]:
+                    self.stdout.write(f"{area}: {assigned} rides assigned")
+            if options["once"]:
+                break
+            time.sleep(max(settings.DISPATCH_INTERVAL_SECONDS - (time.monotonic() - started), 0))
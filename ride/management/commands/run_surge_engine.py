@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import ConstantTable
+from ride.helpers import surge
+
+
+class Command(BaseCommand):
+    help = "Recompute surge multipliers per cell every SURGE_TICK_SECONDS."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--area", action="append", help="country_code to price (default: every ConstantTable area)")
+        parser.add_argument("--once", action="store_true", help="run a single tick and exit")
+
+    def handle(self, *args, **options):
+        engine = None
+        cells_loaded_at = 0.0
+        while True:
+            # The cell set follows the ETA matrices, which are refreshed far less often than we tick.
+            if engine is None or time.monotonic() - cells_loaded_at > settings.ETA_MATRIX_LOCAL_TTL:
+                areas = options["area"] or list(
+                    ConstantTable.objects.exclude(country_code__isnull=True)
+                    .values_list("country_code", flat=True)
+                    .order_by()
+                    .distinct()
+                )
+                engine = surge.SurgeEngine(surge.area_cells(areas))
+                cells_loaded_at = time.monotonic()
+
+            started = time.monotonic()
+            surging = engine.tick()
+            if options["once"]:
+                self.stdout.write(f"{len(engine.cells)} cells, {len(surging)} surging")
+                break
+            time.sleep(max(settings.SURGE_TICK_SECONDS - (time.monotonic() - started), 0))
@@ -1,12 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 
-from core.models import RIDE_TYPE, VEHICLE_TYPE, BaseModel, User, VehicleRegistration
+from core.models import RIDE_TYPE, VEHICLE_TYPE, BaseModel, ServiceZone, User, VehicleRegistration
+from ride.helpers import active_rides, addresses, earnings
 from django.core.validators import MinValueValidator
 
 
 # Create your models here.
 
 RIDE_STATUS = (
+    ("SCHEDULED", "Scheduled"),
     ("PENDING", "Pending"),
     ("ACCEPTED", "Accepted"),
     ("WAITING", "Waiting"),
@@ -34,6 +38,58 @@ PAYMENT_METHOD = (
     ("CARD", "Card"),
 )
 
+POOL_STOP_KIND = (
+    ("PICKUP", "Pickup"),
+    ("DROPOFF", "Dropoff"),
+)
+
+
+class RidePool(BaseModel):
+    """A driver's in-progress shared trip and its remaining ordered stops."""
+
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ride_pool_driver", null=True, blank=True)
+    vehicle = models.ForeignKey(
+        VehicleRegistration, on_delete=models.CASCADE, related_name="ride_pool_vehicle", null=True, blank=True
+    )
+    seat_capacity = models.PositiveIntegerField(default=4)
+    # [{"ride": "<uuid>", "kind": "PICKUP" | "DROPOFF", "latitude": .., "longitude": .., "seats": 1}, ...]
+    stops = models.JSONField(default=list, blank=True)
+    current_latitude = models.FloatField(null=True, blank=True)
+    current_longitude = models.FloatField(null=True, blank=True)
+    cell = models.CharField(max_length=12, null=True, blank=True, db_index=True)
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "RIDE POOL"
+        verbose_name_plural = "RIDE POOLS"
+        indexes = [models.Index(fields=["is_active", "cell"])]
+
+
+class DeliveryRoute(BaseModel):
+    """A batch of package deliveries from one pickup cell and time window, in driving order."""
+
+    driver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="delivery_route_driver", null=True, blank=True)
+    vehicle = models.ForeignKey(
+        VehicleRegistration, on_delete=models.CASCADE, related_name="delivery_route_vehicle", null=True, blank=True
+    )
+    cell = models.CharField(max_length=12, db_index=True)
+    window_start = models.DateTimeField()
+    depot_latitude = models.FloatField()
+    depot_longitude = models.FloatField()
+    # [{"ride": "<uuid>", "kind": "PICKUP" | "DROPOFF", "latitude": .., "longitude": .., "weight": 2.5}, ...]
+    # in driving order; the depot is the first pickup.
+    stops = models.JSONField(default=list, blank=True)
+    total_weight = models.FloatField(default=0.0, validators=[MinValueValidator(0.0)])
+    distance_km = models.FloatField(default=0.0, validators=[MinValueValidator(0.0)])
+    is_active = models.BooleanField(default=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+        verbose_name = "DELIVERY ROUTE"
+        verbose_name_plural = "DELIVERY ROUTES"
+
+
 class Ride(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ride_user", null=True, blank=True
     )
@@ -77,6 +133,8 @@ class Ride(BaseModel):
     ride_duration = models.DurationField(null=True, blank=True)
 
     ride_status = models.CharField(max_length=50, choices=RIDE_STATUS, default="PENDING")
+    # Requested pickup time of a book-ahead ride; released to dispatch by ride/helpers/scheduler.py.
+    scheduled_for = models.DateTimeField(null=True, blank=True)
     payment_method = models.CharField(max_length=50, blank=True, null=True, choices=PAYMENT_METHOD)
 
     price = models.FloatField(
@@ -99,6 +157,13 @@ class Ride(BaseModel):
         default=0.0,
         validators=[MinValueValidator(0.0)],
     )
+    surge_multiplier = models.FloatField(
+        default=1.0,
+        validators=[MinValueValidator(1.0)],
+    )
+    pricing_zone = models.ForeignKey(
+        ServiceZone, on_delete=models.SET_NULL, related_name="zone_rides", null=True, blank=True
+    )
 
     cancelled_by = models.CharField(max_length=50, blank=True, null=True, choices=CANCELLED_BY, default="NONE")
     cancelled_at = models.DateTimeField(null=True, blank=True)
@@ -107,22 +172,278 @@ class Ride(BaseModel):
     waiting_at = models.DateTimeField(null=True, blank=True)
     payment_at = models.DateTimeField(null=True, blank=True)
 
+    # The rider's rating of the driver, and (user_*) the driver's of the rider; see ride/helpers/ratings.py.
     rating = models.PositiveIntegerField(default=0)
     ride_feedback = models.TextField(null=True, blank=True)
+    rated_at = models.DateTimeField(null=True, blank=True)
+    user_rating = models.PositiveIntegerField(default=0)
+    user_feedback = models.TextField(null=True, blank=True)
+    user_rated_at = models.DateTimeField(null=True, blank=True)
+
+    is_pooled = models.BooleanField(default=False)
+    seats = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1)])
+    # Spend the rider's loyalty points on the fare when the ride ends (core/helpers/points.py).
+    use_points = models.BooleanField(default=False)
+    ride_pool = models.ForeignKey(
+        RidePool, on_delete=models.SET_NULL, related_name="pool_rides", null=True, blank=True
+    )
+
+    package_weight = models.FloatField(
+        default=0.0,
+        validators=[MinValueValidator(0.0)],
+    )
+    delivery_route = models.ForeignKey(
+        DeliveryRoute, on_delete=models.SET_NULL, related_name="route_rides", null=True, blank=True
+    )
 
     is_peak_hours = models.BooleanField(default=False)
+    # `price` is a signed upfront quote (ride/helpers/quotes.py), charged at ride end as is.
+    is_price_locked = models.BooleanField(default=False)
     is_completed = models.BooleanField(default=False)
     is_paid = models.BooleanField(default=False)
     is_rated = models.BooleanField(default=False)
+    is_user_rated = models.BooleanField(default=False)
+    # Set once the ride has been counted in EarningsRollup (ride/helpers/earnings.py).
+    earnings_recorded = models.BooleanField(default=False, editable=False)
+    # Bumped by every save; orders the write-through updates of ride/helpers/active_rides.py.
+    version = models.PositiveBigIntegerField(default=0, editable=False)
 
     class Meta:
         ordering = ["-created_at"]
         verbose_name = "VEHICLE REGISTRATION"
         verbose_name_plural = "VEHICLE REGISTRATIONS"
+        indexes = [
+            models.Index(
+                fields=["scheduled_for"], name="ride_scheduled_due_idx", condition=models.Q(ride_status="SCHEDULED")
+            ),
+            # Open rides by status and age, for the stale-ride sweeper (ride/helpers/expiry.py).
+            models.Index(
+                fields=["ride_status", "updated_at"], name="ride_open_status_idx", condition=models.Q(is_completed=False)
+            ),
+            # Closed rides not yet in the earnings rollups, for `backfill_earnings`.
+            models.Index(
+                fields=["id"],
+                name="ride_earnings_backlog_idx",
+                condition=models.Q(earnings_recorded=False, ride_status__in=earnings.ROLLUP_STATUSES),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        filled = addresses.fill_missing(self)
+        adding = self._state.adding
+        if not adding and kwargs.get("update_fields") is None:
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in deferred
+            ]
+        if kwargs.get("update_fields") is not None:
+            # Only the claim below sets earnings_recorded, never a possibly stale instance.
+            kwargs["update_fields"] = [
+                *(field for field in kwargs["update_fields"] if field != "earnings_recorded"), *filled, "version"
+            ]
+        status_written = kwargs.get("update_fields") is None or "ride_status" in kwargs["update_fields"]
+        previous_status = getattr(self, "_saved_status", None)
+        transition = status_written and (adding or self.ride_status != previous_status)
+        counts_earnings = transition and self.ride_status in earnings.ROLLUP_STATUSES
+        if adding and counts_earnings:
+            self.earnings_recorded = True
+        with transaction.atomic():
+            # The UPDATE holds the row lock until commit, so versions follow commit order.
+            self.version = 1 if adding else F("version") + 1
+            super().save(*args, **kwargs)
+            if not adding:
+                self.refresh_from_db(fields=["version"])
+            if transition:
+                event = RideEvent.for_ride(self, None if adding else previous_status)
+                event.save()
+                # A conditional UPDATE, so of two saves reaching PAID or CANCELLED only one counts the ride.
+                if counts_earnings and (
+                    adding or Ride.objects.filter(pk=self.pk, earnings_recorded=False).update(earnings_recorded=True)
+                ):
+                    self.earnings_recorded = True
+                    earnings.record_events([event])
+            active_rides.publish(self)
+        if status_written:
+            self._saved_status = self.ride_status
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The status as loaded, so save() can tell a transition from a plain update.
+        instance._saved_status = instance.__dict__.get("ride_status")
+        return instance
     
     @classmethod
     def fetch_ride_status(cls, user):
-        create_ride = cls.objects.filter(user=user, is_completed=False).first()
-        if create_ride:
-            return create_ride
-        return None
\ No newline at end of file
+        """Status payload of the user's open ride, from the active-ride cache."""
+        found = active_rides.current(user=user, statuses=active_rides.IN_PROGRESS_STATUSES)
+        if found:
+            return found[1]["data"]
+        return None
+
+class RideEvent(models.Model):
+    """
+    Append-only log of ride status transitions, written in the transaction
+    that made them (Ride.save, or the bulk UPDATE of ride/helpers/expiry.py).
+    Each row carries what the read models of ride/helpers/projections.py
+    need, so they are built from the log alone. The sequential id is the
+    offset projectors checkpoint.
+    """
+
+    # Event field -> Ride attribute (or .values() column) it is copied from.
+    SOURCE = {
+        "ride_id": "id",
+        "to_status": "ride_status",
+        "version": "version",
+        "user_id": "user_id",
+        "driver_id": "driver_id",
+        "zone_id": "pricing_zone_id",
+        "ride_type": "ride_type",
+        "vehicle_type": "vehicle_type",
+        "payment_method": "payment_method",
+        "payable_amount": "payable_amount",
+        "point_amount": "point_amount",
+        "cancellation_amount": "cancellation_amount",
+        "cancelled_by": "cancelled_by",
+        "requested_at": "created_at",
+    }
+
+    id = models.BigAutoField(primary_key=True)
+    # No constraint: the log outlives the rides it describes.
+    ride = models.ForeignKey(Ride, on_delete=models.DO_NOTHING, db_constraint=False, related_name="events")
+    from_status = models.CharField(max_length=50, choices=RIDE_STATUS, null=True, blank=True)
+    to_status = models.CharField(max_length=50, choices=RIDE_STATUS)
+    version = models.PositiveBigIntegerField()
+    user_id = models.UUIDField(null=True, blank=True)
+    driver_id = models.UUIDField(null=True, blank=True)
+    zone_id = models.UUIDField(null=True, blank=True)
+    ride_type = models.CharField(max_length=255, blank=True, null=True, choices=RIDE_TYPE)
+    vehicle_type = models.CharField(max_length=50, blank=True, null=True, choices=VEHICLE_TYPE)
+    payment_method = models.CharField(max_length=50, blank=True, null=True, choices=PAYMENT_METHOD)
+    payable_amount = models.FloatField(default=0.0)
+    point_amount = models.FloatField(default=0.0)
+    cancellation_amount = models.FloatField(default=0.0)
+    cancelled_by = models.CharField(max_length=50, blank=True, null=True, choices=CANCELLED_BY)
+    requested_at = models.DateTimeField()
+    occurred_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ["id"]
+        verbose_name = "RIDE EVENT"
+        verbose_name_plural = "RIDE EVENTS"
+        indexes = [models.Index(fields=["ride", "id"], name="ride_event_history_idx")]
+
+    @classmethod
+    def for_ride(cls, ride, from_status):
+        return cls(from_status=from_status, **{field: getattr(ride, attr) for field, attr in cls.SOURCE.items()})
+
+    @classmethod
+    def for_row(cls, row, from_status, occurred_at=None):
+        """An event from a Ride .values() row holding every SOURCE column."""
+        event = cls(from_status=from_status, **{field: row[attr] for field, attr in cls.SOURCE.items()})
+        if occurred_at is not None:
+            event.occurred_at = occurred_at
+        return event
+
+
+class ProjectionCheckpoint(BaseModel):
+    """How far into an append-only log (RideEvent, or PointsEntry for the points fold) a projector has got."""
+
+    name = models.CharField(max_length=100, unique=True)
+    position = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        ordering = ["name"]
+        verbose_name = "PROJECTION CHECKPOINT"
+        verbose_name_plural = "PROJECTION CHECKPOINTS"
+
+
+class DriverDailyStats(BaseModel):
+    """Per driver and local day: rides accepted, paid and cancelled, and earnings (projected from RideEvent)."""
+
+    driver_id = models.UUIDField()
+    day = models.DateField()
+    accepted = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    earnings = models.FloatField(default=0.0)
+
+    class Meta:
+        ordering = ["-day"]
+        verbose_name = "DRIVER DAILY STATS"
+        verbose_name_plural = "DRIVER DAILY STATS"
+        constraints = [models.UniqueConstraint(fields=["driver_id", "day"], name="driver_daily_stats_unique")]
+
+
+class ZoneHourlyDemand(BaseModel):
+    """Per pricing zone (null outside every zone) and local hour: requests and their outcomes."""
+
+    zone_id = models.UUIDField(null=True, blank=True)
+    hour = models.DateTimeField()
+    requested = models.PositiveIntegerField(default=0)
+    accepted = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-hour"]
+        verbose_name = "ZONE HOURLY DEMAND"
+        verbose_name_plural = "ZONE HOURLY DEMAND"
+        indexes = [models.Index(fields=["zone_id", "hour"], name="zone_hourly_demand_idx")]
+
+
+class RideFunnelDaily(BaseModel):
+    """Rides requested on a local day and how many of them reached each later stage."""
+
+    day = models.DateField(unique=True)
+    requested = models.PositiveIntegerField(default=0)
+    accepted = models.PositiveIntegerField(default=0)
+    started = models.PositiveIntegerField(default=0)
+    ended = models.PositiveIntegerField(default=0)
+    paid = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ["-day"]
+        verbose_name = "RIDE FUNNEL DAILY"
+        verbose_name_plural = "RIDE FUNNEL DAILY"
+
+
+ROLLUP_PERIOD = (
+    ("DAY", "Day"),
+    ("WEEK", "Week"),
+    ("MONTH", "Month"),
+)
+
+
+class EarningsRollup(BaseModel):
+    """
+    Per person, period and local period start: rides paid and cancelled and
+    their money, kept up to date by ride/helpers/earnings.py. `user_type` is
+    the person's side of the ride, RIDER for the driver and USER for the rider,
+    as on User.user_type; `fares` and `cancellation_fees` are earned by a
+    driver and spent by a rider.
+    """
+
+    user_type = models.CharField(max_length=255, choices=User.USER_TYPE)
+    person_id = models.UUIDField()
+    period = models.CharField(max_length=10, choices=ROLLUP_PERIOD)
+    period_start = models.DateField()
+    completed = models.PositiveIntegerField(default=0)
+    cancelled = models.PositiveIntegerField(default=0)
+    fares = models.FloatField(default=0.0)
+    points = models.FloatField(default=0.0)
+    cancellation_fees = models.FloatField(default=0.0)
+
+    class Meta:
+        ordering = ["-period_start"]
+        verbose_name = "EARNINGS ROLLUP"
+        verbose_name_plural = "EARNINGS ROLLUPS"
+        # Also the index the summary endpoints read one person's periods from.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_type", "person_id", "period", "period_start"], name="earnings_rollup_unique"
+            )
+        ]
@@ -4,4 +4,44 @@ from . import models
 
 class RideResource(resources.ModelResource):
     class Meta:
-        model = models.Ride
\ No newline at end of file
+        model = models.Ride
+
+
+class RidePoolResource(resources.ModelResource):
+    class Meta:
+        model = models.RidePool
+
+
+class DeliveryRouteResource(resources.ModelResource):
+    class Meta:
+        model = models.DeliveryRoute
+
+
+class RideEventResource(resources.ModelResource):
+    class Meta:
+        model = models.RideEvent
+
+
+class ProjectionCheckpointResource(resources.ModelResource):
+    class Meta:
+        model = models.ProjectionCheckpoint
+
+
+class DriverDailyStatsResource(resources.ModelResource):
+    class Meta:
+        model = models.DriverDailyStats
+
+
+class ZoneHourlyDemandResource(resources.ModelResource):
+    class Meta:
+        model = models.ZoneHourlyDemand
+
+
+class RideFunnelDailyResource(resources.ModelResource):
+    class Meta:
+        model = models.RideFunnelDaily
+
+
+class EarningsRollupResource(resources.ModelResource):
+    class Meta:
+        model = models.EarningsRollup
@@ -1,14 +1,24 @@
-from rest_framework import exceptions, serializers
+from datetime import timedelta
+
+from django.conf import settings
+from rest_framework import ISO_8601, exceptions, serializers
 from rest_framework.exceptions import APIException
+from rest_framework.settings import api_settings
 
-from core.models import ConstantTable, VehicleRegistration
-from core.serializer import CustomSerializerError, DriverPrimaryKeyRelatedField, ModelCustomSerializer
+from core.helpers import presence, zones
+from core.models import RIDE_TYPE, VEHICLE_TYPE, ConstantTable, VehicleRegistration
+from core.serializer import (
+    CustomSerializer, CustomSerializerError, DriverPrimaryKeyRelatedField, ModelCustomSerializer, SparseFieldsMixin
+)
 from ride.models import Ride
+from ride.helpers import active_rides, quotes
 from haversine import haversine, Unit
 from django.utils import timezone
 
 
 class CreateRideSerializer(ModelCustomSerializer):
+    quote_token = serializers.CharField(write_only=True, required=False)
+
     class Meta:
         model = Ride
         fields = (
@@ -28,6 +38,12 @@ class CreateRideSerializer(ModelCustomSerializer):
             "ride_distance_unit",
             "payment_method",
             "price",
+            "is_pooled",
+            "seats",
+            "use_points",
+            "package_weight",
+            "scheduled_for",
+            "quote_token",
         )
         extra_kwargs = {
             "user_location_longitude": {"required": True},
@@ -56,15 +72,79 @@ class CreateRideSerializer(ModelCustomSerializer):
             (user_ride_end_latitude, user_ride_end_longitude),
             unit=Unit.KILOMETERS
         )
+        request = self.context.get("request")
+        country_code = request.user.country_code if request else None
+        if not zones.is_serviceable(user_pickup_latitude, user_pickup_longitude, country_code):
+            raise CustomSerializerError(
+                {"status": False, "message": "Pickup location is outside our service area"}
+            )
+        if not zones.is_serviceable(user_ride_end_latitude, user_ride_end_longitude, country_code):
+            raise CustomSerializerError(
+                {"status": False, "message": "Destination is outside our service area"}
+            )
+
+        scheduled_for = attrs.get("scheduled_for")
+        if scheduled_for is not None:
+            now = timezone.now()
+            if scheduled_for < now + timedelta(minutes=settings.SCHEDULED_RIDE_MIN_AHEAD_MINUTES):
+                raise CustomSerializerError(
+                    {"status": False, "message": f"Rides must be scheduled at least {settings.SCHEDULED_RIDE_MIN_AHEAD_MINUTES} minutes ahead"}
+                )
+            if scheduled_for > now + timedelta(days=settings.SCHEDULED_RIDE_MAX_AHEAD_DAYS):
+                raise CustomSerializerError(
+                    {"status": False, "message": f"Rides can be scheduled at most {settings.SCHEDULED_RIDE_MAX_AHEAD_DAYS} days ahead"}
+                )
+            attrs["ride_status"] = "SCHEDULED"
+
+        token = attrs.pop("quote_token", None)
+        if token:
+            trip = {**attrs, "package_weight": attrs.get("package_weight", 0.0)}
+            try:
+                quote = quotes.verify(token, request.user, trip)
+            except quotes.InvalidQuote as exc:
+                raise CustomSerializerError({"status": False, "message": str(exc)})
+            attrs["price"] = quote["price"]
+            attrs["is_peak_hours"] = quote["is_peak_hours"]
+            attrs["surge_multiplier"] = quote["surge_multiplier"]
+            attrs["is_price_locked"] = True
+
         attrs["ride_distance"] = distance
         attrs["ride_distance_unit"] = Unit.KILOMETERS
+        attrs["pricing_zone"] = zones.pricing_zone(
+            user_pickup_latitude, user_pickup_longitude, country_code
+        ) or zones.pricing_zone(user_ride_end_latitude, user_ride_end_longitude, country_code)
+        return attrs
+
+
+class RideQuoteSerializer(CustomSerializer):
+    user_pickup_latitude = serializers.FloatField(min_value=-90, max_value=90, required=True)
+    user_pickup_longitude = serializers.FloatField(min_value=-180, max_value=180, required=True)
+    user_ride_end_latitude = serializers.FloatField(min_value=-90, max_value=90, required=True)
+    user_ride_end_longitude = serializers.FloatField(min_value=-180, max_value=180, required=True)
+    ride_type = serializers.ChoiceField(choices=RIDE_TYPE, required=True)
+    vehicle_type = serializers.ChoiceField(choices=VEHICLE_TYPE, required=True)
+    package_weight = serializers.FloatField(min_value=0.0, default=0.0)
+
+    def validate(self, attrs):
+        request = self.context.get("request")
+        country_code = request.user.country_code if request else None
+        if not zones.is_serviceable(attrs["user_pickup_latitude"], attrs["user_pickup_longitude"], country_code):
+            raise CustomSerializerError(
+                {"status": False, "message": "Pickup location is outside our service area"}
+            )
+        if not zones.is_serviceable(attrs["user_ride_end_latitude"], attrs["user_ride_end_longitude"], country_code):
+            raise CustomSerializerError(
+                {"status": False, "message": "Destination is outside our service area"}
+            )
         return attrs
 
 
-class RideStatusSerializer(ModelCustomSerializer):
+class RideStatusSerializer(SparseFieldsMixin, ModelCustomSerializer):
     class Meta:
         model = Ride
         fields = (
+            "id",
+            "version",
             "user",
             "driver",
 
@@ -101,6 +181,7 @@ class RideStatusSerializer(ModelCustomSerializer):
             "ride_type",
             "vehicle_type",
             "ride_status",
+            "scheduled_for",
 
             "ride_distance",
             "ride_distance_unit",
@@ -113,7 +194,8 @@ class RideStatusSerializer(ModelCustomSerializer):
 
 
             "price",
-            "discount_amount",
+            "surge_multiplier",
+            "pricing_zone",
             "discount_amount",
             "payable_amount",
             "cancellation_amount",
@@ -129,13 +211,96 @@ class RideStatusSerializer(ModelCustomSerializer):
             "rating",
             "ride_feedback",
 
-            "payment_method",
+            "is_pooled",
+            "seats",
+            "ride_pool",
+
+            "package_weight",
+            "delivery_route",
             
             "is_paid",
             "is_completed",
         )
 
 
+class RideStatusReader:
+    """
+    Read path for RideStatusSerializer's payload without a model instance.
+
+    The field plan (which column feeds each output key and how to convert it)
+    is compiled once from RideStatusSerializer, so a read is one .values()
+    query, with the driver's name and the vehicle's plate joined in, and a
+    loop over the plan. The output matches RideStatusSerializer(ride).data
+    plus the SUMMARY_FIELDS.
+    """
+
+    SUMMARY_FIELDS = {
+        "driver_first_name": "driver__first_name",
+        "driver_last_name": "driver__last_name",
+        "vehicle_plate_number": "vehicle__vehicle_plate_number",
+    }
+    PASSTHROUGH = (
+        serializers.BooleanField,
+        serializers.CharField,
+        serializers.ChoiceField,
+        serializers.FloatField,
+        serializers.IntegerField,
+    )
+
+    def __init__(self):
+        self._plan = None
+
+    @property
+    def plan(self):
+        if self._plan is None:
+            plan = []
+            for name, field in RideStatusSerializer().fields.items():
+                if isinstance(field, serializers.RelatedField):
+                    plan.append((name, f"{name}_id", str))
+                elif type(field) in self.PASSTHROUGH:
+                    plan.append((name, name, None))
+                elif isinstance(field, serializers.DateTimeField) and self._is_iso(field):
+                    plan.append((name, name, self._iso_datetime(timezone.get_default_timezone())))
+                else:
+                    plan.append((name, name, field.to_representation))
+            self._plan = plan
+        return self._plan
+
+    @staticmethod
+    def _is_iso(field):
+        output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+        return settings.USE_TZ and isinstance(output_format, str) and output_format.lower() == ISO_8601
+
+    @staticmethod
+    def _iso_datetime(tz):
+        # DateTimeField.to_representation for the aware values the database returns, minus the per-call settings lookups.
+        def convert(value):
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+        return convert
+
+    def columns(self):
+        columns = ["id", "version", "created_at", *(column for _, column, _ in self.plan), *self.SUMMARY_FIELDS.values()]
+        return list(dict.fromkeys(columns))
+
+    def to_representation(self, row):
+        data = {}
+        for name, column, convert in self.plan:
+            value = row[column]
+            data[name] = value if convert is None or value is None else convert(value)
+        for name, column in self.SUMMARY_FIELDS.items():
+            data[name] = row[column]
+        return data
+
+    def rows(self, **filters):
+        """Projected rows (with id, version and created_at) of the rides matching `filters`."""
+        return Ride.objects.filter(**filters).values(*self.columns())
+
+
+ride_status_reader = RideStatusReader()
+
+
 class AcceptRideSerializer(ModelCustomSerializer):
     driver = DriverPrimaryKeyRelatedField(
         queryset=VehicleRegistration.objects.filter(vehicle_status="ONLINE", is_active=True)
@@ -150,10 +315,14 @@ class AcceptRideSerializer(ModelCustomSerializer):
 
     def validate(self, attrs):
         driver = attrs.get("driver")
-        if Ride.objects.filter(driver=driver.user, is_completed=False).exists():
+        if active_rides.current(driver=driver.user) is not None:
             raise CustomSerializerError(
                 {"status": False, "messgae": "Rider already has an open Ride"}
             )
+        if not presence.is_online(driver.user_id):
+            raise CustomSerializerError(
+                {"status": False, "message": "Rider is offline"}
+            )
         attrs["ride_status"] = "ACCEPTED"
         return attrs
     
@@ -282,4 +451,10 @@ class CashPaymentSerializer(ModelCustomSerializer):
         attrs["payment_method"] = "CASH"
         attrs["is_completed"] = True
         attrs["payment_at"] = timezone.now()
-        return attrs
\ No newline at end of file
+        return attrs
+
+
+class RateRideSerializer(CustomSerializer):
+    ride_id = serializers.UUIDField(required=True)
+    rating = serializers.IntegerField(min_value=1, max_value=5, required=True)
+    feedback = serializers.CharField(required=False, allow_blank=True, default="")
@@ -1,3 +1,748 @@
-from django.test import TestCase
+import itertools
+import os
+import random
+import tempfile
+import threading
+import uuid
 
-# Create your tests here.
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.helpers import etags
+from core.models import User
+from ride.helpers import (
+    active_rides,
+    assignment,
+    autocomplete,
+    delivery,
+    earnings,
+    eta_matrix,
+    expiry,
+    pooling,
+    projections,
+    quotes,
+    ratings,
+    scheduler,
+    surge,
+    vrp,
+)
+from ride.helpers.driver_locations import DriverPositions
+from ride.serializer import RideStatusReader, RideStatusSerializer
+from ride.models import DriverDailyStats, EarningsRollup, Ride, RideEvent, RideFunnelDaily, RidePool
+
+
+def _value(version, status="ACCEPTED", closed_at=0):
+    return active_rides._encode(version, closed_at, {"status": status, "created": 0.0, "data": {}})
+
+
+class RideUsersMixin:
+    """A verified rider (`user`) and driver for a test class, created once per class."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create(
+            email="rider@example.com", username="rider", first_name="A", last_name="B", is_verified=True, is_active=True
+        )
+        cls.driver = User.objects.create(
+            email="driver@example.com",
+            username="driver",
+            first_name="C",
+            last_name="D",
+            user_type="RIDER",
+            is_verified=True,
+            is_active=True,
+        )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "eta-tests"}},
+    ETA_MATRIX_PRECISION=6,
+    ETA_EXACT_CANDIDATES=3,
+)
+class EtaMatrixTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        self.latitudes, self.longitudes = 6.52 + rng.normal(0, 0.03, 400), 3.37 + rng.normal(0, 0.03, 400)
+        self.matrix = eta_matrix.EtaMatrix.build("NG", self.latitudes, self.longitudes)
+
+    def tearDown(self):
+        eta_matrix._local_matrices.clear()
+
+    def test_lookup_stays_within_a_cell_of_the_exact_estimate(self):
+        rider = (self.latitudes[0], self.longitudes[0])
+        distance_km, eta_seconds = self.matrix.lookup(self.latitudes, self.longitudes, *rider)
+        exact_km, exact_eta = eta_matrix.estimate(self.latitudes, self.longitudes, *rider)
+
+        self.assertFalse(np.allclose(distance_km, exact_km))
+        # Centroids are at most half a precision-6 cell diagonal (~0.7 km) from each end.
+        self.assertLess(np.abs(distance_km - exact_km).max(), 2 * 0.7 * 1.3)
+        self.assertLess(np.abs(eta_seconds - exact_eta).max(), 2 * 0.7 * 1.3 / 25.0 * 3600 + 1)
+
+    def test_points_outside_the_matrix_fall_back_to_the_exact_estimate(self):
+        latitudes, longitudes = [7.5, 6.52], [4.5, 3.37]
+        distance_km, eta_seconds = self.matrix.lookup(latitudes, longitudes, 8.0, 5.0)
+        exact_km, exact_eta = eta_matrix.estimate(np.array(latitudes), np.array(longitudes), 8.0, 5.0)
+        np.testing.assert_allclose(distance_km, exact_km)
+        np.testing.assert_allclose(eta_seconds, exact_eta)
+
+    def test_rank_orders_points_by_eta_with_exact_values_at_the_head(self):
+        steps = np.array([5, 2, 8, 1, 7, 3, 6, 4])
+        latitudes, longitudes = 6.52 + 0.02 * steps, np.full(len(steps), 3.37)
+        eta_matrix.store_matrix(eta_matrix.EtaMatrix.build("NG", np.append(latitudes, 6.52), np.append(longitudes, 3.37)))
+
+        order, distance_km, eta_seconds = eta_matrix.rank("NG", latitudes, longitudes, 6.52, 3.37)
+        self.assertEqual(order.tolist(), np.argsort(steps).tolist())
+        exact_km, exact_eta = eta_matrix.estimate(latitudes, longitudes, 6.52, 3.37)
+        np.testing.assert_allclose(eta_seconds[order[:3]], exact_eta[order[:3]])
+        self.assertFalse(np.allclose(eta_seconds[order[3:]], exact_eta[order[3:]]))
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "assignment-tests"}},
+    DISPATCH_MAX_PICKUP_SECONDS=900,
+)
+class AssignmentTests(SimpleTestCase):
+    def brute_force(self, cost):
+        best = min(
+            itertools.permutations(range(cost.shape[0]), cost.shape[1]),
+            key=lambda rows: cost[list(rows), range(cost.shape[1])].sum(),
+        )
+        pairs = [(row, column) for column, row in enumerate(best) if cost[row, column] < assignment.INFEASIBLE]
+        return len(pairs), sum(cost[row, column] for row, column in pairs)
+
+    def test_solve_is_optimal_where_greedy_is_not(self):
+        cost = np.array([[60.0, 120.0], [300.0, 800.0]])
+        rows, columns = assignment.greedy(cost)
+        self.assertEqual(cost[rows, columns].sum(), 860.0)
+        rows, columns = assignment.solve(cost)
+        self.assertEqual(cost[rows, columns].sum(), 420.0)
+
+        rng = np.random.default_rng(5)
+        for _ in range(20):
+            cost = rng.uniform(30, 900, (6, 4))
+            cost[rng.random(cost.shape) < 0.3] = assignment.INFEASIBLE
+            rows, columns = assignment.solve(cost)
+            self.assertEqual(len(set(rows)), len(rows))
+            self.assertTrue((cost[rows, columns] < assignment.INFEASIBLE).all())
+            count, total = self.brute_force(cost)
+            self.assertEqual(len(rows), count)
+            self.assertAlmostEqual(cost[rows, columns].sum(), total)
+
+    def test_mismatched_vehicles_and_far_pickups_are_infeasible(self):
+        cache.clear()
+        eta_matrix._local_matrices.clear()
+        drivers = DriverPositions(
+            ["near", "other-type", "far", "unknown"],
+            ["v1", "v2", "v3", "v4"],
+            ["REGULAR", "PREMIUM", "REGULAR", None],
+            ["CAR", "CAR", "CAR", None],
+            [6.521, 6.521, 6.90, 6.521],
+            [3.37, 3.37, 3.37, 3.37],
+        )
+        requests = assignment.OpenRequests(["ride"], ["REGULAR"], ["CAR"], [6.52], [3.37])
+        cost, distance_km = assignment.cost_matrix(drivers, requests, "ZZ")
+
+        self.assertLess(cost[0, 0], assignment.INFEASIBLE)
+        self.assertTrue((cost[1:, 0] == assignment.INFEASIBLE).all())
+        self.assertEqual(assignment.prune(cost, 10).tolist(), [0])
+        self.assertAlmostEqual(distance_km[0, 0], eta_matrix.estimate(6.521, 3.37, 6.52, 3.37)[0])
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "autocomplete-tests"}},
+    AUTOCOMPLETE_CHECK_SECONDS=0,
+    AUTOCOMPLETE_POPULARITY_WEIGHT=1.0,
+    AUTOCOMPLETE_DISTANCE_SCALE_KM=5.0,
+)
+class AutocompleteTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.addCleanup(setattr, autocomplete, "_index", None)
+        self.addCleanup(setattr, autocomplete, "_checked_at", 0.0)
+        cache.clear()
+
+        rng = random.Random(31)
+        streets = ["Allen Avenue", "Adeola Odeku", "Admiralty Way", "Awolowo Road", "Bode Thomas", "Broad Street"]
+        areas = ["Ikeja", "Ikoyi", "Lekki", "Surulere", "Yaba"]
+        self.labels = [f"{index} {rng.choice(streets)}, {rng.choice(areas)}" for index in range(400)]
+        self.latitudes = [6.45 + rng.uniform(0, 0.2) for _ in self.labels]
+        self.longitudes = [3.35 + rng.uniform(0, 0.2) for _ in self.labels]
+        self.popularity = [rng.randint(0, 50) for _ in self.labels]
+        with override_settings(AUTOCOMPLETE_DATA_DIR=self.root):
+            autocomplete.build(self.labels, self.latitudes, self.longitudes, self.popularity)
+        self.index = autocomplete.AutocompleteIndex(os.path.join(self.root, os.listdir(self.root)[0]))
+
+    def matches(self, text):
+        query = autocomplete.normalize(text)
+        return {
+            entry
+            for entry, label in enumerate(self.labels)
+            if any(" ".join(autocomplete.normalize(label).split(" ")[start:]).startswith(query) for start in range(6))
+        }
+
+    def test_prefix_candidates_match_a_brute_force_scan(self):
+        for text in ("allen av", "ADEOLA O", "ikoyi", "12 ", "broad street yaba", "Awolowo Road, Lekki"):
+            query = autocomplete.normalize(text).encode()
+            self.assertEqual(set(self.index.candidates(query).tolist()), self.matches(text), text)
+
+        for text in ("a", "ik", "yab"):
+            expected = self.matches(text)
+            found = set(self.index.candidates(autocomplete.normalize(text).encode()).tolist())
+            self.assertEqual(len(found), min(len(expected), autocomplete.TOP_PER_NODE))
+            self.assertLessEqual(found, expected)
+            lowest = min(self.popularity[entry] for entry in found)
+            self.assertTrue(all(self.popularity[entry] <= lowest for entry in expected - found))
+        self.assertEqual(self.index.suggest("zz"), [])
+        self.assertEqual(self.index.suggest("  ,"), [])
+
+    def test_suggestions_rank_by_popularity_and_distance(self):
+        entries = sorted(self.matches("surulere"), key=lambda entry: -self.popularity[entry])
+        suggestions = self.index.suggest("surulere", limit=3)
+        self.assertEqual([suggestion["address"] for suggestion in suggestions], [self.labels[entry] for entry in entries[:3]])
+        self.assertIsNone(suggestions[0]["distance_km"])
+
+        least_popular = entries[-1]
+        with override_settings(AUTOCOMPLETE_DISTANCE_SCALE_KM=0.1):
+            nearby = self.index.suggest("surulere", self.latitudes[least_popular], self.longitudes[least_popular])[0]
+        self.assertEqual(nearby["address"], self.labels[least_popular])
+        self.assertEqual(nearby["distance_km"], 0.0)
+
+    def test_workers_pick_up_a_new_build(self):
+        with override_settings(AUTOCOMPLETE_DATA_DIR=self.root):
+            self.assertTrue(autocomplete.suggest("allen avenue ikeja", limit=1)[0]["address"].endswith("Allen Avenue, Ikeja"))
+            autocomplete.build(["1 Marina, Lagos Island"], [6.45], [3.39], [1])
+            self.assertEqual(autocomplete.suggest("marina")[0]["address"], "1 Marina, Lagos Island")
+            self.assertEqual(autocomplete.suggest("allen"), [])
+
+
+@override_settings(ACTIVE_RIDE_CACHE_TTL=60)
+class ActiveRideStoreTests(SimpleTestCase):
+    def test_concurrent_merges_keep_the_highest_version(self):
+        store = active_rides.LocalStore()
+        versions = list(range(1, 501))
+        random.shuffle(versions)
+        chunks = [versions[start::8] for start in range(8)]
+
+        def write(chunk):
+            for version in chunk:
+                store.merge({"key": {"ride": _value(version)}}, loaded=True)
+
+        threads = [threading.Thread(target=write, args=(chunk,)) for chunk in chunks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(active_rides._version(store.read("key")["ride"]), 500)
+
+    def test_stale_fill_does_not_undo_a_transition(self):
+        store = active_rides.LocalStore()
+        store.merge({"key": {"ride": _value(4, "RIDE_END", closed_at=0)}})
+        self.assertIsNone(store.read("key"))
+        store.merge({"key": {"ride": _value(3, "RIDE_START")}}, loaded=True)
+        self.assertEqual(active_rides._decode(store.read("key")["ride"])["status"], "RIDE_END")
+
+
+@override_settings(ACTIVE_RIDE_CACHE="local", ACTIVE_RIDE_CACHE_TTL=60)
+class ActiveRideCacheTests(RideUsersMixin, TestCase):
+    def setUp(self):
+        active_rides.reset()
+
+    def tearDown(self):
+        active_rides.reset()
+
+    def test_transitions_are_written_through(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ride = Ride.objects.create(user=self.user)
+        self.assertEqual(active_rides.current(user=self.user)[1]["status"], "PENDING")
+        # The first read of a hash fills it from the database; later ones never query.
+        self.assertIsNone(active_rides.current(driver=self.driver))
+
+        for status in ("ACCEPTED", "WAITING", "RIDE_START"):
+            with self.captureOnCommitCallbacks(execute=True):
+                ride.driver, ride.ride_status = self.driver, status
+                ride.save()
+            with self.assertNumQueries(0):
+                self.assertEqual(active_rides.current(user=self.user)[1]["status"], status)
+                self.assertEqual(active_rides.current(driver=self.driver)[1]["status"], status)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ride.ride_status, ride.is_completed = "PAID", True
+            ride.save()
+        with self.assertNumQueries(0):
+            self.assertIsNone(active_rides.current(user=self.user))
+            self.assertIsNone(Ride.fetch_ride_status(self.user))
+
+    def test_out_of_order_commit_callbacks_converge(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ride = Ride.objects.create(user=self.user)
+        active_rides.current(user=self.user)
+
+        callbacks = []
+        for status in ("ACCEPTED", "WAITING", "RIDE_START", "RIDE_END"):
+            with self.captureOnCommitCallbacks() as captured:
+                ride.driver, ride.ride_status = self.driver, status
+                ride.save()
+            callbacks.extend(captured)
+        for callback in reversed(callbacks):
+            callback()
+
+        self.assertEqual(ride.version, 5)
+        self.assertEqual(active_rides.current(user=self.user)[1]["status"], "RIDE_END")
+        self.assertEqual(active_rides.get_ride(driver=self.driver, statuses=["RIDE_END"]), ride)
+
+    def test_pooled_driver_moves_the_named_ride_or_the_first_stop(self):
+        first = Ride.objects.create(user=self.user, driver=self.driver, ride_status="ACCEPTED")
+        second = Ride.objects.create(user=self.user, driver=self.driver, ride_status="ACCEPTED")
+        RidePool.objects.create(
+            driver=self.driver,
+            stops=[{"ride": str(ride.pk), "kind": "PICKUP"} for ride in (first, second)],
+        )
+
+        # The newer ride is not the next stop.
+        self.assertEqual(active_rides.get_ride(driver=self.driver, statuses=["ACCEPTED"]), first)
+        self.assertEqual(active_rides.get_ride(driver=self.driver, statuses=["ACCEPTED"], ride_id=second.pk), second)
+        self.assertIsNone(active_rides.get_ride(driver=self.driver, statuses=["WAITING"], ride_id=second.pk))
+        self.assertIsNone(active_rides.current(driver=self.user, statuses=["ACCEPTED"], ride_id=first.pk))
+
+
+@override_settings(POOL_MAX_DETOUR_RATIO=0.5, POOL_MAX_ADDED_KM=3.0)
+class PoolingTests(SimpleTestCase):
+    def pool(self, latitude, longitude, seat_capacity=4):
+        rider = Ride(
+            user_pickup_latitude=latitude + 0.005,
+            user_pickup_longitude=longitude,
+            user_ride_end_latitude=latitude + 0.04,
+            user_ride_end_longitude=longitude,
+            seats=1,
+        )
+        return RidePool(
+            seat_capacity=seat_capacity,
+            current_latitude=latitude,
+            current_longitude=longitude,
+            stops=[pooling._stop(rider, "PICKUP"), pooling._stop(rider, "DROPOFF")],
+        )
+
+    def test_new_rider_is_inserted_on_the_way_into_the_nearest_trip(self):
+        near, far = self.pool(6.50, 3.30), self.pool(6.70, 3.50)
+        ride = Ride(
+            user_pickup_latitude=6.51, user_pickup_longitude=3.30,
+            user_ride_end_latitude=6.535, user_ride_end_longitude=3.30,
+            seats=1,
+        )
+        pickup, dropoff = (6.51, 3.30), (6.535, 3.30)
+
+        pool, pickup_after, dropoff_after, added_km = pooling.evaluate([far, near], pickup, dropoff)
+        self.assertIs(pool, near)
+        self.assertEqual((pickup_after, dropoff_after), (1, 1))
+        self.assertAlmostEqual(added_km, 0.0, places=6)
+        stops = pooling._insert(near.stops, ride, pickup_after, dropoff_after)
+        self.assertEqual(
+            [(stop["ride"] == str(ride.id), stop["kind"]) for stop in stops],
+            [(False, "PICKUP"), (True, "PICKUP"), (True, "DROPOFF"), (False, "DROPOFF")],
+        )
+
+    def test_full_or_distant_trips_are_not_offered(self):
+        pickup, dropoff = (6.51, 3.30), (6.535, 3.30)
+        self.assertIsNone(pooling.evaluate([self.pool(6.50, 3.30, seat_capacity=1), self.pool(6.70, 3.50)], pickup, dropoff))
+
+
+class VehicleRoutingTests(SimpleTestCase):
+    def test_solution_covers_every_stop_within_capacity(self):
+        rng = np.random.default_rng(3)
+        latitudes, longitudes = 6.52 + rng.normal(0, 0.05, 300), 3.37 + rng.normal(0, 0.05, 300)
+        demands = rng.integers(1, 6, 300).astype(float)
+        solution = vrp.solve(6.52, 3.37, latitudes, longitudes, demands, 20.0, time_budget=2.0, neighbours=10)
+
+        self.assertEqual(sorted(stop for route in solution.routes for stop in route), list(range(300)))
+        for route, load in zip(solution.routes, solution.loads):
+            self.assertAlmostEqual(load, demands[route].sum())
+            self.assertLessEqual(load, 20.0)
+        xy = vrp.project(latitudes, longitudes, 6.52)
+        depot = vrp.project([6.52], [3.37], 6.52)[0]
+        self.assertAlmostEqual(solution.distance_km, sum(vrp.route_length(xy, depot, route) for route in solution.routes))
+        # Far shorter than serving every stop on its own out-and-back trip.
+        self.assertLess(solution.distance_km, 0.5 * 2 * np.linalg.norm(xy - depot, axis=1).sum())
+
+
+class RideStatusReaderTests(RideUsersMixin, TestCase):
+    def test_projected_rows_match_the_serializer(self):
+        now = timezone.now()
+        rides = [
+            Ride.objects.create(user=self.user),
+            Ride.objects.create(
+                user=self.user,
+                driver=self.driver,
+                ride_status="RIDE_START",
+                user_pickup_latitude=6.52,
+                user_pickup_longitude=3.37,
+                user_pickup_address="14 Allen Avenue, Ikeja",
+                price=2500.5,
+                surge_multiplier=1.4,
+                ride_start_time=now,
+                scheduled_for=now - timedelta(hours=1, microseconds=5),
+            ),
+        ]
+        for time_zone in ("Africa/Lagos", "UTC"):
+            with override_settings(TIME_ZONE=time_zone), timezone.override(time_zone):
+                reader = RideStatusReader()
+                for ride in rides:
+                    data = reader.to_representation(reader.rows(pk=ride.pk).get())
+                    summary = {name: data.pop(name) for name in RideStatusReader.SUMMARY_FIELDS}
+                    expected = RideStatusSerializer(Ride.objects.get(pk=ride.pk)).data
+                    # Related keys come out as strings rather than UUIDs; both render the same.
+                    expected = {name: str(value) if isinstance(value, uuid.UUID) else value for name, value in expected.items()}
+                    self.assertEqual(data, expected)
+                    self.assertEqual(summary["driver_first_name"], "C" if ride.driver_id else None)
+                    self.assertIsNone(summary["vehicle_plate_number"])
+
+
+@override_settings(
+    ACTIVE_RIDE_CACHE="off",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "delta-tests"}},
+)
+class RideStatusDeltaTests(RideUsersMixin, TestCase):
+    def setUp(self):
+        active_rides.reset()
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        active_rides.reset()
+
+    def test_since_version_returns_only_the_changed_fields(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ride = Ride.objects.create(user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            ride.driver, ride.ride_status = self.driver, "ACCEPTED"
+            ride.save()
+
+        body = self.client.get("/v1/ride/ride_status/?since_version=1").json()
+        self.assertTrue(body["delta"])
+        self.assertEqual(body["ride_data"]["version"], 2)
+        self.assertEqual(body["ride_data"]["driver"], str(self.driver.pk))
+        self.assertNotIn("user", body["ride_data"])
+        self.assertEqual(self.client.get("/v1/ride/ride_status/?since_version=2").status_code, 304)
+        trimmed = self.client.get("/v1/ride/ride_status/?fields=ride_status").json()["ride_data"]
+        self.assertEqual(set(trimmed), {"id", "version", "ride_status"})
+
+
+class ETagTests(SimpleTestCase):
+    def test_tags_differ_by_requested_fields_and_delta_base(self):
+        def tag(query):
+            return etags.make(Request(APIRequestFactory().get(f"/v1/ride/ride_status/{query}")), "ride", 4)
+
+        self.assertEqual(tag("?fields=id,price"), tag("?fields=price,id"))
+        self.assertEqual(len({tag(""), tag("?fields=price"), tag("?since_version=3"), tag("?since_version=2")}), 4)
+
+
+@override_settings(DELIVERY_VEHICLE_CAPACITY_KG=10.0, DELIVERY_NEIGHBOURS=5)
+class DeliveryRouteTests(SimpleTestCase):
+    def test_routes_pick_up_every_package_before_dropping_it_off(self):
+        rng = random.Random(7)
+        rows = [
+            (
+                f"ride-{index}", "REGULAR", None,
+                6.52 + rng.uniform(-0.01, 0.01), 3.37 + rng.uniform(-0.01, 0.01),
+                6.52 + rng.uniform(-0.1, 0.1), 3.37 + rng.uniform(-0.1, 0.1),
+                rng.choice([1.0, 2.5, 4.0]),
+            )
+            for index in range(12)
+        ]
+        routes = delivery.plan_group(("REGULAR", "s1v", None), rows, time_budget=1.0)
+
+        self.assertEqual(sorted(ride for route in routes for ride in route.ride_ids), sorted(row[0] for row in rows))
+        for route in routes:
+            self.assertLessEqual(route.weight, 10.0)
+            order = [(stop["ride"], stop["kind"]) for stop in route.stops]
+            for ride in route.ride_ids:
+                self.assertLess(order.index((ride, "PICKUP")), order.index((ride, "DROPOFF")))
+            self.assertEqual(route.depot, (route.stops[0]["latitude"], route.stops[0]["longitude"]))
+            xy = vrp.project([stop["latitude"] for stop in route.stops], [stop["longitude"] for stop in route.stops], 6.52)
+            self.assertAlmostEqual(route.distance_km, vrp.path_length(xy), places=3)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "surge-engine-tests"}},
+    SURGE_MIN_DEMAND=3,
+    SURGE_SENSITIVITY=0.5,
+    SURGE_SMOOTHING=0.3,
+    SURGE_MAX_MULTIPLIER=3.0,
+)
+class SurgeEngineTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_raw_multiplier_needs_demand_and_is_capped(self):
+        self.assertEqual(surge.raw_multiplier(2, 0), 1.0)
+        self.assertEqual(surge.raw_multiplier(3, 6), 1.0)
+        self.assertEqual(surge.raw_multiplier(6, 2), 2.0)
+        self.assertEqual(surge.raw_multiplier(100, 1), 3.0)
+
+    def test_tick_smooths_busy_cells_and_leaves_quiet_ones_alone(self):
+        busy, quiet = surge.surge_cell(6.52, 3.37), surge.surge_cell(6.60, 3.50)
+        with mock.patch("time.time", return_value=1_700_000_000):
+            for _ in range(6):
+                surge.record_demand(6.52, 3.37)
+            surge.record_supply_many([("driver-1", 6.52, 3.37), ("driver-2", 6.52, 3.37), ("driver-3", 6.60, 3.50)])
+            engine = surge.SurgeEngine([busy, quiet])
+
+            self.assertEqual(engine.tick(), {busy: 1.3})
+            self.assertEqual(engine.tick(), {busy: 1.51})
+            self.assertEqual(surge.multiplier(6.52, 3.37), 1.51)
+            self.assertIsNone(cache.get(surge.MULTIPLIER_KEY.format(cell=quiet)))
+            self.assertEqual(surge.multiplier(6.60, 3.50), 1.0)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "surge-tests"}},
+    SURGE_WINDOW_SECONDS=300,
+    SURGE_BUCKET_SECONDS=30,
+)
+class SurgeSupplyTests(SimpleTestCase):
+    def test_a_driver_heartbeating_all_window_counts_once(self):
+        cell = surge.surge_cell(6.52, 3.37)
+        clock = 1_700_000_000
+        for step in range(0, 900, 5):
+            with mock.patch("time.time", return_value=clock + step):
+                surge.record_supply("driver-1", 6.52, 3.37)
+                surge.record_supply_many([("driver-1", 6.52, 3.37), ("driver-2", 6.52, 3.37)])
+                keys = [surge.SUPPLY_KEY.format(cell=cell, bucket=bucket) for bucket in surge._window_buckets()]
+                self.assertEqual(sum(cache.get_many(keys).values()), 2)
+
+
+class RideEventTests(RideUsersMixin, TestCase):
+    def test_transitions_are_logged_and_projected_once(self):
+        ride = Ride.objects.create(user=self.user)
+        ride.ride_feedback = "no transition"
+        ride.save()
+        ride = Ride.objects.get(pk=ride.pk)
+        for status in ("ACCEPTED", "WAITING", "RIDE_START", "RIDE_END", "PAID"):
+            ride.driver, ride.ride_status, ride.payable_amount = self.driver, status, 2500.0
+            ride.save()
+
+        events = list(RideEvent.objects.filter(ride=ride).values_list("from_status", "to_status", "version"))
+        self.assertEqual(
+            events,
+            [
+                (None, "PENDING", 1),
+                ("PENDING", "ACCEPTED", 3),
+                ("ACCEPTED", "WAITING", 4),
+                ("WAITING", "RIDE_START", 5),
+                ("RIDE_START", "RIDE_END", 6),
+                ("RIDE_END", "PAID", 7),
+            ],
+        )
+
+        later = timezone.now() + timedelta(minutes=1)
+        self.assertEqual(projections.catch_up(now=later)["driver_daily_stats"], 6)
+        self.assertEqual(projections.catch_up(now=later)["driver_daily_stats"], 0)
+        stats = DriverDailyStats.objects.get(driver_id=self.driver.pk)
+        self.assertEqual((stats.accepted, stats.completed, stats.earnings), (1, 1, 2500.0))
+        funnel = RideFunnelDaily.objects.get()
+        self.assertEqual((funnel.requested, funnel.accepted, funnel.paid, funnel.cancelled), (1, 1, 1, 0))
+
+    def test_a_backdated_later_event_does_not_skip_an_unsettled_earlier_one(self):
+        Ride.objects.create(user=self.user)
+        second = Ride.objects.create(user=self.user)
+        RideEvent.objects.filter(ride=second).update(occurred_at=timezone.now() - timedelta(hours=1))
+
+        # Only the second, higher-id event is past the cutoff yet.
+        self.assertEqual(projections.run(projections.PROJECTORS["ride_funnel_daily"]), 0)
+        later = timezone.now() + timedelta(minutes=1)
+        self.assertEqual(projections.catch_up(now=later)["ride_funnel_daily"], 2)
+        self.assertEqual(sum(RideFunnelDaily.objects.values_list("requested", flat=True)), 2)
+
+
+@override_settings(RIDE_EXPIRE_PENDING_MINUTES=15, RIDE_EXPIRE_ACCEPTED_MINUTES=45, RIDE_EXPIRY_BATCH=2)
+class RideExpiryTests(RideUsersMixin, TestCase):
+    def ride(self, minutes_ago, **fields):
+        ride = Ride.objects.create(user=self.user, **fields)
+        Ride.objects.filter(pk=ride.pk).update(updated_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return ride.pk
+
+    def test_only_rides_past_their_status_timeout_are_cancelled(self):
+        stale_pending = [self.ride(20), self.ride(30), self.ride(60)]
+        fresh_pending = self.ride(10)
+        stale_accepted = self.ride(50, driver=self.driver, ride_status="ACCEPTED")
+        fresh_accepted = self.ride(30, driver=self.driver, ride_status="ACCEPTED")
+        started = self.ride(90, driver=self.driver, ride_status="RIDE_START")
+
+        expired = expiry.expire()
+        # Oldest first, in batches of two.
+        self.assertEqual(expired, {"PENDING": stale_pending[::-1], "ACCEPTED": [stale_accepted]})
+        cancelled = Ride.objects.filter(ride_status="CANCELLED")
+        self.assertEqual(set(cancelled.values_list("pk", flat=True)), {*stale_pending, stale_accepted})
+        self.assertTrue(all(ride.is_completed and ride.cancelled_by == "NONE" and ride.version == 2 for ride in cancelled))
+        self.assertEqual(
+            dict(Ride.objects.filter(pk__in=[fresh_pending, fresh_accepted, started]).values_list("pk", "ride_status")),
+            {fresh_pending: "PENDING", fresh_accepted: "ACCEPTED", started: "RIDE_START"},
+        )
+        self.assertEqual(RideEvent.objects.filter(ride_id=stale_accepted).latest("version").to_status, "CANCELLED")
+        self.assertEqual(expiry.expire(), {"PENDING": [], "ACCEPTED": []})
+
+
+class EarningsRollupTests(RideUsersMixin, TestCase):
+    def test_paid_rides_are_rolled_up_once_and_backfilled(self):
+        ride = Ride.objects.create(user=self.user, driver=self.driver, ride_status="RIDE_END", payable_amount=2500.0)
+        ride.ride_status = "PAID"
+        ride.save(update_fields=["ride_status"])
+        ride.ride_feedback = "no transition"
+        ride.save()
+        # A ride closed before the rollups existed.
+        Ride.objects.create(user=self.user, driver=self.driver, ride_status="RIDE_END", payable_amount=1000.0)
+        Ride.objects.filter(ride_status="RIDE_END").update(ride_status="PAID")
+
+        self.assertEqual(earnings.backfill_batch(10), 1)
+        self.assertEqual(earnings.backfill_batch(10), 0)
+        self.assertEqual(EarningsRollup.objects.filter(person_id=self.driver.pk).count(), 3)
+        totals, periods = earnings.summary("RIDER", self.driver.pk, "WEEK", 4)
+        self.assertEqual((totals["completed"], totals["fares"]), (2, 3500.0))
+        self.assertEqual(len(periods), 4)
+        self.assertEqual(periods[0]["total"], 3500.0)
+        totals, _ = earnings.summary("USER", self.user.pk, "MONTH", 1)
+        self.assertEqual(totals["fares"], 3500.0)
+
+    def test_stale_copies_of_a_ride_count_it_once(self):
+        ride = Ride.objects.create(user=self.user, driver=self.driver, ride_status="RIDE_END", payable_amount=2500.0)
+        copies = [Ride.objects.get(pk=ride.pk) for _ in range(3)]
+        copies[0].ride_status = "PAID"
+        copies[0].save(update_fields=["ride_status"])
+        # Full saves of copies loaded before the claim neither count the ride again nor clear its flag.
+        for copy in copies[1:]:
+            copy.ride_status, copy.ride_feedback = "PAID", "late edit"
+            copy.save()
+
+        self.assertTrue(Ride.objects.get(pk=ride.pk).earnings_recorded)
+        self.assertEqual(earnings.backfill_batch(10), 0)
+        totals, _ = earnings.summary("RIDER", self.driver.pk, "DAY", 1)
+        self.assertEqual((totals["completed"], totals["fares"]), (1, 2500.0))
+
+
+class RatingTests(RideUsersMixin, TestCase):
+    def test_ratings_count_once_and_rebuild_matches(self):
+        rides = [Ride.objects.create(user=self.user, driver=self.driver, ride_status="PAID") for _ in range(3)]
+        for ride, score in zip(rides, (5, 3, 4)):
+            self.assertEqual(ratings.rate("RIDER", self.user, ride.pk, score), self.driver.pk)
+        self.assertIsNone(ratings.rate("RIDER", self.user, rides[0].pk, 1))
+        self.assertIsNone(ratings.rate("USER", self.user, rides[0].pk, 1))
+
+        live = User.objects.get(pk=self.driver.pk)
+        self.assertEqual((live.rating_count, live.rating_sum, live.rating), (3, 12, 4))
+        User.objects.filter(pk=self.driver.pk).update(rating_count=0, rating_sum=0, rating_weight=0.0, rating_weighted_sum=0.0)
+        after, changed = None, 0
+        while True:
+            after, count = ratings.rebuild_batch(after, 1)
+            changed += count
+            if after is None:
+                break
+        self.assertEqual(changed, 1)
+        rebuilt = User.objects.get(pk=self.driver.pk)
+        self.assertEqual((rebuilt.rating_count, rebuilt.rating_sum), (3, 12))
+        self.assertAlmostEqual(rebuilt.rating_average, live.rating_average)
+
+
+class QuoteTokenTests(RideUsersMixin, TestCase):
+    def setUp(self):
+        self.trip = {
+            "ride_type": "ECONOMY",
+            "vehicle_type": "RIDES",
+            "user_pickup_latitude": 6.45,
+            "user_pickup_longitude": 3.39,
+            "user_ride_end_latitude": 6.52,
+            "user_ride_end_longitude": 3.37,
+            "package_weight": 0.0,
+        }
+
+    def test_signed_quote_verifies_only_for_its_rider_trip_and_lifetime(self):
+        quote = quotes.price(self.user, self.trip)
+        token = quotes.sign(quote)
+        self.assertEqual(quotes.verify(token, self.user, self.trip)["price"], quote["price"])
+
+        other = User.objects.create(email="other@example.com", username="other", first_name="E", last_name="F")
+        with self.assertRaises(quotes.InvalidQuote):
+            quotes.verify(token, other, self.trip)
+        with self.assertRaises(quotes.InvalidQuote):
+            quotes.verify(token, self.user, {**self.trip, "ride_type": "LUXURY"})
+        with self.assertRaises(quotes.InvalidQuote):
+            quotes.verify(token[:-2] + ("AA" if token[-2:] != "AA" else "BB"), self.user, self.trip)
+        with self.assertRaises(quotes.InvalidQuote):
+            quotes.verify(token, self.user, self.trip, now=quote["expires_at"] + 1)
+
+
+class ScheduledRideTests(RideUsersMixin, TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.booking = Ride.objects.create(
+            user=self.user, ride_status="SCHEDULED", scheduled_for=timezone.now() + timedelta(hours=3)
+        )
+
+    def test_bookings_are_listed_apart_and_only_cancelled_by_id(self):
+        self.assertEqual(self.client.get("/v1/ride/ride_status/").status_code, 400)
+        bookings = self.client.get("/v1/ride/bookings/").json()["results"]
+        self.assertEqual([ride["id"] for ride in bookings], [str(self.booking.pk)])
+
+        ride = Ride.objects.create(user=self.user, ride_status="ACCEPTED")
+        self.assertEqual(self.client.get("/v1/ride/ride_status/").json()["ride_data"]["id"], str(ride.pk))
+        response = self.client.post(
+            "/v1/ride/cancel_ride_user/", {"cancelled_reason": "plans changed", "ride_id": str(self.booking.pk)}
+        )
+        self.assertEqual(response.status_code, 200)
+        ride.refresh_from_db()
+        self.booking.refresh_from_db()
+        self.assertEqual((ride.ride_status, self.booking.ride_status), ("ACCEPTED", "CANCELLED"))
+
+    def test_a_booking_due_during_a_ride_in_progress_is_cancelled_not_released(self):
+        ride = Ride.objects.create(user=self.user, ride_status="RIDE_START")
+        Ride.objects.filter(pk=self.booking.pk).update(scheduled_for=timezone.now())
+
+        self.assertEqual(scheduler.release_due(), [])
+        self.booking.refresh_from_db()
+        self.assertEqual((self.booking.ride_status, self.booking.cancelled_by), ("CANCELLED", "NONE"))
+        self.assertEqual(Ride.objects.filter(user=self.user, is_completed=False).get(), ride)
+
+    def test_release_keeps_the_quoted_price_of_a_locked_booking(self):
+        Ride.objects.filter(pk=self.booking.pk).update(
+            scheduled_for=timezone.now(), is_price_locked=True, price=4200.0, is_peak_hours=True, surge_multiplier=1.8
+        )
+        self.assertEqual(scheduler.release_due(), [self.booking])
+        self.booking.refresh_from_db()
+        self.assertEqual(
+            (self.booking.ride_status, self.booking.price, self.booking.is_peak_hours, self.booking.surge_multiplier),
+            ("PENDING", 4200.0, True, 1.8),
+        )
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "idempotency-tests"}}
+)
+class IdempotencyTests(RideUsersMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.ride = Ride.objects.create(user=self.user, driver=self.driver, ride_status="RIDE_END", payable_amount=2500.0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.driver)
+
+    def test_a_retried_payment_is_replayed_not_repeated(self):
+        first = self.client.post("/v1/ride/rider_cash_payment/", {"is_paid": True}, HTTP_IDEMPOTENCY_KEY="pay-1")
+        retry = self.client.post("/v1/ride/rider_cash_payment/", {"is_paid": True}, HTTP_IDEMPOTENCY_KEY="pay-1")
+
+        self.assertEqual((first.status_code, retry.status_code), (200, 200))
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertNotIn("Idempotent-Replayed", first)
+        self.assertEqual(RideEvent.objects.filter(ride=self.ride, to_status="PAID").count(), 1)
+
+        reused = self.client.post("/v1/ride/rider_cash_payment/", {"is_paid": False}, HTTP_IDEMPOTENCY_KEY="pay-1")
+        self.assertEqual(reused.status_code, 422)
@@ -3,8 +3,11 @@ from django.urls import include, path
 from ride import views
 
 rides = [
+    path("quote/", views.RideQuoteAPIView.as_view(), name="ride-quote"),
     path("ride/", views.CreateRideAPIView.as_view(), name="create-ride"),
     path("ride_status/", views.RideStatusAPIView.as_view(), name="ride-status"),
+    path("bookings/", views.ScheduledRidesAPIView.as_view(), name="scheduled-rides"),
+    path("autocomplete/", views.DestinationAutocompleteAPIView.as_view(), name="destination-autocomplete"),
     path("fetch_user_location/", views.FetchUserLocationAPIView.as_view(), name="fetch-user-location"),
     path("accept_ride/", views.AcceptRideAPIView.as_view(), name="accept-ride"),
     path("cancel_ride_user/", views.CancelRideByUserAPIView.as_view(), name="cancel-ride-user"),
@@ -13,6 +16,9 @@ rides = [
     path("start_ride_rider/", views.StartRideByRiderAPIView.as_view(), name="start-ride-rider"),
     path("end_ride_rider/", views.RideEndByRiderAPIView.as_view(), name="end-ride-rider"),
     path("rider_cash_payment/", views.CashPaymentByRiderAPIView.as_view(), name="collect-cash-payment-rider"),
+    path("rate_driver/", views.RateDriverAPIView.as_view(), name="rate-driver"),
+    path("rate_user/", views.RateUserAPIView.as_view(), name="rate-user"),
+    path("earnings/", views.EarningsSummaryAPIView.as_view(), name="earnings-summary"),
 
 ]
 
@@ -1,4 +1,7 @@
+from django.db import transaction
+from django.db.models import Count, Max
 from django.shortcuts import render
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import filters, generics, status
 from rest_framework.decorators import APIView
@@ -6,34 +9,63 @@ from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from core.helpers import etags, fieldsets, points
+from core.idempotency import IdempotentMixin
 from core.models import ConstantTable, User
 from core.permissions import (
-    AlreadyStartedRide, AcceptedRiderActiveRide, CancelUserActiveRide, CashPaymentActiveRide, EndRiderActiveRide, StartRiderActiveRide, UserHasNoActiveRide, UserIsActive, WaitingRiderActiveRide
+    AcceptedRiderActiveRide, CancelUserActiveRide, CashPaymentActiveRide, EndRiderActiveRide, StartRiderActiveRide, UserHasActiveRide, UserHasNoActiveRide, UserIsActive, WaitingRiderActiveRide
 )
+from core.views import CustomPagination
+from ride.helpers import active_rides, autocomplete, delivery, earnings, pooling, quotes, ratings, surge
 from ride.models import Ride
 from ride.serializer import (
-    AcceptRideSerializer, CancelUserRideSerializer, CashPaymentSerializer, CreateRideSerializer, EndRideSerializer, RideStatusSerializer, StartRideSerializer, WaitingRideSerializer
+    AcceptRideSerializer, CancelUserRideSerializer, CashPaymentSerializer, CreateRideSerializer, EndRideSerializer, RateRideSerializer, RideQuoteSerializer, RideStatusSerializer, StartRideSerializer, WaitingRideSerializer
 )
 from haversine import haversine, Unit
 from django.utils import timezone
 # Create your views here.
 
-class CreateRideAPIView(APIView):
-    permission_classes = [IsAuthenticated, UserIsActive, AlreadyStartedRide]
+# A driver on a pool or delivery route has several open rides; without it the first stop's ride moves.
+RIDE_ID_PARAMETER = openapi.Parameter(
+    "ride_id", openapi.IN_QUERY, description="The ride to move on, also accepted in the body", type=openapi.TYPE_STRING
+)
+
+
+class CreateRideAPIView(IdempotentMixin, APIView):
+    permission_classes = [IsAuthenticated, UserIsActive, UserHasActiveRide]
     """Start a Ride."""
 
     serializer_class = CreateRideSerializer
     @swagger_auto_schema(request_body=CreateRideSerializer, tags=['Rider/User'])
     def post(self, request):
         """Handle HTTP POST request."""
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(data=request.data, context={"request": request})
         serializer.is_valid(raise_exception=True)
-        current_time = timezone.localtime().time()
-        constant_table = ConstantTable.constant_table_instance(country_code=request.user.country_code)
-        is_peak_hours = constant_table.is_peak_hour(peak_hours=constant_table.peak_hours, current_time=current_time)
-        serializer["is_peak_hours"] = is_peak_hours
-        serializer["user"] = request.user
-        serializer.save()
+        if serializer.validated_data.get("ride_status") == "SCHEDULED":
+            # Unless quoted, surge and peak hours are priced when ride/helpers/scheduler.py releases the booking.
+            ride = serializer.save(user=request.user)
+            return Response(
+                {
+                    "status": True,
+                    "ride_id": ride.id,
+                    "message": "User has scheduled a ride successfully",
+                },
+                status=status.HTTP_200_OK,
+            )
+        pickup_latitude = serializer.validated_data.get("user_pickup_latitude")
+        pickup_longitude = serializer.validated_data.get("user_pickup_longitude")
+        if serializer.validated_data.get("is_price_locked"):
+            # Priced, peak hours and surge included, when the quote was issued.
+            ride = serializer.save(user=request.user)
+        else:
+            current_time = timezone.localtime().time()
+            constant_table = ConstantTable.constant_table_instance(country_code=request.user.country_code)
+            is_peak_hours = constant_table.is_peak_hour(peak_hours=constant_table.peak_hours, current_time=current_time)
+            surge_multiplier = surge.multiplier(pickup_latitude, pickup_longitude)
+            ride = serializer.save(user=request.user, is_peak_hours=is_peak_hours, surge_multiplier=surge_multiplier)
+        surge.record_demand(pickup_latitude, pickup_longitude)
+        if ride.is_pooled:
+            pooling.match(ride)
         return Response(
             {
                 "status": True,
@@ -43,6 +75,32 @@ class CreateRideAPIView(APIView):
         )
     
 
+class RideQuoteAPIView(APIView):
+    permission_classes = [IsAuthenticated, UserIsActive]
+    """Price a trip upfront; the returned quote_token locks the fare when the ride is created."""
+
+    serializer_class = RideQuoteSerializer
+    @swagger_auto_schema(request_body=RideQuoteSerializer, tags=['Rider/User'])
+    def post(self, request):
+        """Handle HTTP POST request."""
+        serializer = self.serializer_class(data=request.data, context={"request": request})
+        serializer.is_valid(raise_exception=True)
+        quote = quotes.price(request.user, serializer.validated_data)
+        return Response(
+            {
+                "status": True,
+                "message": "success",
+                "price": quote["price"],
+                "distance": quote["distance"],
+                "is_peak_hours": quote["is_peak_hours"],
+                "surge_multiplier": quote["surge_multiplier"],
+                "expires_at": quote["expires_at"],
+                "quote_token": quotes.sign(quote),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class RideStatusAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive]
     """Start a Ride."""
@@ -50,31 +108,141 @@ class RideStatusAPIView(APIView):
     @swagger_auto_schema(tags=['Rider/User'])
     def get(self, request):
         """Handle HTTP POST request."""
-        ride_status = Ride.fetch_ride_status(user=request.user)
-        if ride_status is None:
-            ride_status = False
-        else:
-            ride_status = True
-        
-        if ride_status is False:
+        fields = fieldsets.requested_fields(request)
+        since_version = fieldsets.since_version(request)
+        found = active_rides.current(user=request.user, statuses=active_rides.IN_PROGRESS_STATUSES)
+        if found is None or found[1]["data"] is None:
             return Response(
                 {
-                    "status": ride_status,
+                    "status": False,
                     "message": "User has no open ride",
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        ride_data = RideStatusSerializer(ride_status)
-        return Response(
+        ride_id, state = found
+        etag = etags.make(request, ride_id, state["data"].get("version"))
+        cached = etags.not_modified(request, etag)
+        if cached is not None:
+            return cached
+        ride_data = state["data"]
+        delta = False
+        if since_version is not None:
+            if since_version == ride_data.get("version"):
+                return Response(status=status.HTTP_304_NOT_MODIFIED)
+            base = active_rides.state_at(ride_id, since_version)
+            if base is not None:
+                ride_data, delta = fieldsets.changed(base, ride_data, keep=("id", "version")), True
+        ride_data = fieldsets.select(ride_data, fields, keep=("id", "version"))
+        if delta and ride_data.keys() <= {"id", "version"}:
+            # Only fields the client did not ask for changed.
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        response = Response(
             {
                 "status": True,
                 "message": "success",
-                "ride_data": ride_data.data
+                "delta": delta,
+                "ride_data": ride_data
             },
             status=status.HTTP_200_OK,
         )
+        return etags.tagged(response, etag)
     
 
+class ScheduledRidesAPIView(generics.ListAPIView):
+    permission_classes = [IsAuthenticated, UserIsActive]
+    pagination_class = CustomPagination
+    serializer_class = RideStatusSerializer
+
+    @swagger_auto_schema(
+        operation_description="Fetch the user's booked rides, soonest first",
+        tags=['Rider/User']
+    )
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return Ride.objects.filter(user=self.request.user, ride_status="SCHEDULED").order_by("scheduled_for", "id")
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        summary = queryset.aggregate(latest=Max("updated_at"), count=Count("id"))
+        etag = etags.make(request, request.user.pk, summary["latest"], summary["count"])
+        cached = etags.not_modified(request, etag)
+        if cached is not None:
+            return cached
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request)
+        serializer = self.get_serializer(page, many=True)
+        response_data = {
+            "count": paginator.page.paginator.count,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+            "results": serializer.data,
+        }
+        return etags.tagged(Response(response_data, status=status.HTTP_200_OK), etag)
+
+
+class DestinationAutocompleteAPIView(APIView):
+    permission_classes = [IsAuthenticated, UserIsActive]
+    """Suggest destinations for a partly typed address."""
+
+    @swagger_auto_schema(tags=['Rider/User'])
+    def get(self, request):
+        """Handle HTTP GET request."""
+        query = request.query_params.get("q", "")
+        try:
+            latitude = request.query_params.get("latitude")
+            longitude = request.query_params.get("longitude")
+            latitude = float(latitude) if latitude else None
+            longitude = float(longitude) if longitude else None
+            limit = min(max(int(request.query_params.get("limit", 8)), 1), 20)
+        except ValueError:
+            return Response({
+                "status": False,
+                "message": "invalid latitude, longitude or limit",
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {
+                "status": True,
+                "message": "success",
+                "suggestions": autocomplete.suggest(query, latitude, longitude, limit),
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class EarningsSummaryAPIView(APIView):
+    permission_classes = [IsAuthenticated, UserIsActive]
+    """Trips and money per day, week or month: earned as a driver, spent as a rider."""
+
+    @swagger_auto_schema(tags=['Driver', 'Rider/User'])
+    def get(self, request):
+        """Handle HTTP GET request."""
+        period = request.query_params.get("period", "DAY").upper()
+        try:
+            count = min(max(int(request.query_params.get("periods", 7)), 1), earnings.MAX_PERIODS)
+        except ValueError:
+            count = None
+        if period not in earnings.PERIODS or count is None:
+            return Response({
+                "status": False,
+                "message": f"period must be one of {', '.join(earnings.PERIODS)} and periods a number",
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        totals, periods = earnings.summary(request.user.user_type, request.user.pk, period, count)
+        return Response(
+            {
+                "status": True,
+                "message": "success",
+                "period": period,
+                "summary": totals,
+                "periods": periods,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
 class FetchUserLocationAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive]
     """Start a Ride."""
@@ -95,7 +263,7 @@ class FetchUserLocationAPIView(APIView):
         user_latitude = None
 
         if user.user_type == "USER":
-            get_ride = Ride.objects.filter(user=user, is_completed=False).first()
+            get_ride = active_rides.get_ride(user=user, statuses=active_rides.IN_PROGRESS_STATUSES)
             if get_ride is None:
                 return Response({
                     "status": False,
@@ -122,7 +290,7 @@ class FetchUserLocationAPIView(APIView):
         )
     
 
-class AcceptRideAPIView(APIView):
+class AcceptRideAPIView(IdempotentMixin, APIView):
     permission_classes = [IsAuthenticated, UserIsActive, UserHasNoActiveRide]
     """Accept a Ride."""
 
@@ -131,7 +299,7 @@ class AcceptRideAPIView(APIView):
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(user=request.user, ride_status="PENDING", is_completed=False).first()
+        opened_ride = active_rides.get_ride(user=request.user, statuses=["PENDING"])
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
@@ -149,15 +317,19 @@ class CancelRideByUserAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive, CancelUserActiveRide]
 
     serializer_class = CancelUserRideSerializer
-    @swagger_auto_schema(request_body=CancelUserRideSerializer, tags=['Rider/User'])
+    @swagger_auto_schema(request_body=CancelUserRideSerializer, tags=['Rider/User'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(user=request.user, ride_status__in=["ACCEPTED", "WAITING"], is_completed=False).first()
+        ride_id = active_rides.requested_id(request)
+        statuses = ["SCHEDULED", "ACCEPTED", "WAITING"] if ride_id else ["ACCEPTED", "WAITING"]
+        opened_ride = active_rides.get_ride(user=request.user, statuses=statuses, ride_id=ride_id)
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        pooling.advance(opened_ride)
+        delivery.advance(opened_ride)
         return Response(
             {
                 "status": True,
@@ -171,15 +343,19 @@ class CancelRideByRiderAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive, AcceptedRiderActiveRide]
 
     serializer_class = CancelUserRideSerializer
-    @swagger_auto_schema(request_body=CancelUserRideSerializer, tags=['Driver'])
+    @swagger_auto_schema(request_body=CancelUserRideSerializer, tags=['Driver'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status__in=["ACCEPTED", "WAITING"], is_completed=False).first()
+        opened_ride = active_rides.get_ride(
+            driver=request.user, statuses=["ACCEPTED", "WAITING"], ride_id=active_rides.requested_id(request)
+        )
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        pooling.advance(opened_ride)
+        delivery.advance(opened_ride)
         return Response(
             {
                 "status": True,
@@ -193,15 +369,19 @@ class WaitingRideByRiderAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive, WaitingRiderActiveRide]
 
     serializer_class = WaitingRideSerializer
-    @swagger_auto_schema(request_body=WaitingRideSerializer, tags=['Driver'])
+    @swagger_auto_schema(request_body=WaitingRideSerializer, tags=['Driver'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="ACCEPTED", is_completed=False).first()
+        opened_ride = active_rides.get_ride(
+            driver=request.user, statuses=["ACCEPTED"], ride_id=active_rides.requested_id(request)
+        )
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        pooling.advance(opened_ride)
+        delivery.advance(opened_ride)
         return Response(
             {
                 "status": True,
@@ -215,15 +395,19 @@ class StartRideByRiderAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive, StartRiderActiveRide]
 
     serializer_class = StartRideSerializer
-    @swagger_auto_schema(request_body=StartRideSerializer, tags=['Driver'])
+    @swagger_auto_schema(request_body=StartRideSerializer, tags=['Driver'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="WAITING", is_completed=False).first()
+        opened_ride = active_rides.get_ride(
+            driver=request.user, statuses=["WAITING"], ride_id=active_rides.requested_id(request)
+        )
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         serializer.save()
+        pooling.advance(opened_ride)
+        delivery.advance(opened_ride)
         return Response(
             {
                 "status": True,
@@ -237,11 +421,13 @@ class RideEndByRiderAPIView(APIView):
     permission_classes = [IsAuthenticated, UserIsActive, EndRiderActiveRide]
 
     serializer_class = EndRideSerializer
-    @swagger_auto_schema(request_body=EndRideSerializer, tags=['Driver'])
+    @swagger_auto_schema(request_body=EndRideSerializer, tags=['Driver'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="START_RIDE", is_completed=False).first()
+        opened_ride = active_rides.get_ride(
+            driver=request.user, statuses=["RIDE_START"], ride_id=active_rides.requested_id(request)
+        )
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
@@ -259,22 +445,43 @@ class RideEndByRiderAPIView(APIView):
         
         duration_seconds = duration.seconds
 
-        total_fare, point_discount, point_deducted, points_left = constant_table.calculate_fare(
-            country_code=opened_ride.user.country_code, 
-            ride_type=opened_ride.ride_type, 
-            distance=distance, 
-            duration=duration_seconds, 
-            is_peak_hours=opened_ride.is_peak_hours
-        )
-        
-        opened_ride.ride_distance = distance
-        opened_ride.payable_amount = total_fare
-        opened_ride.ride_duration = duration
-        opened_ride.point_amount = point_discount
-        opened_ride.save()
+        rider_constants = ConstantTable.constant_table_instance(country_code=opened_ride.user.country_code)
+        with transaction.atomic():
+            # Locks the rider's points against another redemption until the ride is saved.
+            available_points = points.balance(opened_ride.user_id, for_update=True) if opened_ride.use_points else 0
+            if opened_ride.is_price_locked:
+                # The upfront quote is the fare; only the points still have to be applied.
+                total_fare = opened_ride.price
+                point_discount, point_deducted, points_left = ConstantTable.redeem_points(total_fare, available_points)
+            else:
+                total_fare, point_discount, point_deducted, points_left = constant_table.calculate_fare(
+                    country_code=opened_ride.user.country_code, 
+                    ride_type=opened_ride.ride_type, 
+                    distance=distance, 
+                    duration=duration_seconds, 
+                    is_peak_hours=opened_ride.is_peak_hours,
+                    points=available_points,
+                    surge_multiplier=opened_ride.surge_multiplier,
+                    is_delivery=opened_ride.vehicle_type == "PACKAGE_DELIVERY",
+                    package_weight=opened_ride.package_weight,
+                    zone=opened_ride.pricing_zone,
+                )
+
+            opened_ride.ride_distance = distance
+            opened_ride.payable_amount = total_fare - point_discount
+            opened_ride.ride_duration = duration
+            opened_ride.point_amount = point_discount
+            opened_ride.save()
+            points.settle_ride(
+                opened_ride, redeemed=point_discount, earned=int(opened_ride.payable_amount * rider_constants.points_earn_rate)
+            )
+        pooling.advance(opened_ride)
+        delivery.advance(opened_ride)
 
-        if point_deducted:
-            pass
+        # The driver is free again at the drop-off point.
+        surge.record_supply(
+            request.user.id, opened_ride.driver_ride_end_latitude, opened_ride.driver_ride_end_longitude
+        )
 
         return Response(
             {
@@ -285,15 +492,17 @@ class RideEndByRiderAPIView(APIView):
         )
     
 
-class CashPaymentByRiderAPIView(APIView):
+class CashPaymentByRiderAPIView(IdempotentMixin, APIView):
     permission_classes = [IsAuthenticated, UserIsActive, CashPaymentActiveRide]
 
     serializer_class = CashPaymentSerializer
-    @swagger_auto_schema(request_body=CashPaymentSerializer, tags=['Driver'])
+    @swagger_auto_schema(request_body=CashPaymentSerializer, tags=['Driver'], manual_parameters=[RIDE_ID_PARAMETER])
     def post(self, request):
         """Handle HTTP POST request."""
 
-        opened_ride = Ride.objects.filter(driver=request.user, ride_status="END_RIDE", is_completed=False).first()
+        opened_ride = active_rides.get_ride(
+            driver=request.user, statuses=["RIDE_END"], ride_id=active_rides.requested_id(request)
+        )
 
         serializer = self.serializer_class(opened_ride, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
@@ -305,4 +514,48 @@ class CashPaymentByRiderAPIView(APIView):
                 "message": "Payment Completed",
             },
             status=status.HTTP_200_OK,
-        )
\ No newline at end of file
+        )
+
+
+class RateRideAPIView(APIView):
+    """Rate the other side of a paid ride, once: `rated` is RIDER (the driver) or USER."""
+
+    permission_classes = [IsAuthenticated, UserIsActive]
+    serializer_class = RateRideSerializer
+    rated = None
+
+    def post(self, request):
+        """Handle HTTP POST request."""
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        rated_id = ratings.rate(self.rated, request.user, data["ride_id"], data["rating"], data["feedback"] or None)
+        if rated_id is None:
+            return Response({
+                "status": False,
+                "message": "no paid ride of yours left to rate with this id",
+            }, status=status.HTTP_403_FORBIDDEN)
+
+        return Response(
+            {
+                "status": True,
+                "message": "Rating Submitted",
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class RateDriverAPIView(RateRideAPIView):
+    rated = "RIDER"
+
+    @swagger_auto_schema(request_body=RateRideSerializer, tags=['Rider/User'])
+    def post(self, request):
+        return super().post(request)
+
+
+class RateUserAPIView(RateRideAPIView):
+    rated = "USER"
+
+    @swagger_auto_schema(request_body=RateRideSerializer, tags=['Driver'])
+    def post(self, request):
+        return super().post(request)